@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Input-path benchmark: the old read() loop (new bytes object per chunk + carry
+concatenation) vs. readinto into a reused buffer vs. zero-copy mmap views.
+
+    python bench_input.py base.bin --chunk-sizes 4K,64K,1M,16M
+    python bench_input.py base.bin --work simhash --engine numpy --hash rolling
+
+For each reader and chunk size it prints MB/s and the peak Python allocation
+(tracemalloc, measured in a separate untimed pass).
+"""
+import argparse, os, time, tracemalloc, zlib
+
+from simhash_complete_chunked import (
+    ENGINES, HASH_FAMILIES, MmapReader, check_engine, iter_bytes_blocks_fh, iter_carry_chunks, parse_size,
+)
+
+class ReadOnly:
+    """Hides readinto() so iter_carry_chunks takes the old read() + concat path."""
+    def __init__(self, fh):
+        self.fh = fh
+
+    def read(self, size=-1):
+        return self.fh.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fh.close()
+
+READERS = {
+    "read": lambda path: ReadOnly(open(path, "rb")),
+    "readinto": lambda path: open(path, "rb"),
+    "mmap": lambda path: MmapReader(path),
+}
+
+def run_scan(fh, args, chunk_size):
+    crc = 0
+    for buf, _, fresh in iter_carry_chunks(fh, args.ngram - 1, chunk_size):
+        crc = zlib.crc32(buf[fresh:], crc)
+    return crc
+
+def run_simhash(fh, args, chunk_size):
+    recs = iter_bytes_blocks_fh(fh, bitlen=args.bitlen, n=args.ngram, block_size=args.block_bytes,
+                                chunk_size=chunk_size, engine=args.engine, feature_hash=args.feature_hash)
+    return [r["hash"] for r in recs]
+
+def measure(path, reader, work, args, chunk_size):
+    best = float("inf")
+    result = None
+    for _ in range(args.repeat):
+        with READERS[reader](path) as fh:
+            t0 = time.perf_counter()
+            result = work(fh, args, chunk_size)
+            best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    with READERS[reader](path) as fh:
+        work(fh, args, chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the bytes-mode input paths.")
+    ap.add_argument("path", help="Plain (uncompressed) file to read")
+    ap.add_argument("--chunk-sizes", default="64K,1M,16M", help="Comma-separated chunk sizes (default: 64K,1M,16M)")
+    ap.add_argument("--work", choices=["scan", "simhash"], default="scan",
+                    help="scan: crc32 over every chunk; simhash: full block SimHash (default: scan)")
+    ap.add_argument("--repeat", type=int, default=3, help="Timed runs per cell; the best one is reported")
+    ap.add_argument("--bitlen", type=int, default=128)
+    ap.add_argument("--ngram", type=int, default=7)
+    ap.add_argument("--block-size", default="64K")
+    ap.add_argument("--engine", choices=ENGINES, default="numpy")
+    ap.add_argument("--hash", dest="feature_hash", choices=HASH_FAMILIES, default="rolling")
+    args = ap.parse_args()
+    check_engine(args.engine)
+    args.block_bytes = parse_size(args.block_size)
+    work = run_scan if args.work == "scan" else run_simhash
+
+    size = os.path.getsize(args.path)
+    print(f"{'reader':<10}{'chunk':>10}{'MB/s':>10}{'peak alloc':>14}")
+    for cs in args.chunk_sizes.split(","):
+        chunk_size = parse_size(cs)
+        results = set()
+        for reader in READERS:
+            secs, peak, result = measure(args.path, reader, work, args, chunk_size)
+            results.add(repr(result))
+            print(f"{reader:<10}{cs:>10}{size / secs / 1e6:>10.1f}{peak / 1024:>12.0f}K")
+        if len(results) != 1:
+            raise SystemExit("readers disagree on the output")
+
+if __name__ == "__main__":
+    main()
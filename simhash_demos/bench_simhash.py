@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for simhash_bytes, simhash_text and simhash_bytes_blocks.
+
+Generates a reproducible dataset (the README's base.bin / modified.bin recipe,
+scaled and seeded: random data, in-place overwrites, an insert, .gz/.bz2/.xz
+copies, and a Zipf-distributed text corpus), then times every cell of the
+bitlen/ngram/step/block-size grid and prints JSON with MB/s, features/s and
+the peak RSS of the process that ran the cell.
+
+    python bench_simhash.py --engines numpy --bitlen 64,128 --ngram 5,7 --block-size 64K,1M > bench.json
+    python bench_simhash.py --datasets base.bin,base.bin.xz,corpus.txt --baseline bench.json --tolerance 0.15
+
+Each cell runs in a fresh process (so peak RSS is its own), best of --repeat.
+With --baseline, cells more than --tolerance slower than the stored run (or
+with a different fingerprint) are reported and the exit status is 1.
+"""
+import argparse, bz2, gzip, hashlib, itertools, json, lzma, multiprocessing, os, platform, random, sys, time
+
+from simhash_complete_chunked import (
+    ENGINES, HASH_FAMILIES, WORD_RE, np, parse_size, simhash_bytes, simhash_bytes_blocks, simhash_text,
+    to_fixed_hex,
+)
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+DATASET_VERSION = 1
+BYTES_SETS = ("base.bin", "overwrite.bin", "insert.bin", "base.bin.gz", "base.bin.bz2", "base.bin.xz")
+TEXT_SETS = ("corpus.txt", "corpus.txt.gz")
+README_SIZE = 2 << 20   # offsets of the README recipe are for a 2 MiB base.bin
+
+# ---------- dataset ----------
+def _overwrite(data, rng, size):
+    """The README's dd loop: 2 KiB of fresh random bytes at three offsets (scaled to the file size)."""
+    out = bytearray(data)
+    for off in (262144, 983040, 1572864):
+        off = off * size // README_SIZE
+        out[off:off + 2048] = rng.randbytes(len(out[off:off + 2048]))
+    return bytes(out)
+
+def _insert(data, rng, size):
+    """4 KiB of random bytes inserted at 1/8 of the file: every later byte shifts."""
+    off = 262144 * size // README_SIZE
+    return data[:off] + rng.randbytes(4096) + data[off:]
+
+def make_corpus(rng, size):
+    """Lines of words drawn from a Zipf-like vocabulary, so common n-grams repeat as in real text."""
+    vocab = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+             for _ in range(20000)]
+    weights = [1 / (r + 1) for r in range(len(vocab))]
+    lines, total = [], 0
+    while total < size:
+        line = " ".join(rng.choices(vocab, weights, k=rng.randint(5, 20))) + "\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+def make_dataset(root, size, text_size, seed):
+    """Write the dataset into root unless a manifest with the same parameters is already there."""
+    manifest = {"version": DATASET_VERSION, "size": size, "text_size": text_size, "seed": seed}
+    mpath = os.path.join(root, "manifest.json")
+    try:
+        with open(mpath) as f:
+            if json.load(f) == manifest:
+                return
+    except (OSError, ValueError):
+        pass
+    os.makedirs(root, exist_ok=True)
+    rng = random.Random(seed)
+    base = rng.randbytes(size)
+    corpus = make_corpus(rng, text_size)
+    files = {
+        "base.bin": base,
+        "overwrite.bin": _overwrite(base, rng, size),
+        "insert.bin": _insert(base, rng, size),
+        "base.bin.gz": gzip.compress(base, mtime=0),
+        "base.bin.bz2": bz2.compress(base),
+        "base.bin.xz": lzma.compress(base),
+        "corpus.txt": corpus,
+        "corpus.txt.gz": gzip.compress(corpus, mtime=0),
+    }
+    for name, data in files.items():
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(data)
+    with open(mpath, "w") as f:
+        json.dump(manifest, f)
+
+def plain_size(path):
+    if path.endswith((".gz", ".bz2", ".xz")):
+        opener = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}[path.rsplit(".", 1)[1]]
+        with opener(path, "rb") as f:
+            return sum(len(b) for b in iter(lambda: f.read(1 << 20), b""))
+    return os.path.getsize(path)
+
+def count_tokens(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return len(WORD_RE.findall(f.read().decode("utf-8", "surrogateescape")))
+
+# ---------- cells ----------
+def _run(cell):
+    """Time one cell (in a fresh process): best of cell["repeat"] runs, plus peak RSS and the output."""
+    path, work = cell["path"], cell["work"]
+    kw = dict(bitlen=cell["bitlen"], engine=cell["engine"], feature_hash=cell["hash"])
+    best, out = float("inf"), None
+    for _ in range(cell["repeat"]):
+        t0 = time.perf_counter()
+        if work == "bytes":
+            out = [simhash_bytes(path, n=cell["ngram"], step=cell["step"], **kw)]
+        elif work == "blocks":
+            out = [r["hash"] for r in simhash_bytes_blocks(path, n=cell["ngram"], step=cell["step"],
+                                                           block_size=cell["block_size"], **kw)]
+        else:
+            out = [simhash_text(path, ngram=cell["ngram"], **kw)]
+        best = min(best, time.perf_counter() - t0)
+    rss = None
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = rss // 1024 if sys.platform == "darwin" else rss     # bytes on macOS, KiB elsewhere
+    digest = hashlib.blake2b(" ".join(to_fixed_hex(h, cell["bitlen"]) for h in out).encode(), digest_size=8)
+    return best, rss, digest.hexdigest()
+
+def iter_cells(args, root):
+    grid = itertools.product(args.datasets, args.work, args.engines, args.hashes, args.bitlens, args.ngrams)
+    for name, work, engine, fh, bitlen, ngram in grid:
+        if (work == "text") != (name in TEXT_SETS):
+            continue
+        steps = [1] if work == "text" else args.steps
+        sizes = args.block_sizes if work == "blocks" else [None]
+        for step, bs in itertools.product(steps, sizes):
+            yield {"dataset": name, "path": os.path.join(root, name), "work": work, "engine": engine, "hash": fh,
+                   "bitlen": bitlen, "ngram": ngram, "step": step, "block_size": bs, "repeat": args.repeat}
+
+def _key(r):
+    return tuple(r[k] for k in ("dataset", "work", "engine", "hash", "bitlen", "ngram", "step", "block_size"))
+
+def compare(results, baseline, tolerance):
+    """Lines describing cells slower than baseline by more than tolerance, or with different output."""
+    old = {_key(r): r for r in baseline["results"]}
+    problems = []
+    for r in results:
+        b = old.get(_key(r))
+        if b is None:
+            continue
+        if r["output"] != b["output"]:
+            problems.append(f"output changed: {_key(r)}")
+        elif r["mb_s"] < b["mb_s"] * (1 - tolerance):
+            problems.append(f"{(1 - r['mb_s'] / b['mb_s']) * 100:.0f}% slower ({b['mb_s']:.1f} -> {r['mb_s']:.1f} MB/s): "
+                            f"{_key(r)}")
+    return problems
+
+def _list(conv):
+    return lambda s: [conv(x) for x in s.split(",") if x]
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the SimHash entry points over a synthetic dataset.")
+    ap.add_argument("--data", default="bench-data", help="Dataset directory (created/refreshed; default: bench-data)")
+    ap.add_argument("--size", default="8M", help="Size of base.bin and its variants (default: 8M)")
+    ap.add_argument("--text-size", default="4M", help="Size of corpus.txt (default: 4M)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--datasets", type=_list(str), default=["base.bin", "base.bin.gz", "corpus.txt"],
+                    help=f"Comma-separated, from {', '.join(BYTES_SETS + TEXT_SETS)} "
+                         "(default: base.bin,base.bin.gz,corpus.txt)")
+    ap.add_argument("--work", type=_list(str), default=["bytes", "blocks", "text"],
+                    help="Entry points: bytes (simhash_bytes), blocks (simhash_bytes_blocks), text (simhash_text)")
+    ap.add_argument("--engines", type=_list(str), default=["numpy" if np is not None else "python"],
+                    help=f"Comma-separated, from {', '.join(ENGINES)} (default: numpy if installed, else python)")
+    ap.add_argument("--hashes", type=_list(str), default=list(HASH_FAMILIES))
+    ap.add_argument("--bitlen", dest="bitlens", type=_list(int), default=[64, 128])
+    ap.add_argument("--ngram", dest="ngrams", type=_list(int), default=[5])
+    ap.add_argument("--step", dest="steps", type=_list(int), default=[1])
+    ap.add_argument("--block-size", dest="block_sizes", type=_list(parse_size), default=[64 << 10])
+    ap.add_argument("--repeat", type=int, default=3, help="Timed runs per cell; the best one is reported")
+    ap.add_argument("--out", default=None, help="Write the JSON report here instead of stdout")
+    ap.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="With --baseline: allowed slowdown as a fraction (default: 0.2)")
+    args = ap.parse_args()
+    for name in args.datasets:
+        if name not in BYTES_SETS + TEXT_SETS:
+            ap.error(f"unknown dataset {name!r}")
+    for opt, values, allowed in (("--work", args.work, ("bytes", "blocks", "text")), ("--engines", args.engines, ENGINES),
+                                 ("--hashes", args.hashes, HASH_FAMILIES)):
+        for v in values:
+            if v not in allowed:
+                ap.error(f"{opt}: unknown value {v!r}")
+    if "numpy" in args.engines and np is None:
+        ap.error("engine 'numpy' requires NumPy: pip install numpy")
+
+    make_dataset(args.data, parse_size(args.size), parse_size(args.text_size), args.seed)
+    sizes = {name: plain_size(os.path.join(args.data, name)) for name in args.datasets}
+    tokens = {name: count_tokens(os.path.join(args.data, name)) for name in args.datasets if name in TEXT_SETS}
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for cell in iter_cells(args, args.data):
+        with ctx.Pool(1) as pool:
+            secs, rss, output = pool.apply(_run, (cell,))
+        size = sizes[cell["dataset"]]
+        if cell["work"] == "text":
+            features = max(0, tokens[cell["dataset"]] - cell["ngram"] + 1)
+        else:
+            features = max(0, (size - cell["ngram"]) // cell["step"] + 1)
+        res = {k: v for k, v in cell.items() if k not in ("path", "repeat")}
+        res.update(seconds=round(secs, 4), mb_s=round(size / secs / 1e6, 2),
+                   features_s=round(features / secs), peak_rss_kb=rss, output=output)
+        results.append(res)
+        print(f"{res['work']:<7}{res['dataset']:<15}{res['engine']:<7}{res['hash']:<8}bitlen={res['bitlen']:<4}"
+              f"ngram={res['ngram']:<3}step={res['step']:<3}block={res['block_size'] or '-':<9}"
+              f"{res['mb_s']:>9.1f} MB/s{res['peak_rss_kb'] or 0:>10} KiB", file=sys.stderr)
+
+    report = {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__ if np is not None else None,
+                 "platform": platform.platform(), "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "dataset": {"size": parse_size(args.size), "text_size": parse_size(args.text_size),
+                             "seed": args.seed, "version": DATASET_VERSION}},
+        "results": results,
+    }
+    text = json.dumps(report, indent=1)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for p in problems:
+            print(f"regression: {p}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Accuracy vs. throughput of SimHash parameter settings.
+
+Builds a seeded corpus of documents (random bytes, the Zipf text corpus of
+bench_simhash, or slices of --input files), derives mutated copies of every
+document per mutation profile, and for every cell of the hash/bitlen/ngram/
+step/block-size grid measures hashing MB/s and the Hamming distances of
+near-duplicate pairs (document vs. its mutated copy) and unrelated pairs
+(mutated copy vs. the next document). One table row per cell and profile has
+the distance quantiles and precision/recall when pairs within k count as
+duplicates, for each --k; the last line names the fastest cell that meets
+--target-recall and --target-precision on every profile with a single k.
+
+    python eval_simhash.py --hashes blake2b,rolling --bitlen 64,128 --ngram 5,7 --k 2,3,4,6,8
+    python eval_simhash.py --kind text --modes bytes,text --ngram 3,5 --profile mixed:overwrite=0.01,insert=0.01
+    python eval_simhash.py --block-size 0,4K --chunking fixed,cdc --profile insert=0.02 --json > eval.json
+
+A profile is [NAME:]KIND=RATE,... with KIND one of overwrite (fresh bytes in
+place), insert, delete and reorder (a piece cut out and put back elsewhere);
+RATE is the fraction of the document's bytes touched, in --edit-size pieces
+(at least one piece per kind). Fresh bytes are taken from elsewhere in the
+corpus. With --block-size, a pair's distance is the median over the first
+document's blocks of the distance to the nearest block of the second (blocks
+are bytes mode only). Precision assumes as many duplicate as unrelated pairs.
+Needs NumPy.
+"""
+import argparse, itertools, json, os, platform, random, sys, time
+
+from bench_simhash import make_corpus
+from simhash_complete_chunked import (
+    CHUNKINGS, HASH_FAMILIES, BufferReader, check_engine, hamming_many_to_many, iter_bytes_blocks_fh, np,
+    open_binary, pack_hashes, parse_size, popcount_np, simhash_many,
+)
+
+MUTATIONS = ("overwrite", "insert", "delete", "reorder")
+DEFAULT_PROFILES = ("overwrite=0.01", "insert=0.01", "delete=0.01", "reorder=0.05",
+                    "mixed:overwrite=0.005,insert=0.005,delete=0.005,reorder=0.02")
+
+# ---------- corpus ----------
+def parse_profile(spec):
+    """'[NAME:]KIND=RATE,...' -> (name, {kind: rate})."""
+    name, _, body = spec.rpartition(":")
+    rates = {}
+    for part in body.split(","):
+        kind, eq, rate = part.partition("=")
+        if kind not in MUTATIONS or not eq:
+            raise ValueError(f"bad mutation {part!r} in profile {spec!r} (KIND=RATE, KIND one of {', '.join(MUTATIONS)})")
+        rates[kind] = float(rate)
+        if not 0 <= rates[kind] <= 1:
+            raise ValueError(f"rate out of [0, 1] in profile {spec!r}")
+    return name or body, rates
+
+def make_docs(kind, count, size, seed, inputs=()):
+    """count documents of size bytes: random bytes, Zipf text, or consecutive slices of the input files."""
+    rng = random.Random(seed)
+    if inputs:
+        data, want = [], count * size
+        for path in inputs:
+            with open_binary(path) as fh:
+                data.append(fh.read(want))
+            want -= len(data[-1])
+            if want <= 0:
+                break
+        data = b"".join(data)
+        return [data[i:i + size] for i in range(0, len(data) - size + 1, size)]
+    if kind == "bytes":
+        return [rng.randbytes(size) for _ in range(count)]
+    corpus = make_corpus(rng, count * size)
+    return [corpus[i * size:(i + 1) * size] for i in range(count)]
+
+def mutate(doc, rates, edit_size, rng, pool):
+    """A copy of doc with each kind of edit applied at its rate; fresh bytes come from random offsets of pool."""
+    out = bytearray(doc)
+    for kind in MUTATIONS:
+        rate = rates.get(kind, 0)
+        if not rate:
+            continue
+        for _ in range(max(1, round(rate * len(doc) / edit_size))):
+            size = min(edit_size, len(out))
+            off = rng.randrange(len(out) - size + 1)
+            if kind == "overwrite":
+                src = rng.randrange(len(pool) - size + 1)
+                out[off:off + size] = pool[src:src + size]
+            elif kind == "insert":
+                src = rng.randrange(len(pool) - size + 1)
+                out[off:off] = pool[src:src + size]
+            elif kind == "delete":
+                del out[off:off + size]
+            else:
+                piece = out[off:off + size]
+                del out[off:off + size]
+                to = rng.randrange(len(out) + 1)
+                out[to:to] = piece
+    return bytes(out)
+
+# ---------- cells ----------
+def iter_cells(args):
+    grid = itertools.product(args.modes, args.hashes, args.bitlens, args.ngrams, args.steps, args.block_sizes)
+    for mode, fh, bitlen, ngram, step, bs in grid:
+        if mode == "text" and (bs or step != 1):
+            continue
+        for chunking in args.chunkings if bs else [None]:
+            yield {"mode": mode, "hash": fh, "bitlen": bitlen, "ngram": ngram, "step": step if mode == "bytes" else 1,
+                   "block_size": bs or None, "chunking": chunking}
+
+def fingerprints(docs, cell):
+    """(N, lanes) packed document fingerprints, or with a block size one packed array of block hashes per document."""
+    if not cell["block_size"]:
+        return simhash_many(docs, mode=cell["mode"], bitlen=cell["bitlen"], ngram=cell["ngram"], step=cell["step"],
+                            feature_hash=cell["hash"])
+    return [pack_hashes([r["hash"] for r in iter_bytes_blocks_fh(BufferReader(d), bitlen=cell["bitlen"], n=cell["ngram"],
+                                                                step=cell["step"], block_size=cell["block_size"],
+                                                                engine="numpy", feature_hash=cell["hash"],
+                                                                chunking=cell["chunking"])], cell["bitlen"])
+            for d in docs]
+
+def pair_distances(x, y, blocks):
+    """Distance of x[i] to y[i] for every i (see the module docstring for block fingerprints)."""
+    if not blocks:
+        return popcount_np(x ^ y).sum(axis=1, dtype=np.int64)
+    out = []
+    for a, b in zip(x, y):
+        best = np.sort(hamming_many_to_many(a, b).min(axis=1))
+        out.append(int(best[(len(best) - 1) // 2]))
+    return np.array(out, dtype=np.int64)
+
+def histogram(d):
+    values, counts = np.unique(d, return_counts=True)
+    return {int(v): int(c) for v, c in zip(values, counts)}
+
+def quantile(d, q):
+    return int(np.sort(d)[min(len(d) - 1, int(q * len(d)))])
+
+def precision_recall(pos, neg, k):
+    tp, fp = int((pos <= k).sum()), int((neg <= k).sum())
+    return (tp / (tp + fp) if tp + fp else 1.0), tp / len(pos)
+
+def evaluate(cell, base, variants, args):
+    """Result dict of one cell: MB/s over all documents, and per profile the distance histograms and P/R per k."""
+    blocks = bool(cell["block_size"])
+    nbytes = sum(map(len, base)) + sum(len(d) for docs in variants.values() for d in docs)
+    best = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        fb = fingerprints(base, cell)
+        fv = {name: fingerprints(docs, cell) for name, docs in variants.items()}
+        best = min(best, time.perf_counter() - t0)
+    others = fb[1:] + fb[:1] if blocks else np.roll(fb, -1, axis=0)
+    res = dict(cell, seconds=round(best, 4), mb_s=round(nbytes / best / 1e6, 2), profiles={})
+    for name, f in fv.items():
+        pos, neg = pair_distances(f, fb, blocks), pair_distances(f, others, blocks)
+        res["profiles"][name] = {
+            "positive": histogram(pos), "negative": histogram(neg),
+            "pos_quantiles": [quantile(pos, 0.5), quantile(pos, 0.9), int(pos.max())],
+            "neg_quantiles": [int(neg.min()), quantile(neg, 0.1), quantile(neg, 0.5)],
+            "k": {k: dict(zip(("precision", "recall"), map(lambda v: round(v, 4), precision_recall(pos, neg, k))))
+                  for k in args.ks},
+        }
+    res["k_ok"] = next((k for k in args.ks if all(p["k"][k]["recall"] >= args.target_recall and
+                                                  p["k"][k]["precision"] >= args.target_precision
+                                                  for p in res["profiles"].values())), None)
+    return res
+
+def choose(results):
+    """The fastest cell that meets the targets (fewer bits on ties), or None."""
+    ok = [r for r in results if r["k_ok"] is not None]
+    return max(ok, key=lambda r: (r["mb_s"], -r["bitlen"])) if ok else None
+
+def _cell_text(r):
+    block = "-" if not r["block_size"] else f"{r['block_size']}/{r['chunking']}"
+    return f"{r['mode']:<6}{r['hash']:<8}{r['bitlen']:<7}{r['ngram']:<6}{r['step']:<5}{block:<12}"
+
+def format_table(results, ks):
+    w = max([len("profile")] + [len(name) for r in results for name in r["profiles"]]) + 2
+    lines = [f"{'mode':<6}{'hash':<8}{'bits':<7}{'ngram':<6}{'step':<5}{'block':<12}{'MB/s':>8}  {'profile':<{w}}"
+             f"{'pos p50/p90/max':<17}{'neg min/p10/p50':<17}" + "".join(f"{'k=' + str(k) + ' P/R':<13}" for k in ks)]
+    for r in results:
+        for name, p in r["profiles"].items():
+            pr = "".join(f"{p['k'][k]['precision']:.2f}/{p['k'][k]['recall']:<8.2f}" for k in ks)
+            lines.append(f"{_cell_text(r)}{r['mb_s']:>8.1f}  {name:<{w}}{'/'.join(map(str, p['pos_quantiles'])):<17}"
+                         f"{'/'.join(map(str, p['neg_quantiles'])):<17}{pr}")
+    return "\n".join(lines)
+
+def _list(conv):
+    return lambda s: [conv(x) for x in s.split(",") if x]
+
+def main():
+    ap = argparse.ArgumentParser(description="Precision/recall and MB/s of SimHash settings on a mutated corpus.")
+    ap.add_argument("--kind", choices=["bytes", "text"], default="bytes",
+                    help="Corpus: random bytes or Zipf-distributed text (default: bytes)")
+    ap.add_argument("--input", action="append", default=[], metavar="PATH",
+                    help="Cut the corpus from these files instead (repeatable; plain or .gz/.bz2/.xz)")
+    ap.add_argument("--docs", type=int, default=100, help="Documents in the corpus (default: 100)")
+    ap.add_argument("--doc-size", default="16K", help="Bytes per document (default: 16K)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--profile", action="append", default=[], metavar="[NAME:]KIND=RATE,...",
+                    help=f"Mutation profile (repeatable; default: {' '.join(DEFAULT_PROFILES)})")
+    ap.add_argument("--edit-size", default="256", help="Bytes per overwrite/insert/delete/moved piece (default: 256)")
+    ap.add_argument("--modes", type=_list(str), default=["bytes"], help="Comma-separated, from bytes, text")
+    ap.add_argument("--hashes", type=_list(str), default=list(HASH_FAMILIES))
+    ap.add_argument("--bitlen", dest="bitlens", type=_list(int), default=[64, 128])
+    ap.add_argument("--ngram", dest="ngrams", type=_list(int), default=[5, 7])
+    ap.add_argument("--step", dest="steps", type=_list(int), default=[1])
+    ap.add_argument("--block-size", dest="block_sizes", type=_list(parse_size), default=[0],
+                    help="Comma-separated; 0 = whole-document fingerprints (default: 0)")
+    ap.add_argument("--chunking", dest="chunkings", type=_list(str), default=["fixed"],
+                    help=f"With a block size: comma-separated, from {', '.join(CHUNKINGS)} (default: fixed)")
+    ap.add_argument("--k", dest="ks", type=_list(int), default=[2, 3, 4, 6, 8, 12],
+                    help="Distance thresholds to report (default: 2,3,4,6,8,12)")
+    ap.add_argument("--target-recall", type=float, default=0.95)
+    ap.add_argument("--target-precision", type=float, default=0.99)
+    ap.add_argument("--repeat", type=int, default=1, help="Timed runs per cell; the best one is reported")
+    ap.add_argument("--json", action="store_true", help="Print the full report (with distance histograms) as JSON")
+    args = ap.parse_args()
+    try:
+        check_engine("numpy")
+        profiles = dict(parse_profile(s) for s in args.profile or DEFAULT_PROFILES)
+        doc_size, edit_size = parse_size(args.doc_size), parse_size(args.edit_size)
+        if edit_size < 1 or doc_size < edit_size:
+            raise ValueError("need 1 <= --edit-size <= --doc-size")
+    except (RuntimeError, ValueError) as e:
+        ap.error(str(e))
+    for opt, values, allowed in (("--modes", args.modes, ("bytes", "text")), ("--hashes", args.hashes, HASH_FAMILIES),
+                                 ("--chunking", args.chunkings, CHUNKINGS)):
+        for v in values:
+            if v not in allowed:
+                ap.error(f"{opt}: unknown value {v!r}")
+
+    base = make_docs(args.kind, args.docs, doc_size, args.seed, args.input)
+    if len(base) < 2:
+        ap.error("the corpus needs at least two documents (more --input data or a smaller --doc-size)")
+    pool = b"".join(base)
+    variants = {}
+    for name, rates in profiles.items():
+        rng = random.Random(f"{args.seed}:{name}")
+        variants[name] = [mutate(d, rates, edit_size, rng, pool) for d in base]
+
+    results = []
+    for cell in iter_cells(args):
+        res = evaluate(cell, base, variants, args)
+        results.append(res)
+        print(f"{_cell_text(res)}{res['mb_s']:>8.1f} MB/s  k={res['k_ok'] if res['k_ok'] is not None else '-'}",
+              file=sys.stderr)
+    best = choose(results)
+    if args.json:
+        print(json.dumps({
+            "meta": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                     "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "corpus": {"kind": "files" if args.input else args.kind, "docs": len(base), "doc_size": doc_size,
+                                "seed": args.seed, "edit_size": edit_size, "profiles": profiles},
+                     "target": {"recall": args.target_recall, "precision": args.target_precision}},
+            "results": results,
+            "choice": None if best is None else {k: best[k] for k in ("mode", "hash", "bitlen", "ngram", "step",
+                                                                      "block_size", "chunking", "mb_s", "k_ok")},
+        }, indent=1))
+        return
+    print(format_table(results, args.ks))
+    target = f"recall >= {args.target_recall}, precision >= {args.target_precision} on every profile"
+    if best is None:
+        print(f"no setting meets {target}; try larger --k values, more bits or shorter n-grams")
+    else:
+        opts = f"--mode {best['mode']} --hash {best['hash']} --bitlen {best['bitlen']} --ngram {best['ngram']}"
+        if best["mode"] == "bytes":
+            opts += f" --step {best['step']}"
+        if best["block_size"]:
+            opts += f" --block-size {best['block_size']} --chunking {best['chunking']}"
+        print(f"cheapest setting with {target}: {opts}, k={best['k_ok']} ({best['mb_s']} MB/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Compact binary output (--format bin): fixed-width records that can be memory-mapped.
+
+Layout (little-endian):
+
+    header   MAGIC, u32 length, JSON {"bitlen", "mode", "feature_hash", "lanes"[, "unit"]},
+             zero-padded to a multiple of 8 bytes
+    records  record_dtype(lanes) rows: path id (u32), block (i32, -1 for a whole
+             file; the line number for --records output, whose header has
+             "unit": "line"), start, end (u64 byte offsets, 0 for a whole file),
+             hash as `lanes` u64 words (word j = bits 64j..64j+63)
+    paths    path table: the UTF-8 paths, each followed by a NUL, in id order
+    trailer  u64 path-table offset, u64 record count, MAGIC
+
+Records are written as they come, so the file streams to stdout; only the
+trailer needs the end. BinFile maps a finished file and exposes the records as
+a NumPy structured array without parsing anything.
+"""
+import json, mmap, struct
+
+try:
+    import numpy as np  # optional: pip install numpy (needed for BinFile)
+except ImportError:
+    np = None
+
+MAGIC = b"SHBIN\x00\x01\n"
+TRAILER = struct.Struct("<QQ8s")
+WRITE_BATCH = 1 << 16       # records buffered per write
+_M64 = (1 << 64) - 1
+
+def record_dtype(lanes):
+    return np.dtype([("path", "<u4"), ("block", "<i4"), ("start", "<u8"), ("end", "<u8"),
+                     ("hash", "<u8", (lanes,))])
+
+class BinWriter:
+    def __init__(self, fh, bitlen, mode, feature_hash, unit="block"):
+        """fh: binary file object (e.g. sys.stdout.buffer); unit: "line" for --records output."""
+        self.fh = fh
+        self.lanes = -(-bitlen // 64)
+        self._rec = struct.Struct(f"<IiQQ{self.lanes}Q")
+        self._ids = {}
+        self._cols = ([], [], [], [], [])     # path id, block, start, end, hash
+        self.count = 0
+        meta = {"bitlen": bitlen, "mode": mode, "feature_hash": feature_hash, "lanes": self.lanes}
+        if unit != "block":
+            meta["unit"] = unit
+        meta = json.dumps(meta).encode()
+        head = MAGIC + struct.pack("<I", len(meta)) + meta
+        head += b"\0" * (-len(head) % 8)
+        fh.write(head)
+        self.offset = len(head)
+
+    def write(self, rec):
+        """Append one whole-file, block or line record (the dicts of iter_path_records)."""
+        paths, blocks, starts, ends, hashes = self._cols
+        paths.append(self._ids.setdefault(rec["path"], len(self._ids)))
+        if "block" in rec or "line" in rec:
+            blocks.append(rec["block"] if "block" in rec else rec["line"])
+            starts.append(rec["start"])
+            ends.append(rec["end"])
+        else:
+            blocks.append(-1)
+            starts.append(0)
+            ends.append(0)
+        hashes.append(rec["hash"])
+        if len(hashes) >= WRITE_BATCH:
+            self.flush()
+
+    def _pack(self):
+        paths, blocks, starts, ends, hashes = self._cols
+        if np is None:
+            return b"".join(self._rec.pack(*row[:4], *[(row[4] >> (64 * j)) & _M64 for j in range(self.lanes)])
+                            for row in zip(*self._cols))
+        # column-wise through a structured array instead of one struct.pack per record
+        out = np.empty(len(hashes), dtype=record_dtype(self.lanes))
+        out["path"], out["block"], out["start"], out["end"] = paths, blocks, starts, ends
+        for j in range(self.lanes):
+            out["hash"][:, j] = [(h >> (64 * j)) & _M64 for h in hashes]
+        return out.tobytes()
+
+    def flush(self):
+        data = self._pack()
+        self.fh.write(data)
+        self.fh.flush()
+        self.offset += len(data)
+        self.count += len(self._cols[4])
+        self._cols = ([], [], [], [], [])
+
+    def close(self):
+        """Write the remaining records, the path table and the trailer."""
+        self.flush()
+        table = b"".join(p.encode("utf-8", "surrogateescape") + b"\0" for p in self._ids)
+        self.fh.write(table + TRAILER.pack(self.offset, self.count, MAGIC))
+        self.fh.flush()
+
+def is_bin_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+class BinFile:
+    """
+    A memory-mapped --format bin file: .records is a record_dtype structured array
+    (a view of the mapping, no copy), .paths the path table, .bitlen/.mode/.feature_hash/.unit
+    the header.
+    """
+    def __init__(self, path):
+        if np is None:
+            raise RuntimeError("reading --format bin files requires NumPy: pip install numpy")
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[:len(MAGIC)] != MAGIC or len(mm) < TRAILER.size:
+            raise ValueError(f"{path}: not a simhash --format bin file")
+        table_off, count, magic = TRAILER.unpack_from(mm, len(mm) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: truncated --format bin file (no trailer)")
+        (n,) = struct.unpack_from("<I", mm, len(MAGIC))
+        meta = json.loads(mm[len(MAGIC) + 4:len(MAGIC) + 4 + n])
+        self.bitlen, self.mode, self.feature_hash = meta["bitlen"], meta["mode"], meta["feature_hash"]
+        self.unit = meta.get("unit", "block")
+        start = len(MAGIC) + 4 + n
+        start += -start % 8
+        self.records = np.frombuffer(mm, dtype=record_dtype(meta["lanes"]), count=count, offset=start)
+        table = mm[table_off:len(mm) - TRAILER.size]
+        self.paths = [p.decode("utf-8", "surrogateescape") for p in table.split(b"\0")[:-1]]
+
+    def __len__(self):
+        return len(self.records)
+
+    def hashes(self):
+        """The fingerprints as python ints."""
+        return [sum(v << (64 * j) for j, v in enumerate(row)) for row in self.records["hash"].tolist()]
+
+    def __iter__(self):
+        """Records as dicts like parse_record's: {"path", "hash", "bitlen", "label"[, "block", "start", "end" | "line"]}."""
+        label = self.mode if self.feature_hash == "blake2b" else f"{self.mode}+{self.feature_hash}"
+        r = self.records
+        cols = zip(r["path"].tolist(), r["block"].tolist(), r["start"].tolist(), r["end"].tolist(), self.hashes())
+        for pid, block, start, end, h in cols:
+            rec = {"path": self.paths[pid], "hash": h, "bitlen": self.bitlen, "label": label}
+            if block >= 0 and self.unit == "line":
+                rec["line"] = block
+            elif block >= 0:
+                rec.update(block=block, start=start, end=end)
+            yield rec
+
+    def close(self):
+        self.records = None
+        try:
+            self._mm.close()
+        except BufferError:     # record arrays handed out are still alive; unmapped when they go
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
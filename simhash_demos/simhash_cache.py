@@ -0,0 +1,170 @@
+"""
+Persistent SimHash fingerprint cache (SQLite).
+
+Entries are keyed by file identity (device, inode, size, mtime_ns, st_mode) plus
+a string describing every hashing parameter that changes the output (bitlen,
+ngram, step, block size, feature hash, ...). A hit returns the stored whole-file
+or per-block records without opening the file.
+
+Eviction: entries not used for `max_age` seconds are dropped, then the least
+recently used ones until the stored records fit in `max_bytes`.
+"""
+import json, os, sqlite3, time
+
+COMMIT_EVERY = 1000     # stores between commits, so an interrupted run keeps most of its work
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    dev      INTEGER NOT NULL,
+    ino      INTEGER NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fmode    INTEGER NOT NULL,
+    params   TEXT    NOT NULL,
+    path     TEXT    NOT NULL,
+    records  TEXT    NOT NULL,
+    nbytes   INTEGER NOT NULL,
+    created  REAL    NOT NULL,
+    used     REAL    NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns, fmode, params)
+);
+CREATE INDEX IF NOT EXISTS fingerprints_used ON fingerprints (used);
+"""
+
+def file_key(path):
+    """(dev, ino, size, mtime_ns, st_mode) of a regular file, or None (stdin, missing, special files)."""
+    if path == "-":
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not os.path.isfile(path):
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode)
+
+BLOCK_KEYS = ("path", "block", "start", "end", "hash")
+RUN_KEYS = ("cache", "stats")   # per-run fields (hit/miss, --stats timings): never stored
+
+def encode_records(records):
+    """
+    Records without their path: hash_hex for a whole file, [block, start, end, hash_hex]
+    for a block. A counter vector, if present, is appended ([hash_hex, vector] for a whole
+    file); any other block fields (text offsets, ...) as a trailing dict. --records
+    records are dicts ({"line", "start", "end", "hash": hash_hex} or {"line", "error"}).
+    RUN_KEYS are dropped: they describe the run that computed the records, not the file.
+    """
+    out = []
+    for rec in records:
+        if "line" in rec:
+            item = {k: v for k, v in rec.items() if k != "path" and k not in RUN_KEYS}
+            if "hash" in item:
+                item["hash"] = format(item["hash"], "x")
+            out.append(item)
+            continue
+        hx = format(rec["hash"], "x")
+        if "block" not in rec:
+            out.append([hx, rec["vector"]] if "vector" in rec else hx)
+            continue
+        extra = {k: v for k, v in rec.items() if k not in BLOCK_KEYS and k not in RUN_KEYS}
+        out.append([rec["block"], rec["start"], rec["end"], hx, *([extra] if extra else [])])
+    return json.dumps(out, separators=(",", ":"))
+
+def decode_records(text, path):
+    out = []
+    for item in json.loads(text):
+        if isinstance(item, str):
+            out.append({"path": path, "hash": int(item, 16)})
+        elif isinstance(item, dict):
+            rec = {"path": path, **item}
+            if "hash" in rec:
+                rec["hash"] = int(rec["hash"], 16)
+            out.append(rec)
+        elif len(item) == 2:
+            out.append({"path": path, "hash": int(item[0], 16), "vector": item[1]})
+        else:
+            block, start, end, hx = item[:4]
+            rec = {"path": path, "block": block, "start": start, "end": end, "hash": int(hx, 16)}
+            if len(item) > 4:
+                rec.update(item[4])
+            out.append(rec)
+    return out
+
+class FingerprintCache:
+    def __init__(self, db_path, max_bytes=256 << 20, max_age=30 * 86400):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = self.misses = self.stores = self.evicted = 0
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        self._touched = []
+
+    def get(self, key, params, path):
+        """Cached records for (key, params) with `path` filled in, or None."""
+        if key is None:
+            return None
+        row = self.db.execute(
+            "SELECT records FROM fingerprints WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND fmode=? AND params=?",
+            (*key, params)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append((*key, params))
+        return decode_records(row[0], path)
+
+    def put(self, key, params, path, records):
+        """Store records computed from a file whose identity was `key` before hashing.
+        Skipped if the file changed in the meantime."""
+        if key is None or file_key(path) != key:
+            return
+        text = encode_records(records)
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, params, path, text, len(text), now, now))
+        self.stores += 1
+        if self.stores % COMMIT_EVERY == 0:
+            self.db.commit()
+
+    def evict(self):
+        """Apply the age and size limits; returns the number of entries removed."""
+        removed = 0
+        if self.max_age:
+            cur = self.db.execute("DELETE FROM fingerprints WHERE used < ?", (time.time() - self.max_age,))
+            removed += cur.rowcount
+        if self.max_bytes:
+            total = self.db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM fingerprints").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self.db.execute("SELECT rowid, nbytes FROM fingerprints ORDER BY used").fetchall()
+                victims = []
+                for rowid, nbytes in rows:
+                    if total <= self.max_bytes:
+                        break
+                    victims.append((rowid,))
+                    total -= nbytes
+                self.db.executemany("DELETE FROM fingerprints WHERE rowid = ?", victims)
+                removed += len(victims)
+        self.evicted += removed
+        return removed
+
+    def close(self):
+        """Record the hits' last use, evict, and commit."""
+        now = time.time()
+        self.db.executemany(
+            "UPDATE fingerprints SET used=? WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND fmode=? AND params=?",
+            [(now, *k) for k in self._touched])
+        self._touched = []
+        self.evict()
+        self.db.commit()
+        self.db.close()
+
+    def summary(self):
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evicted": self.evicted}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -3,6 +3,12 @@ from pathlib import Path
 import gzip, bz2, lzma
 from collections import deque
 
+# the numpy engine is shared with the chunked tool (NumPy stays optional there)
+from simhash_complete_chunked import (
+    ENGINES, accumulate_bits, accumulate_features_np, batched, byte_feature_batches_np, check_engine, new_acc,
+    sign_from_acc,
+)
+
 # ---------- hashing core ----------
 def hash_feature_bytes(b: bytes, bitlen=64) -> int:
     h = hashlib.blake2b(b, digest_size=bitlen // 8).digest()
@@ -58,7 +64,17 @@ def stream_token_ngrams(tokens, n=3):
             yield " ".join([*window, t])
         window.append(t)
 
-def simhash_text(path, bitlen=64, ngram=3, weight_fn=None, chunk_size=None):
+def simhash_text(path, bitlen=64, ngram=3, weight_fn=None, chunk_size=None, engine="python"):
+    check_engine(engine)
+    if engine == "numpy":
+        acc = new_acc(bitlen)
+        with open_maybe_compressed(path, "rt") as fh:
+            feats = stream_token_ngrams(stream_word_tokens_fh(fh), n=ngram)
+            for batch in batched(feats):
+                acc, _ = accumulate_features_np(acc, batch, bitlen, weight_fn=weight_fn,
+                                                key=lambda f: f.encode("utf-8", "ignore"))
+        return sign_from_acc(acc)
+
     vec = [0] * bitlen
     with open_maybe_compressed(path, "rt") as fh:
         tokens = stream_word_tokens_fh(fh)
@@ -89,7 +105,16 @@ def stream_byte_ngrams_fh(fh, n=7, step=1, chunk_size=1<<20):
                     yield bytes(window)
                 since = (since + 1) % step
 
-def simhash_bytes(path, bitlen=64, n=7, step=1, chunk_size=1<<20, weight_fn=None):
+def simhash_bytes(path, bitlen=64, n=7, step=1, chunk_size=1<<20, weight_fn=None, engine="python"):
+    check_engine(engine)
+    if engine == "numpy":
+        acc = new_acc(bitlen)
+        with open_maybe_compressed(path, "rb") as fh:
+            for _, bits, weights in byte_feature_batches_np(fh, n=n, step=step, chunk_size=chunk_size,
+                                                            bitlen=bitlen, weight_fn=weight_fn):
+                acc, _ = accumulate_bits(acc, bits, weights)
+        return sign_from_acc(acc)
+
     vec = [0] * bitlen
     with open_maybe_compressed(path, "rb") as fh:
         for gram in stream_byte_ngrams_fh(fh, n=n, step=step, chunk_size=chunk_size):
@@ -141,14 +166,20 @@ def main():
     ap.add_argument("--chunk-size", type=int, default=1<<20, help="Read size per chunk (bytes)")
     ap.add_argument("--recursive", action="store_true", help="Recurse into directories")
     ap.add_argument("--json", action="store_true", help="Emit JSON lines instead of TSV")
+    ap.add_argument("--engine", choices=ENGINES, default="python",
+                    help="Accumulation engine: per-bit python loop or batched numpy (same hashes; default: python)")
     args = ap.parse_args()
+    try:
+        check_engine(args.engine)
+    except RuntimeError as e:
+        ap.error(str(e))
 
     for path in iter_input_paths(args.paths, recursive=args.recursive):
         if args.mode == "text":
-            h = simhash_text(path, bitlen=args.bitlen, ngram=args.ngram)
+            h = simhash_text(path, bitlen=args.bitlen, ngram=args.ngram, engine=args.engine)
         else:
             h = simhash_bytes(path, bitlen=args.bitlen, n=args.ngram,
-                              step=args.step, chunk_size=args.chunk_size)
+                              step=args.step, chunk_size=args.chunk_size, engine=args.engine)
 
         if args.json:
             rec = {"path": path, "simhash_hex": to_fixed_hex(h, args.bitlen),
@@ -1,9 +1,26 @@
 #!/usr/bin/env python3
-import argparse, sys, os, re, hashlib, json
+import argparse, sys, os, re, hashlib, json, math, codecs, queue, struct, threading, time
 from pathlib import Path
 import gzip, bz2, lzma
 from collections import deque
 
+from simhash_bin import BinFile, BinWriter, is_bin_file
+from simhash_cache import FingerprintCache, file_key
+from simhash_resume import ResumeStore
+from simhash_sketch import DEFAULT_DEPTH, DEFAULT_WIDTH, build_sketch, load_idf
+from simhash_stats import Stats, profiling
+from simhash_walk import Walker
+
+try:
+    import numpy as np  # optional: pip install numpy (needed for --engine numpy)
+except ImportError:
+    np = None
+
+ENGINES = ("python", "numpy")
+NUMPY_BATCH = 1 << 16       # features hashed per accumulation step in the numpy engine
+WEIGHTED_ROWS = 1 << 10     # bit-matrix rows converted per weighted matmul (keeps the copy in cache)
+STATS = None                # simhash_stats.Stats of the file being hashed with --stats, else None
+
 # ---------- hashing core ----------
 def hash_feature_bytes(b: bytes, bitlen=64) -> int:
     h = hashlib.blake2b(b, digest_size=bitlen // 8).digest()
@@ -12,6 +29,235 @@ def hash_feature_bytes(b: bytes, bitlen=64) -> int:
 def hamming_distance(a: int, b: int) -> int:
     return (a ^ b).bit_count()
 
+# ---------- rolling feature hash (buzhash + fmix64 lanes) ----------
+HASH_FAMILIES = ("blake2b", "rolling")
+_M64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+# fixed, reproducible byte table: fingerprints must not depend on the run
+BUZ_TABLE = [int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=8, person=b"simhash-buzhash").digest(), "big")
+             for i in range(256)]
+_BUZ_NP = np.array(BUZ_TABLE, dtype=np.uint64) if np is not None else None
+
+def check_feature_hash(feature_hash):
+    if feature_hash not in HASH_FAMILIES:
+        raise ValueError(f"unknown feature hash: {feature_hash!r} (choose from {', '.join(HASH_FAMILIES)})")
+
+def check_sample(sample, step=1):
+    """
+    sample > 1: content-defined sampling, only windows whose buzhash is divisible by
+    `sample` are hashed (about 1 in sample). Unlike step, which window is kept depends
+    only on its bytes, so an insert doesn't change the selection after it.
+    """
+    if sample < 1:
+        raise ValueError("sample must be >= 1")
+    if sample > 1 and step != 1:
+        raise ValueError("sampling by content (sample > 1) and by position (step > 1) don't combine")
+
+def rotl64(x: int, r: int) -> int:
+    r &= 63
+    return ((x << r) | (x >> (64 - r))) & _M64 if r else x
+
+def fmix64(k: int) -> int:
+    """MurmurHash3 64-bit finalizer."""
+    k ^= k >> 33
+    k = (k * 0xFF51AFD7ED558CCD) & _M64
+    k ^= k >> 33
+    k = (k * 0xC4CEB9FE1A85EC53) & _M64
+    k ^= k >> 33
+    return k
+
+def buzhash(gram: bytes) -> int:
+    """Buzhash of a whole window: XOR of rotl(T[b_k], n-1-k)."""
+    h = 0
+    for b in gram:
+        h = rotl64(h, 1) ^ BUZ_TABLE[b]
+    return h
+
+def mix_rolling(h: int, bitlen=64) -> int:
+    """Expand a 64-bit buzhash into a bitlen-bit feature hash; lane j (bits 64j..) is fmix64(h + (j+1)*golden)."""
+    out = 0
+    for j in range((bitlen + 63) // 64):
+        out |= fmix64((h + (j + 1) * _GOLDEN) & _M64) << (64 * j)
+    return out & ((1 << bitlen) - 1)
+
+def hash_feature_rolling(b: bytes, bitlen=64) -> int:
+    return mix_rolling(buzhash(b), bitlen)
+
+# ---------- NumPy engine (batched accumulation) ----------
+def check_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine: {engine!r} (choose from {', '.join(ENGINES)})")
+    if engine == "numpy" and np is None:
+        raise RuntimeError("engine 'numpy' requires NumPy: pip install numpy")
+
+def digests_to_bits(digests: bytes, bitlen: int):
+    """
+    Unpack concatenated blake2b digests into an (N, bitlen) uint8 matrix of 0/1.
+    Column i is bit i of int.from_bytes(digest, "big"), i.e. the same bit
+    the python engine tests with (h >> i) & 1.
+    """
+    nbytes = bitlen // 8
+    rows = np.frombuffer(digests, dtype=np.uint8).reshape(-1, nbytes)
+    bits = np.unpackbits(rows[:, ::-1], axis=1, bitorder="little")
+    if bits.shape[1] < bitlen:
+        # bitlen not a multiple of 8: the hash has no bits up there, they always vote -w
+        bits = np.pad(bits, ((0, 0), (0, bitlen - bits.shape[1])))
+    return bits
+
+def lanes_to_bits(lanes, bitlen: int):
+    """
+    Unpack (N, L) uint64 lanes into an (N, bitlen) uint8 matrix of 0/1.
+    Column i is bit i of sum(lane_j << 64*j), matching mix_rolling.
+    """
+    raw = np.ascontiguousarray(lanes, dtype="<u8").view(np.uint8)
+    return np.unpackbits(raw, axis=1, bitorder="little")[:, :bitlen]
+
+def accumulate_bits(acc, bits, weights=None):
+    """
+    Add the +w/-w votes of an (N, bitlen) bit matrix to `acc`.
+    Returns (acc, contributed); acc is promoted to float64 for non-integer weights.
+    """
+    if STATS is None:
+        return _accumulate_bits(acc, bits, weights)
+    STATS.features += len(bits)
+    with STATS.stage("accumulate"):
+        return _accumulate_bits(acc, bits, weights)
+
+def _accumulate_bits(acc, bits, weights):
+    if weights is None:
+        acc += 2 * bits.sum(axis=0, dtype=np.int64) - bits.shape[0]
+        return acc, bits.shape[0]
+    if weights.dtype.kind == "f" and acc.dtype.kind != "f":
+        acc = acc.astype(np.float64)
+    # w . (2b - 1) = 2 (w . b) - sum(w), over slices of rows whose converted bits stay in cache
+    dt = acc.dtype
+    for i in range(0, len(bits), WEIGHTED_ROWS):
+        acc += 2 * (weights[i:i + WEIGHTED_ROWS].astype(dt) @ bits[i:i + WEIGHTED_ROWS].astype(dt))
+    acc -= weights.sum().astype(dt)
+    return acc, int(np.count_nonzero(weights))
+
+def sum_votes(bits, starts, counts):
+    """
+    Unweighted +1/-1 votes of consecutive row ranges of a bit matrix (range j: counts[j]
+    rows from starts[j], ranges adjacent and covering bits) in one reduceat: (len(starts), bitlen).
+    """
+    if STATS is None:
+        return 2 * _sum_rows(bits, starts, counts) - counts[:, None]
+    STATS.features += len(bits)
+    with STATS.stage("accumulate"):
+        return 2 * _sum_rows(bits, starts, counts) - counts[:, None]
+
+def _sum_rows(bits, starts, counts):
+    if bits.shape[1] % 8 or not bits.flags.c_contiguous:
+        return np.add.reduceat(bits, starts, axis=0, dtype=np.int64)
+    # 8 bit columns per uint64 word, summed bytewise (no carries while a range has < 256 rows):
+    # longer ranges are cut into 255-row pieces whose byte sums are added up afterwards
+    long = counts > 255
+    cuts = starts
+    if long.any():
+        cuts = np.concatenate([starts] + [np.arange(s + 255, s + c, 255) for s, c in zip(starts[long], counts[long])])
+        cuts.sort(kind="stable")
+    sums = np.add.reduceat(bits.view(np.uint64), cuts, axis=0).view(np.uint8)
+    if len(cuts) == len(starts):
+        return sums.astype(np.int64)
+    return np.add.reduceat(sums, np.searchsorted(cuts, starts), axis=0, dtype=np.int64)
+
+def weighs_keys(weight_fn):
+    """
+    Whether weight_fn takes feature keys instead of features (simhash_sketch): the low
+    64 bits of each feature hash, a uint64 array in the numpy engine and an int in the
+    python one. Such weights need no feature bytes and are looked up per batch.
+    """
+    return getattr(weight_fn, "by_key", False)
+
+def digest_keys_np(digests: bytes, d: int):
+    """Feature keys of concatenated d-byte digests: int.from_bytes(digest, "big") & (2**64 - 1)."""
+    rows = np.frombuffer(digests, dtype=np.uint8).reshape(-1, d)[:, -8:]
+    if d < 8:
+        rows = np.pad(rows, ((0, 0), (8 - d, 0)))
+    return np.ascontiguousarray(rows).view(">u8").ravel().astype(np.uint64)
+
+def lane_keys_np(lanes, bitlen: int):
+    """Feature keys of (N, L) rolling lanes: mix_rolling(h, bitlen) & (2**64 - 1)."""
+    return lanes[:, 0] & np.uint64((1 << bitlen) - 1) if bitlen < 64 else lanes[:, 0]
+
+def accumulate_features_np(acc, feats, bitlen, weight_fn=None, key=None):
+    """
+    Hash a batch of features and add their +w/-w bit votes to `acc` in one step.
+    key: maps a feature to the bytes that get hashed (default: the feature itself).
+    Returns (acc, contributed) where contributed is the number of features with w != 0.
+    acc is promoted to float64 if weight_fn returns non-integer weights.
+    """
+    weights = None
+    by_key = weighs_keys(weight_fn)
+    if weight_fn is not None and not by_key:
+        ws = [weight_fn(f) for f in feats]
+        feats = [f for f, w in zip(feats, ws) if w]
+        weights = np.asarray([w for w in ws if w])
+    if not feats:
+        return acc, 0
+    d = bitlen // 8
+    blake = hashlib.blake2b
+    if key is None:
+        digests = b"".join([blake(f, digest_size=d).digest() for f in feats])
+    else:
+        digests = b"".join([blake(key(f), digest_size=d).digest() for f in feats])
+    if by_key:
+        weights = weight_fn(digest_keys_np(digests, d))
+    return accumulate_bits(acc, digests_to_bits(digests, bitlen), weights)
+
+def _rotl64_np(x, r):
+    r &= 63
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r)) if r else x
+
+def _fmix64_np(k):
+    k = k ^ (k >> np.uint64(33))
+    k = k * np.uint64(0xFF51AFD7ED558CCD)
+    k = k ^ (k >> np.uint64(33))
+    k = k * np.uint64(0xC4CEB9FE1A85EC53)
+    return k ^ (k >> np.uint64(33))
+
+def rolling_lanes_np(buf, i, stop, n, step, bitlen):
+    """
+    Vectorized hash_feature_rolling for the windows buf[j:j+n], j in range(i, stop, step).
+    Returns an (N, ceil(bitlen/64)) uint64 lane matrix: n table gathers + XORs per batch
+    instead of one interpreted update per byte.
+    """
+    return mix_lanes_np(buzhash_np(buf, i, stop, n, step), bitlen)
+
+def buzhash_np(buf, i, stop, n, step=1):
+    """(N,) uint64 buzhash of the windows buf[j:j+n], j in range(i, stop, step)."""
+    count = len(range(i, stop, step))
+    span = (count - 1) * step + 1
+    tv = _BUZ_NP[np.frombuffer(buf, dtype=np.uint8)[i:i + span + n - 1]]
+    h = np.zeros(count, dtype=np.uint64)
+    for k in range(n):
+        h ^= _rotl64_np(tv[k:k + span:step], n - 1 - k)
+    return h
+
+def mix_lanes_np(h, bitlen):
+    """Vectorized mix_rolling: (N,) uint64 hashes -> (N, ceil(bitlen/64)) uint64 lanes."""
+    lanes = np.empty((len(h), (bitlen + 63) // 64), dtype=np.uint64)
+    for j in range(lanes.shape[1]):
+        lanes[:, j] = _fmix64_np(h + np.uint64(((j + 1) * _GOLDEN) & _M64))
+    return lanes
+
+def new_acc(bitlen):
+    return np.zeros(bitlen, dtype=np.int64)
+
+def sign_from_acc(acc):
+    return sign_from_vec(acc.tolist())
+
+def batched(it, size=NUMPY_BATCH):
+    batch = []
+    for x in it:
+        batch.append(x)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 # ---------- I/O helpers ----------
 def open_maybe_compressed(path: str, mode: str):
     """
@@ -32,6 +278,333 @@ def open_maybe_compressed(path: str, mode: str):
         return open(p, "rb")
     return open(p, "rt", encoding="utf-8", errors="ignore")
 
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".bzip2", ".xz", ".lzma")
+
+def is_plain_file(path) -> bool:
+    """True for regular uncompressed files (seekable, mmap-able); False for stdin and .gz/.bz2/.xz."""
+    return path != "-" and not str(path).lower().endswith(COMPRESSED_SUFFIXES) and os.path.isfile(path)
+
+class BufferReader:
+    """
+    File-like reader over buf[start:end] (bytes, bytearray, mmap) that hands out
+    memoryview slices instead of copies. iter_carry_chunks slices its buffer directly.
+    """
+    def __init__(self, buf, start=0, end=None):
+        self.mv = memoryview(buf)
+        self.start = self.pos = start
+        self.end = len(self.mv) if end is None else min(end, len(self.mv))
+
+    @property
+    def count(self):
+        return self.pos - self.start
+
+    def read(self, size=-1):
+        stop = self.end if size < 0 else min(self.end, self.pos + size)
+        data = self.mv[self.pos:stop]
+        self.pos = stop
+        return data
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class MmapReader(BufferReader):
+    """Zero-copy BufferReader over a memory-mapped plain file (optionally a byte range of it)."""
+    def __init__(self, path, start=0, end=None):
+        import mmap
+        self._f = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._f.close()
+            raise
+        super().__init__(self._mm, start, end)
+
+    def close(self):
+        try:
+            self.mv.release()
+            self._mm.close()
+        except BufferError:
+            pass    # a caller still holds a slice; the mapping goes away with the last one
+        self._f.close()
+
+def open_binary(path, readahead=0):
+    """
+    Binary input for the bytes-mode hashers: an MmapReader for non-empty plain files,
+    otherwise open_maybe_compressed(path, "rb") (stdin, pipes, .gz/.bz2/.xz).
+    readahead > 0: compressed files are decompressed ahead on other threads, with up
+    to `readahead` buffers queued (ReadaheadReader; BgzfReader for BGZF .gz files).
+    """
+    if is_plain_file(path) and os.path.getsize(path) > 0:
+        fh = MmapReader(path)
+    elif readahead and path != "-" and str(path).lower().endswith(COMPRESSED_SUFFIXES):
+        if str(path).lower().endswith(".gz") and is_bgzf(path):
+            fh = BgzfReader(path, depth=readahead)
+        else:
+            fh = ReadaheadReader(open_maybe_compressed(path, "rb"), depth=readahead)
+    else:
+        fh = open_maybe_compressed(path, "rb")
+    return fh if STATS is None else STATS.reader(path, fh, isinstance(fh, BufferReader))
+
+# ---------- decompression readahead ----------
+READAHEAD_CHUNK = 1 << 20
+BGZF_GROUP = 1 << 20        # compressed bytes of whole BGZF blocks per decompression task
+# totals over the readers closed in this process, for --stats
+READAHEAD_STATS = {"files": 0, "bytes": 0, "decompress": 0.0, "wait": 0.0}
+
+class PrefetchReader:
+    """
+    File-like reader over buffers produced ahead of time by _next() (b"" at EOF).
+    read() may return fewer bytes than asked; readinto() copies into the caller's
+    buffer, so iter_carry_chunks takes its reused-bytearray path.
+    decompress_time: seconds spent producing buffers; wait_time: seconds read() blocked.
+    """
+    def __init__(self):
+        self._buf = b""
+        self._pos = 0
+        self._eof = False
+        self.nbytes = 0
+        self.decompress_time = self.wait_time = 0.0
+
+    def _fill(self):
+        if self._pos < len(self._buf) or self._eof:
+            return
+        t0 = time.perf_counter()
+        data = self._next()
+        self.wait_time += time.perf_counter() - t0
+        self._buf, self._pos = data, 0
+        self.nbytes += len(data)
+        self._eof = not data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(READAHEAD_CHUNK), b""))
+        self._fill()
+        if self._pos == 0 and size >= len(self._buf):
+            data = self._buf
+        else:
+            data = self._buf[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        self._fill()
+        got = min(len(b), len(self._buf) - self._pos)
+        b[:got] = self._buf[self._pos:self._pos + got]
+        self._pos += got
+        return got
+
+    def close(self):
+        READAHEAD_STATS["files"] += 1
+        READAHEAD_STATS["bytes"] += self.nbytes
+        READAHEAD_STATS["decompress"] += self.decompress_time
+        READAHEAD_STATS["wait"] += self.wait_time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ReadaheadReader(PrefetchReader):
+    """
+    Reads fh (e.g. a gzip/bz2/lzma file object) on a background thread into a
+    queue of at most `depth` chunk_size buffers. zlib, bz2 and lzma release the
+    GIL while decompressing, so decompression overlaps with hashing.
+    """
+    def __init__(self, fh, chunk_size=READAHEAD_CHUNK, depth=4):
+        super().__init__()
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self._q = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                t0 = time.perf_counter()
+                data = self.fh.read(self.chunk_size)
+                self.decompress_time += time.perf_counter() - t0
+                self._put(data)
+                if not data:
+                    return
+        except BaseException as e:      # handed to the consumer
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _next(self):
+        item = self._q.get()
+        if isinstance(item, BaseException):
+            self._eof = True
+            raise item
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.fh.close()
+        super().close()
+
+def is_bgzf(path) -> bool:
+    """True if path starts with a BGZF block (gzip member with a 'BC' extra subfield holding its size)."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[:4] != b"\x1f\x8b\x08\x04":
+            return False
+        extra = f.read(struct.unpack("<H", head[10:12])[0])
+    return _bgzf_block_size(extra) is not None
+
+def _bgzf_block_size(extra):
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == b"BC" and slen == 2:
+            return struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+        i += 4 + slen
+    return None
+
+def _inflate(raw):
+    t0 = time.perf_counter()
+    data = gzip.decompress(raw)     # handles the concatenated members of a group
+    return data, time.perf_counter() - t0
+
+class BgzfReader(PrefetchReader):
+    """
+    Parallel decompression of BGZF (blocked gzip, as written by bgzip/samtools):
+    each member records its compressed size, so whole members are cut out
+    without inflating them, grouped into ~BGZF_GROUP-byte tasks and inflated on a
+    thread pool, at most `depth` tasks ahead, and handed out in order.
+    A trailing part without BGZF headers is inflated as one task.
+    decompress_time is summed over the threads.
+    """
+    def __init__(self, path, depth=4, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        super().__init__()
+        self._raw = open(path, "rb")
+        self._depth = max(1, depth)
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self._pending = deque()
+        self._raw_eof = False
+
+    def _read_group(self):
+        parts, size = [], 0
+        while size < BGZF_GROUP:
+            head = self._raw.read(12)
+            if not head:
+                self._raw_eof = True
+                break
+            bsize = None
+            if len(head) == 12 and head[:4] == b"\x1f\x8b\x08\x04":
+                extra = self._raw.read(struct.unpack("<H", head[10:12])[0])
+                bsize = _bgzf_block_size(extra)
+                head += extra
+            if bsize is None:       # not BGZF from here on
+                parts += [head, self._raw.read()]
+                self._raw_eof = True
+                break
+            parts += [head, self._raw.read(bsize - len(head))]
+            size += bsize
+        return b"".join(parts)
+
+    def _next(self):
+        while True:
+            while len(self._pending) < self._depth and not self._raw_eof:
+                raw = self._read_group()
+                if raw:
+                    self._pending.append(self._pool.submit(_inflate, raw))
+            if not self._pending:
+                return b""
+            data, secs = self._pending.popleft().result()
+            self.decompress_time += secs
+            if data:
+                return data
+
+    def close(self):
+        for fut in self._pending:
+            fut.cancel()
+        self._pool.shutdown(wait=True)
+        self._raw.close()
+        super().close()
+
+class ObservedReader:
+    """Wraps a reader so that `observe(view, base)` sees every fresh chunk iter_carry_chunks hands out."""
+    def __init__(self, fh, observe):
+        self.fh = fh
+        self.observe = observe
+
+def iter_carry_chunks(fh, keep=0, chunk_size=1<<20, offset=0):
+    """
+    Yield (buf, base, fresh) over a binary stream: buf is the last `keep` bytes of the
+    previous buf (the n-1 byte overlap n-grams need) followed by up to chunk_size new
+    bytes, base is the absolute offset of buf[0] and buf[fresh:] are the new bytes.
+    offset: absolute position of fh's first byte.
+    No per-chunk allocation on the fast paths:
+      - BufferReader/MmapReader: buf is a memoryview of the mapping itself;
+      - anything with readinto (stdin, pipes, gzip/bz2/lzma): one reused bytearray of
+        keep + chunk_size bytes, with the carry moved to its front.
+    buf is only valid until the next item is requested.
+    """
+    if isinstance(fh, ObservedReader):
+        for buf, base, fresh in iter_carry_chunks(fh.fh, keep, chunk_size, offset=offset):
+            fh.observe(buf[fresh:], base + fresh)
+            yield buf, base, fresh
+        return
+
+    if isinstance(fh, BufferReader):
+        first = fh.pos
+        while fh.pos < fh.end:
+            lo = max(first, fh.pos - keep)
+            stop = min(fh.end, fh.pos + chunk_size)
+            buf = fh.mv[lo:stop]
+            fresh = fh.pos - lo
+            fh.pos = stop
+            yield buf, offset + (lo - first), fresh
+        return
+
+    readinto = getattr(fh, "readinto", None)
+    if readinto is None:        # read()-only objects: concatenate the carry
+        carry = b""
+        base = offset
+        while True:
+            data = fh.read(chunk_size)
+            if not data:
+                break
+            buf = carry + data if carry else data
+            yield buf, base, len(carry)
+            cut = max(0, len(buf) - keep)
+            carry = buf[cut:] if keep else b""
+            base += cut
+        return
+
+    store = bytearray(keep + chunk_size)
+    view = memoryview(store)
+    have = 0                    # carry bytes at the front of store
+    base = offset
+    while True:
+        got = readinto(view[have:have + chunk_size])
+        if not got:
+            break
+        total = have + got
+        yield view[:total], base, have
+        have_next = min(keep, total)
+        store[:have_next] = store[total - have_next:total]
+        base += total - have_next
+        have = have_next
+
 # ---------- TEXT MODE (token or n-gram tokens) ----------
 WORD_RE = re.compile(r"\w+", re.UNICODE)
 
@@ -51,29 +624,211 @@ def stream_token_ngrams(tokens, n=3):
             yield " ".join([*window, t])
         window.append(t)
 
-def simhash_text(path, bitlen=64, ngram=3, weight_fn=None):
-    vec = [0] * bitlen
-    with open_maybe_compressed(path, "rt") as fh:
-        tokens = stream_word_tokens_fh(fh)
-        feats = stream_token_ngrams(tokens, n=ngram)
-        for feat in feats:
-            w = 1 if weight_fn is None else weight_fn(feat)
-            if not w:
-                continue
-            h = hash_feature_bytes(feat.encode("utf-8", "ignore"), bitlen=bitlen)
-            for i in range(bitlen):
-                vec[i] += w if (h >> i) & 1 else -w
-    return sign_from_vec(vec)
+class TokenReader:
+    """
+    Word tokens of a binary UTF-8 stream with their positions, read in chunk_size
+    pieces, so memory stays bounded even without newlines. Iterating yields
+    (token, byte_start, char_start); afterwards .bytes / .chars / .tokens are the stream's totals.
+    Character offsets count code points of the decoded text (an undecodable byte counts as one).
+    """
+    def __init__(self, fh, chunk_size=1<<20, lowercase=True):
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.lowercase = lowercase
+        self.bytes = self.chars = self.tokens = 0
 
-# ---------- BYTES MODE (byte n-grams) ----------
-def stream_byte_ngrams_fh(fh, n=7, step=1, chunk_size=1<<20):
-    assert n >= 1 and step >= 1
-    window = deque(maxlen=n)
-    since = 0
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder("utf-8")("surrogateescape")    # round-trips every byte
+        carry = ""                  # a token that may continue in the next chunk
+        bbase = cbase = 0           # byte/char offset of text[0]
+        while True:
+            data = self.fh.read(self.chunk_size)
+            final = not data
+            text = carry + decoder.decode(data, final=final)
+            # lowercase before matching, as stream_word_tokens_fh / iter_token_chunks do: lowering can
+            # lengthen a character ("İ" -> "i" + combining dot) and so split or end a token
+            low = text.lower() if self.lowercase else text
+            # orig[i]: index in text of the character low[i] came from (None: one to one)
+            orig = None if len(low) == len(text) else [i for i, c in enumerate(text) for _ in c.lower()]
+            matches = list(WORD_RE.finditer(low))
+            cut = len(text)
+            if matches and not final and matches[-1].end() == len(low):
+                cut = matches.pop().start()
+                cut = cut if orig is None else orig[cut]
+            self.tokens += len(matches)
+            ascii_text = text.isascii()
+            pos, b = 0, bbase
+            for m in matches:
+                start = m.start() if orig is None else orig[m.start()]
+                if ascii_text:
+                    b = bbase + start
+                else:
+                    b += len(text[pos:start].encode("utf-8", "surrogateescape"))
+                    pos = start
+                yield m.group(), b, cbase + start
+            bbase = bbase + cut if ascii_text else b + len(text[pos:cut].encode("utf-8", "surrogateescape"))
+            cbase += cut
+            carry = text[cut:]
+            if final:
+                self.bytes, self.chars = bbase, cbase
+                return
+
+_WORD_RE_B = re.compile(rb"\w+")
+# bytes that may belong to a token: ASCII word characters and any non-ASCII (UTF-8) byte
+_WORDISH = bytes(range(48, 58)) + bytes(range(65, 91)) + b"_" + bytes(range(97, 123)) + bytes(range(128, 256))
+TOKEN_CACHE = 1 << 20       # distinct tokens remembered per stream before the token-hash cache is reset
+MAX_TOKEN = 1 << 16         # longer tokens are split (bounds the carry of iter_token_chunks)
+
+def iter_token_chunks(fh, chunk_size=1<<20):
+    """
+    Lowercased word tokens (UTF-8 bytes) of a binary text stream, one list per chunk:
+    the tokens of stream_word_tokens_fh, but read in fixed-size chunks with the
+    partial token at the end carried over, so single-line inputs (minified JSON,
+    logs without newlines) are never loaded whole. ASCII chunks are tokenized as
+    bytes without decoding. Tokens longer than max(MAX_TOKEN, chunk_size) bytes are split.
+    """
+    carry = b""
     while True:
         data = fh.read(chunk_size)
+        buf = carry + data if carry else bytes(data)
+        if data:
+            keep = len(buf) - len(buf.rstrip(_WORDISH))
+            if keep == len(buf) and len(buf) > max(MAX_TOKEN, chunk_size):
+                # no token boundary in sight: cut anyway, but not inside a UTF-8 sequence
+                j = len(buf)
+                while j > len(buf) - 3 and 0x80 <= buf[j - 1] < 0xC0:
+                    j -= 1
+                if buf[j - 1] >= 0xC0:
+                    j -= 1
+                keep = len(buf) - j
+            buf, carry = buf[:len(buf) - keep], buf[len(buf) - keep:]
+        if buf.isascii():
+            yield _WORD_RE_B.findall(buf.lower())
+        else:
+            yield [t.encode("utf-8") for t in WORD_RE.findall(buf.decode("utf-8", "surrogateescape").lower())]
         if not data:
-            break
+            return
+
+def hash_token(tok: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(tok, digest_size=8, person=b"simhash-token").digest(), "big")
+
+def combine_token_hashes(hs, n):
+    """
+    Hashes of the n-grams of a token hash sequence: XOR of rotl(h_k, n-1-k), the
+    buzhash combine over tokens, updated in O(1) per n-gram.
+    """
+    if len(hs) < n:
+        return []
+    h = 0
+    for t in hs[:n]:
+        h = rotl64(h, 1) ^ t
+    out = [h]
+    for i in range(n, len(hs)):
+        h = rotl64(h, 1) ^ rotl64(hs[i - n], n) ^ hs[i]
+        out.append(h)
+    return out
+
+def text_feature_chunks(fh, ngram=3, chunk_size=1<<20, feature_hash="blake2b", grams=True, as_array=False):
+    """
+    Token n-gram features of a binary text stream, one batch per chunk: (grams, hashes).
+    grams: the n-grams as UTF-8 bytes (tokens joined by b" ", i.e. the features of
+    stream_token_ngrams), or None when neither requested nor needed for blake2b.
+    hashes: with feature_hash="rolling", the 64-bit n-gram hashes combined from
+    per-token hashes (list, or uint64 array with as_array); each distinct token
+    is hashed once. None for blake2b.
+    """
+    n = max(1, ngram)
+    window = deque(maxlen=n - 1)    # last n-1 tokens / token hashes of earlier chunks
+    tail = deque(maxlen=n - 1)
+    cache = {}
+    for toks in iter_token_chunks(fh, chunk_size):
+        out_grams = hashes = None
+        if grams or feature_hash == "blake2b":
+            if n == 1:
+                out_grams = toks
+            else:
+                seq = [*window, *toks]
+                out_grams = [b" ".join(seq[i:i + n]) for i in range(len(seq) - n + 1)]
+                window.extend(toks)
+        if feature_hash == "rolling":
+            if len(cache) >= TOKEN_CACHE:
+                cache.clear()
+            th = list(map(cache.get, toks))
+            if None in th:
+                for i, h in enumerate(th):
+                    if h is None:
+                        t = toks[i]
+                        if t not in cache:
+                            cache[t] = hash_token(t)
+                        th[i] = cache[t]
+            seq = [*tail, *th]
+            tail.extend(th)
+            if as_array:
+                a = np.array(seq, dtype=np.uint64)
+                count = max(0, len(a) - n + 1)
+                hashes = np.zeros(count, dtype=np.uint64)
+                for k in range(n):
+                    hashes ^= _rotl64_np(a[k:k + count], n - 1 - k)
+            else:
+                hashes = combine_token_hashes(seq, n)
+        yield out_grams, hashes
+
+def simhash_text(path, bitlen=64, ngram=3, weight_fn=None, engine="python", feature_hash="blake2b",
+                 chunk_size=1<<20, readahead=0):
+    """
+    Whole-file SimHash of token n-grams. feature_hash="blake2b" hashes each joined
+    n-gram; "rolling" hashes each token once and combines the token hashes
+    (different fingerprints, much less work per n-gram).
+    weight_fn receives the n-gram as a str (or its key, see weighs_keys). readahead: see open_binary.
+    """
+    check_engine(engine)
+    check_feature_hash(feature_hash)
+    by_key = weighs_keys(weight_fn)
+    wfn = weight_fn if weight_fn is None or by_key else (lambda g: weight_fn(g.decode("utf-8")))
+    with open_binary(path, readahead) as fh:
+        chunks = text_feature_chunks(fh, ngram=ngram, chunk_size=chunk_size, feature_hash=feature_hash,
+                                     grams=weight_fn is not None and not by_key, as_array=engine == "numpy")
+        if engine == "numpy":
+            acc = new_acc(bitlen)
+            for grams, hashes in chunks:
+                if feature_hash == "blake2b":
+                    for batch in batched(grams):
+                        acc, _ = accumulate_features_np(acc, batch, bitlen, weight_fn=wfn)
+                elif len(hashes):
+                    lanes = mix_lanes_np(hashes, bitlen)
+                    if wfn is None:
+                        weights = None
+                    elif by_key:
+                        weights = wfn(lane_keys_np(lanes, bitlen))
+                    else:
+                        weights = np.asarray([wfn(g) for g in grams])
+                    acc, _ = accumulate_bits(acc, lanes_to_bits(lanes, bitlen), weights)
+            return sign_from_acc(acc)
+
+        vec = [0] * bitlen
+        for grams, hashes in chunks:
+            feats = grams if hashes is None else hashes
+            if STATS is not None:
+                STATS.features += len(feats)
+            for j, f in enumerate(feats):
+                h = hash_feature_bytes(f, bitlen=bitlen) if hashes is None else mix_rolling(f, bitlen)
+                w = 1 if wfn is None else wfn(h & _M64) if by_key else wfn(grams[j])
+                if not w:
+                    continue
+                for i in range(bitlen):
+                    vec[i] += w if (h >> i) & 1 else -w
+        return sign_from_vec(vec)
+
+# ---------- BYTES MODE (byte n-grams) ----------
+def stream_byte_ngrams_fh(fh, n=7, step=1, chunk_size=1<<20, offset=0):
+    """
+    offset: absolute position of fh's first byte when streaming a slice of a larger
+    input; keeps the `step` phase of the full stream.
+    """
+    assert n >= 1 and step >= 1
+    window = deque(maxlen=n)
+    since = offset % step
+    for data, _, _ in iter_carry_chunks(fh, 0, chunk_size, offset=offset):
         for b in data:
             window.append(b)
             if len(window) == n:
@@ -81,17 +836,166 @@ def stream_byte_ngrams_fh(fh, n=7, step=1, chunk_size=1<<20):
                     yield bytes(window)
                 since = (since + 1) % step
 
-def simhash_bytes(path, bitlen=64, n=7, step=1, chunk_size=1<<20, weight_fn=None):
-    vec = [0] * bitlen
-    with open_maybe_compressed(path, "rb") as fh:
-        for gram in stream_byte_ngrams_fh(fh, n=n, step=step, chunk_size=chunk_size):
-            w = 1 if weight_fn is None else weight_fn(gram)
-            if not w:
+def stream_rolling_hashes_fh(fh, n=7, step=1, chunk_size=1<<20, grams=False, offset=0):
+    """
+    Yield (end_pos, gram, h) for the same windows stream_byte_ngrams_fh keeps, where h
+    is the 64-bit buzhash of the window, updated in O(1) per byte:
+        h' = rotl(h, 1) ^ T[in] ^ rotl(T[out], n)
+    The window bytes are only materialized when grams=True (gram is None otherwise).
+    """
+    assert n >= 1 and step >= 1
+    T = BUZ_TABLE
+    T_out = [rotl64(t, n) for t in T]
+    window = deque(maxlen=n)
+    h = 0
+    since = offset % step
+    pos = offset
+    for data, _, _ in iter_carry_chunks(fh, 0, chunk_size, offset=offset):
+        for b in data:
+            h = (((h << 1) | (h >> 63)) & _M64) ^ T[b]
+            if len(window) == n:
+                h ^= T_out[window[0]]
+            window.append(b)
+            pos += 1
+            if len(window) == n:
+                if since == 0:
+                    yield pos - 1, (bytes(window) if grams else None), h
+                since = (since + 1) % step
+
+def stream_byte_features_fh(fh, n=7, step=1, chunk_size=1<<20, bitlen=64, feature_hash="blake2b", grams=False,
+                            offset=0, sample=1):
+    """
+    Yield (end_pos, gram, h) for every kept byte n-gram: end_pos is the absolute offset
+    of the window's last byte and h its bitlen-bit feature hash. gram is the window bytes
+    (always for blake2b; for rolling only when grams=True, otherwise None).
+    offset: absolute position of fh's first byte (see stream_byte_ngrams_fh).
+    sample: keep only windows whose buzhash is divisible by it (see check_sample).
+    """
+    check_feature_hash(feature_hash)
+    check_sample(sample, step)
+    if sample > 1:
+        blake = feature_hash == "blake2b"
+        for end_pos, gram, h in stream_rolling_hashes_fh(fh, n=n, chunk_size=chunk_size, grams=grams or blake,
+                                                         offset=offset):
+            if h % sample == 0:
+                yield end_pos, gram, hash_feature_bytes(gram, bitlen=bitlen) if blake else mix_rolling(h, bitlen)
+        return
+    if feature_hash == "rolling":
+        for end_pos, gram, h in stream_rolling_hashes_fh(fh, n=n, step=step, chunk_size=chunk_size, grams=grams,
+                                                         offset=offset):
+            yield end_pos, gram, mix_rolling(h, bitlen)
+        return
+    # kept windows end `step` apart, starting at the first phase-aligned full window
+    first_end = offset + n - 1 + (-offset) % step
+    for k, gram in enumerate(stream_byte_ngrams_fh(fh, n=n, step=step, chunk_size=chunk_size, offset=offset)):
+        yield first_end + k * step, gram, hash_feature_bytes(gram, bitlen=bitlen)
+
+def iter_byte_window_ranges(fh, n=7, step=1, chunk_size=1<<20, batch=NUMPY_BATCH, offset=0):
+    """
+    Chunk driver for the numpy engine. Yields (buf, base, i, stop): the kept windows
+    of this batch are buf[j:j+n] for j in range(i, stop, step), and buf[0] sits at
+    absolute offset `base`. buf is one read chunk plus the n-1 byte carry from the
+    previous one, so windows are sliced out of it instead of rebuilt from a deque.
+    A window ending at offset e is kept iff (e - (n-1)) % step == 0, which is
+    exactly the `since` counter of the per-byte loop. At most `batch` windows per range.
+    offset: absolute position of fh's first byte (see stream_byte_ngrams_fh).
+    buf comes from iter_carry_chunks and is only valid until the next range.
+    """
+    assert n >= 1 and step >= 1
+    for buf, base, fresh in iter_carry_chunks(fh, n - 1, chunk_size, offset=offset):
+        # windows ending before the fresh bytes were already yielded
+        first = max(base + fresh, offset + n - 1)
+        first += (-(first - (n - 1))) % step
+        i = first - (n - 1) - base
+        last = len(buf) - n             # start of the last full window in buf
+        while i <= last:
+            stop = min(last + 1, i + batch * step)
+            yield buf, base, i, stop
+            i = stop + (-(stop - i)) % step
+
+def byte_feature_batches_np(fh, n=7, step=1, chunk_size=1<<20, bitlen=64, feature_hash="blake2b", weight_fn=None,
+                            offset=0, sample=1):
+    """
+    numpy-engine counterpart of stream_byte_features_fh. Yields (first_end, bits, weights):
+    bits is the (N, bitlen) 0/1 matrix of N kept windows ending at first_end,
+    first_end+step, ...; weights is None or the (N,) array of weight_fn(gram)
+    (of the feature keys, see weighs_keys).
+    sample > 1: only windows whose buzhash is divisible by sample are hashed, and
+    first_end is an (N,) int64 array with the end of each kept window.
+    """
+    check_feature_hash(feature_hash)
+    check_sample(sample, step)
+    d = bitlen // 8
+    blake = hashlib.blake2b
+    by_key = weighs_keys(weight_fn)
+    for buf, base, i, stop in iter_byte_window_ranges(fh, n=n, step=step, chunk_size=chunk_size, offset=offset):
+        grams = keys = h = None
+        if sample > 1:
+            h = buzhash_np(buf, i, stop, n)
+            starts = i + np.flatnonzero(h % np.uint64(sample) == 0)
+            if not len(starts):
                 continue
-            h = hash_feature_bytes(gram, bitlen=bitlen)
-            for i in range(bitlen):
-                vec[i] += w if (h >> i) & 1 else -w
-    return sign_from_vec(vec)
+            h = h[starts - i]
+        else:
+            starts = range(i, stop, step)
+        if feature_hash == "blake2b" or (weight_fn is not None and not by_key):
+            grams = [buf[j:j + n] for j in starts.tolist()] if h is not None else [buf[j:j + n] for j in starts]
+        if feature_hash == "rolling":
+            lanes = mix_lanes_np(h, bitlen) if h is not None else rolling_lanes_np(buf, i, stop, n, step, bitlen)
+            bits = lanes_to_bits(lanes, bitlen)
+            if by_key:
+                keys = lane_keys_np(lanes, bitlen)
+        else:
+            digests = b"".join([blake(g, digest_size=d).digest() for g in grams])
+            bits = digests_to_bits(digests, bitlen)
+            if by_key:
+                keys = digest_keys_np(digests, d)
+        if weight_fn is None:
+            weights = None
+        elif by_key:
+            weights = weight_fn(keys)
+        else:
+            weights = np.asarray([weight_fn(bytes(g)) for g in grams])
+        yield (base + n - 1 + starts if h is not None else base + i + n - 1), bits, weights
+
+def simhash_bytes(path, bitlen=64, n=7, step=1, chunk_size=1<<20, weight_fn=None, engine="python",
+                  feature_hash="blake2b", readahead=0, sample=1):
+    check_engine(engine)
+    check_sample(sample, step)
+    with open_binary(path, readahead) as fh:
+        return sign_from_vec(bytes_vector_fh(fh, bitlen=bitlen, n=n, step=step, chunk_size=chunk_size,
+                                             weight_fn=weight_fn, engine=engine, feature_hash=feature_hash,
+                                             sample=sample))
+
+def bytes_vector_fh(fh, bitlen=64, n=7, step=1, chunk_size=1<<20, weight_fn=None, engine="python",
+                    feature_hash="blake2b", offset=0, vec=None, sample=1):
+    """
+    Signed counter vector (list) of all byte n-grams of an open stream, added to
+    `vec` if given. offset as in iter_bytes_blocks_fh; sample as in check_sample.
+    """
+    if engine == "numpy":
+        acc = new_acc(bitlen) if vec is None else np.asarray(vec)
+        for _, bits, weights in byte_feature_batches_np(fh, n=n, step=step, chunk_size=chunk_size, bitlen=bitlen,
+                                                        feature_hash=feature_hash, weight_fn=weight_fn,
+                                                        offset=offset, sample=sample):
+            acc, _ = accumulate_bits(acc, bits, weights)
+        return acc.tolist()
+
+    vec = [0] * bitlen if vec is None else list(vec)
+    by_key = weighs_keys(weight_fn)
+    feats = stream_byte_features_fh(fh, n=n, step=step, chunk_size=chunk_size, bitlen=bitlen,
+                                    feature_hash=feature_hash, grams=weight_fn is not None and not by_key, offset=offset,
+                                    sample=sample)
+    if STATS is not None:
+        feats = STATS.counted(feats)
+    for _, gram, h in feats:
+        w = 1 if weight_fn is None else weight_fn(h & _M64) if by_key else weight_fn(gram)
+        if not w:
+            continue
+        for i in range(bitlen):
+            vec[i] += w if (h >> i) & 1 else -w
+    return vec
+
 # ---------- helpers for block mode ----------
 def sign_from_vec(vec):
     out = 0
@@ -122,96 +1026,1293 @@ def parse_size(s: str) -> int:
         raise ValueError(f"invalid size unit in {s!r}")
     return int(num * mult)
 
+class CountingReader:
+    """Thin read()/readinto() wrapper that counts the bytes handed out."""
+    def __init__(self, fh):
+        self.fh = fh
+        self.count = 0
+        if hasattr(fh, "readinto"):
+            self.readinto = self._readinto
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.count += len(data)
+        return data
+
+    def _readinto(self, b):
+        got = self.fh.readinto(b) or 0
+        self.count += got
+        return got
+
+def counting(fh):
+    """fh itself if it already knows its byte count (BufferReader), else a CountingReader."""
+    return fh if isinstance(fh, BufferReader) else CountingReader(fh)
+
+# ---------- block boundaries: fixed size or content-defined ----------
+CHUNKINGS = ("fixed", "cdc")
+
+class FixedBlocks:
+    """Block i is [i*block_size, (i+1)*block_size)."""
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.idx = 0
+        self.start = 0
+
+    def wrap(self, fh):
+        return fh
+
+    def next_cut(self):
+        """End of the current block (None if not known yet)."""
+        return self.start + self.block_size
+
+    def locate(self, e):
+        """Move to the block containing offset e; returns the end of the block left behind, or None."""
+        i = e // self.block_size
+        if i == self.idx:
+            return None
+        end = self.next_cut()
+        self.idx, self.start = i, i * self.block_size
+        return end
+
+    def final_end(self, total):
+        return min(total, self.next_cut())
+
+    def get_state(self):
+        """JSON-able position, for resuming (see simhash_bytes_incremental)."""
+        return {"idx": self.idx, "start": self.start}
+
+    def set_state(self, state):
+        self.idx, self.start = state["idx"], state["start"]
+
+_GEAR = [int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=8, person=b"simhash-gear").digest(), "big")
+         for i in range(256)]
+_GEAR_NP = np.array(_GEAR, dtype=np.uint64) if np is not None else None
+
+class CdcBlocks(FixedBlocks):
+    """
+    Content-defined block boundaries (FastCDC-style gear hash with normalized chunking).
+    fp_i = sum_k GEAR[b_(i-k)] << k (mod 2^64) depends only on the last 64 bytes, so
+    boundaries resynchronize right after an insert/delete and later blocks keep
+    their hashes. A block of length L ending at byte i is cut when
+        min <= L < avg  and  fp_i & mask_s == 0     (harder: more mask bits)
+        avg <= L < max  and  fp_i & mask_l == 0     (easier: fewer mask bits)
+        L == max.
+    Cuts are found as the bytes stream past (see ObservedReader), in O(1) memory;
+    with NumPy the gear hash of a chunk is 6 vectorized shift-add doubling steps.
+    """
+    def __init__(self, avg_size, min_size=None, max_size=None):
+        self.min_size = max(1, avg_size // 4 if min_size is None else min_size)
+        self.avg_size = avg_size
+        self.max_size = avg_size * 4 if max_size is None else max_size
+        if not self.min_size <= self.avg_size <= self.max_size:
+            raise ValueError(f"cdc sizes must satisfy min <= avg <= max "
+                             f"(got {self.min_size}, {self.avg_size}, {self.max_size})")
+        bits = max(1, round(math.log2(avg_size)))
+        # top bits of fp depend on the full 64-byte window
+        self.mask_s = ((1 << min(64, bits + 2)) - 1) << (64 - min(64, bits + 2))
+        self.mask_l = ((1 << max(1, bits - 2)) - 1) << (64 - max(1, bits - 2))
+        self.idx = 0
+        self.start = 0
+        self.cuts = deque()         # known boundaries not reached by the features yet
+        self._cut_start = 0         # start of the block the chunker is in
+        self._fp = 0
+        self._tail = b""            # last 63 bytes, for the vectorized gear hash
+        self._pos = 0               # offset of the next byte to consume
+
+    def wrap(self, fh):
+        return ObservedReader(fh, self.feed)
+
+    def next_cut(self):
+        return self.cuts[0] if self.cuts else None
+
+    def locate(self, e):
+        end = None
+        while self.cuts and e >= self.cuts[0]:
+            c = self.cuts.popleft()
+            if end is None:
+                end = c
+            self.idx += 1
+            self.start = c
+        return end
+
+    def final_end(self, total):
+        return min(total, self.cuts[0]) if self.cuts else total
+
+    def get_state(self):
+        return {"idx": self.idx, "start": self.start, "cuts": list(self.cuts), "cut_start": self._cut_start,
+                "pos": self._pos, "tail": self._tail.hex()}
+
+    def set_state(self, state):
+        self.idx, self.start = state["idx"], state["start"]
+        self.cuts = deque(state["cuts"])
+        self._cut_start, self._pos = state["cut_start"], state["pos"]
+        self._tail = bytes.fromhex(state["tail"])
+        self._fp = 0
+        for b in self._tail:        # fp beyond the tail only needs its last 63 bytes
+            self._fp = ((self._fp << 1) + _GEAR[b]) & _M64
+
+    def feed(self, view, base):
+        """Consume the next bytes of the stream (view[0] at absolute offset base); bytes already seen are skipped."""
+        if base < self._pos:
+            view = view[self._pos - base:]
+            base = self._pos
+        self._pos = base + len(view)
+        if np is not None:
+            self._feed_np(view, base)
+            return
+        G, ms, ml = _GEAR, self.mask_s, self.mask_l
+        mn, avg, mx = self.min_size, self.avg_size, self.max_size
+        fp = self._fp
+        s = self._cut_start
+        pos = base
+        for b in view:
+            fp = ((fp << 1) + G[b]) & _M64
+            ln = pos - s + 1
+            if ln >= mn and ((ln < avg and not fp & ms) or (ln >= avg and (ln >= mx or not fp & ml))):
+                s = pos + 1
+                self.cuts.append(s)
+            pos += 1
+        self._fp = fp
+        self._cut_start = s
+
+    def _feed_np(self, view, base):
+        data = np.frombuffer(view, dtype=np.uint8)
+        if not len(data):
+            return
+        hist = len(self._tail)
+        fp = _GEAR_NP[np.concatenate([np.frombuffer(self._tail, dtype=np.uint8), data])]
+        w = 1
+        while w < 64:
+            fp[w:] += fp[:-w] << np.uint64(w)       # numpy buffers the overlapping operands
+            w *= 2
+        self._tail = (bytes(self._tail) + bytes(view[-63:]))[-63:]
+        fp = fp[hist:]
+        idx = np.flatnonzero((fp & np.uint64(self.mask_l)) == 0)     # mask_l is a subset of mask_s
+        cand_l = idx + base
+        cand_s = idx[(fp[idx] & np.uint64(self.mask_s)) == 0] + base
+
+        def first(cands, lo, hi):
+            i = np.searchsorted(cands, lo)
+            return int(cands[i]) if i < len(cands) and cands[i] < hi else None
+
+        lo, hi = base, base + len(data)
+        while True:
+            s = self._cut_start
+            a, b, c = s + self.min_size - 1, s + self.avg_size - 1, s + self.max_size - 1
+            p = first(cand_s, max(a, lo), min(b, hi))
+            if p is None:
+                p = first(cand_l, max(b, lo), min(c, hi))
+            if p is None and c < hi:
+                p = c
+            if p is None:
+                break
+            self._cut_start = p + 1
+            self.cuts.append(p + 1)
+
+def make_blocks(block_size, chunking="fixed", cdc_min=None, cdc_max=None):
+    if chunking not in CHUNKINGS:
+        raise ValueError(f"unknown chunking: {chunking!r} (choose from {', '.join(CHUNKINGS)})")
+    if chunking == "cdc":
+        return CdcBlocks(block_size, cdc_min, cdc_max)
+    return FixedBlocks(block_size)
+
 # ---------- per-block SimHash (bytes mode) ----------
-def simhash_bytes_blocks(path, bitlen=128, n=7, step=1, block_size=1<<20, chunk_size=1<<20, weight_fn=None):
+def simhash_bytes_blocks(path, bitlen=128, n=7, step=1, block_size=1<<20, chunk_size=1<<20, weight_fn=None,
+                         engine="python", feature_hash="blake2b", chunking="fixed", cdc_min=None, cdc_max=None,
+                         vectors=False, file_record=False, readahead=0, sample=1):
     """
     Yield per-block SimHashes for binary data in bytes mode.
     Each n-gram contributes to the block where the window *ends*.
+    chunking="cdc": content-defined blocks averaging block_size bytes, at least
+    cdc_min (default block_size/4) and at most cdc_max (default 4*block_size).
     Yields dicts: {"block": idx, "start": start_byte, "end": end_byte_exclusive, "hash": int}
+    vectors=True adds each block's signed counter vector as "vector" (see coarsen_blocks).
+    file_record=True ends with the whole-file record {"hash": int} (same value as
+    simhash_bytes), summed from the block counters in the same pass.
+    readahead: see open_binary. sample: content-defined feature sampling (check_sample).
     """
-    with open_maybe_compressed(path, "rb") as fh:
-        vec = [0] * bitlen
-        window = deque(maxlen=n)
-        since = 0
-        byte_idx = 0                # total bytes consumed so far
-        current_block = 0
-        touched = False             # whether the current block got any contributions
-
-        def finalize(block_idx, upto_byte):
-            nonlocal vec, touched
-            if not touched:
-                return None
-            h = sign_from_vec(vec)
-            start = block_idx * block_size
-            end = min(upto_byte, (block_idx + 1) * block_size)
-            rec = {"block": block_idx, "start": start, "end": end, "hash": h}
+    check_engine(engine)
+    check_feature_hash(feature_hash)
+    check_sample(sample, step)
+    make_blocks(block_size, chunking, cdc_min, cdc_max)     # validate before opening
+    with open_binary(path, readahead) as fh:
+        yield from iter_bytes_blocks_fh(fh, bitlen=bitlen, n=n, step=step, block_size=block_size,
+                                        chunk_size=chunk_size, weight_fn=weight_fn, engine=engine,
+                                        feature_hash=feature_hash, chunking=chunking,
+                                        cdc_min=cdc_min, cdc_max=cdc_max,
+                                        vectors=vectors, file_record=file_record, sample=sample)
+
+def iter_bytes_blocks_fh(fh, bitlen=128, n=7, step=1, block_size=1<<20, chunk_size=1<<20, weight_fn=None,
+                         engine="python", feature_hash="blake2b", offset=0, chunking="fixed",
+                         cdc_min=None, cdc_max=None, vectors=False, file_record=False, sample=1):
+    """
+    Block records for an open binary stream (body of simhash_bytes_blocks).
+    offset: absolute position of fh's first byte. A stream starting at
+    block_start - (n-1) yields exactly the records of the full stream for
+    the blocks it covers, which is what simhash_bytes_blocks_parallel uses
+    (fixed-size blocks only: content-defined cuts depend on everything before).
+    """
+    blocks = make_blocks(block_size, chunking, cdc_min, cdc_max)
+    body = _simhash_bytes_blocks_np if engine == "numpy" else _simhash_bytes_blocks_py
+    records = body(fh, bitlen, n, step, blocks, chunk_size, weight_fn, feature_hash, offset=offset,
+                   vectors=vectors or file_record, sample=sample)
+    if file_record:
+        records = add_file_record(records, bitlen, vectors=vectors)
+    yield from records
+
+def add_vectors(a, b):
+    return [x + y for x, y in zip(a, b)]
+
+def add_file_record(records, bitlen, vectors=False):
+    """
+    Pass block records (which must carry "vector") through and append the
+    whole-file record: counters are additive, so the file's counter vector is
+    the sum of its blocks'. "vector" is dropped from the output unless vectors=True.
+    """
+    total = [0] * bitlen
+    for rec in records:
+        vec = rec["vector"] if vectors else rec.pop("vector")
+        total = add_vectors(total, vec)
+        yield rec
+    rec = {"hash": sign_from_vec(total)}
+    if vectors:
+        rec["vector"] = total
+    yield rec
+
+def coarsen_blocks(records, factor):
+    """
+    Merge exported block records (with "vector") into blocks `factor` times
+    larger, without rereading the data: block i of the result covers source
+    blocks [i*factor, (i+1)*factor). Records must be in block order; whole-file
+    records are passed through.
+    """
+    cur = None
+    for rec in records:
+        if "block" not in rec:
+            if cur:
+                yield cur
+                cur = None
+            yield rec
+            continue
+        idx = rec["block"] // factor
+        if cur and cur["block"] == idx:
+            cur["end"] = rec["end"]
+            cur["vector"] = add_vectors(cur["vector"], rec["vector"])
+        else:
+            if cur:
+                yield cur
+            cur = {**rec, "block": idx, "vector": list(rec["vector"])}
+        cur["hash"] = sign_from_vec(cur["vector"])
+    if cur:
+        yield cur
+
+def _simhash_bytes_blocks_py(fh, bitlen, n, step, blocks, chunk_size, weight_fn, feature_hash="blake2b",
+                             offset=0, vectors=False, init=None, sample=1):
+    """python-engine body of simhash_bytes_blocks; init: counter vector of a resumed open block."""
+    reader = counting(fh)
+    vec = [0] * bitlen if init is None else list(init)
+    touched = init is not None  # whether the current block got any contributions
+
+    def record(block_idx, start, end):
+        rec = {"block": block_idx, "start": start, "end": end, "hash": sign_from_vec(vec)}
+        if vectors:
+            rec["vector"] = vec
+        return rec
+
+    by_key = weighs_keys(weight_fn)
+    feats = stream_byte_features_fh(blocks.wrap(reader), n=n, step=step, chunk_size=chunk_size, bitlen=bitlen,
+                                    feature_hash=feature_hash, grams=weight_fn is not None and not by_key,
+                                    offset=offset, sample=sample)
+    if STATS is not None:
+        feats = STATS.counted(feats)
+    for end_pos, gram, h in feats:
+        # finalize the completed block (blocks in between got no windows)
+        block_idx, start = blocks.idx, blocks.start
+        closed = blocks.locate(end_pos)
+        if closed is not None and touched:
+            yield record(block_idx, start, closed)
             vec = [0] * bitlen
             touched = False
-            return rec
 
-        while True:
-            data = fh.read(chunk_size)
-            if not data:
-                break
-            for b in data:
-                window.append(b)
-                byte_idx += 1
-                if len(window) == n:
-                    if since == 0:
-                        # this window ends at byte (byte_idx-1)
-                        end_pos = byte_idx - 1
-                        block_idx = end_pos // block_size
-
-                        # finalize fully completed blocks
-                        while block_idx > current_block:
-                            rec = finalize(current_block, byte_idx - 1)
-                            if rec is not None:
-                                yield rec
-                            current_block += 1
-
-                        # contribute this window to the current block
-                        w = 1 if weight_fn is None else weight_fn(bytes(window))
-                        if w:
-                            h = hash_feature_bytes(bytes(window), bitlen=bitlen)
-                            for i in range(bitlen):
-                                vec[i] += w if (h >> i) & 1 else -w
-                            touched = True
-                    since = (since + 1) % step
-
-        # finalize last block
-        rec = finalize(current_block, byte_idx)
-        if rec is not None:
-            yield rec
+        # contribute this window to the current block
+        w = 1 if weight_fn is None else weight_fn(h & _M64) if by_key else weight_fn(gram)
+        if w:
+            for i in range(bitlen):
+                vec[i] += w if (h >> i) & 1 else -w
+            touched = True
 
-# ---------- CLI ----------
-def iter_input_paths(paths, recursive=False):
-    for p in paths:
-        if p == "-":
-            yield p
-            continue
-        p = Path(p)
-        if p.is_dir():
-            if recursive:
-                for q in p.rglob("*"):
-                    if q.is_file():
-                        yield str(q)
+    # finalize last block
+    if touched:
+        yield record(blocks.idx, blocks.start, blocks.final_end(offset + reader.count))
+
+def _simhash_bytes_blocks_np(fh, bitlen, n, step, blocks, chunk_size, weight_fn, feature_hash="blake2b",
+                             offset=0, vectors=False, init=None, sample=1):
+    """numpy-engine body of simhash_bytes_blocks: same records, accumulated per batch."""
+    reader = counting(fh)
+    acc = new_acc(bitlen) if init is None else np.asarray(init)
+    touched = init is not None
+
+    def record(block_idx, start, end):
+        rec = {"block": block_idx, "start": start, "end": end, "hash": sign_from_acc(acc)}
+        if vectors:
+            rec["vector"] = acc.tolist()
+        return rec
+
+    batches = byte_feature_batches_np(blocks.wrap(reader), n=n, step=step, chunk_size=chunk_size, bitlen=bitlen,
+                                      feature_hash=feature_hash, weight_fn=weight_fn, offset=offset, sample=sample)
+    for first_end, bits, weights in batches:
+        j = 0
+        while j < len(bits):
+            e = int(first_end[j]) if sample > 1 else first_end + j * step
+            block_idx, start = blocks.idx, blocks.start
+            closed = blocks.locate(e)
+            if closed is not None and touched:
+                yield record(block_idx, start, closed)
+                acc = new_acc(bitlen)
+                touched = False
+            # windows j, j+1, ... that still end inside the current block
+            cut = blocks.next_cut()
+            if cut is None:
+                k = len(bits) - j
+            elif sample > 1:
+                k = int(np.searchsorted(first_end, cut)) - j
             else:
-                for q in p.iterdir():
-                    if q.is_file():
-                        yield str(q)
-        elif p.exists():
-            yield str(p)
+                k = min(len(bits) - j, -(-(cut - e) // step))
+            acc, contributed = accumulate_bits(acc, bits[j:j + k], None if weights is None else weights[j:j + k])
+            touched = touched or contributed > 0
+            j += k
+
+    if touched:
+        yield record(blocks.idx, blocks.start, blocks.final_end(offset + reader.count))
+
+# ---------- per-block SimHash (text mode) ----------
+def simhash_text_blocks(path, bitlen=128, ngram=3, block_tokens=None, block_size=None, chunk_size=1<<20,
+                        weight_fn=None, engine="python", vectors=False, file_record=False, readahead=0):
+    """
+    Yield per-block SimHashes of text from token n-gram features, streamed in
+    bounded memory (also through .gz/.bz2/.xz). Blocks hold block_tokens tokens,
+    or end at the first token boundary at least block_size bytes after their start.
+    Each n-gram contributes to the block of its last token.
+    Yields dicts: {"block", "start", "end" (bytes), "char_start", "char_end", "tokens", "hash"};
+    vectors/file_record/readahead as in simhash_bytes_blocks.
+    """
+    check_engine(engine)
+    if not block_tokens and not block_size:
+        raise ValueError("text blocks need block_tokens or block_size")
+    with open_binary(path, readahead) as fh:
+        records = _simhash_text_blocks_fh(fh, bitlen, ngram, block_tokens, block_size, chunk_size, weight_fn,
+                                          engine, vectors or file_record)
+        if file_record:
+            records = add_file_record(records, bitlen, vectors=vectors)
+        yield from records
+
+def _simhash_text_blocks_fh(fh, bitlen, ngram, block_tokens, block_size, chunk_size, weight_fn, engine, vectors):
+    tokens = TokenReader(fh, chunk_size)
+    window = deque(maxlen=max(1, ngram))
+    numpy = engine == "numpy"
+    by_key = weighs_keys(weight_fn)
+    key = lambda f: f.encode("utf-8", "ignore")
+    vec = new_acc(bitlen) if numpy else [0] * bitlen
+    batch = []
+    touched = False
+    idx = ntok = 0
+    start = cstart = 0
+
+    def flush():
+        nonlocal vec, batch, touched
+        if batch:
+            vec, contributed = accumulate_features_np(vec, batch, bitlen, weight_fn=weight_fn, key=key)
+            touched = touched or contributed > 0
+            batch = []
+
+    def record(end, cend):
+        rec = {"block": idx, "start": start, "end": end, "char_start": cstart, "char_end": cend,
+               "tokens": ntok, "hash": sign_from_acc(vec) if numpy else sign_from_vec(vec)}
+        if vectors:
+            rec["vector"] = vec.tolist() if numpy else vec
+        return rec
+
+    for tok, b, c in tokens:
+        if ntok and ((block_tokens and ntok >= block_tokens) or (block_size and b - start >= block_size)):
+            flush()
+            if touched:
+                yield record(b, c)
+            vec = new_acc(bitlen) if numpy else [0] * bitlen
+            touched = False
+            idx, ntok, start, cstart = idx + 1, 0, b, c
+        ntok += 1
+        window.append(tok)
+        if len(window) < ngram:
+            continue
+        feat = " ".join(window)
+        if numpy:
+            batch.append(feat)
+            if len(batch) >= NUMPY_BATCH:
+                flush()
+            continue
+        if by_key:
+            h = hash_feature_bytes(key(feat), bitlen=bitlen)
+            w = weight_fn(h & _M64)
+        else:
+            w = 1 if weight_fn is None else weight_fn(feat)
+            h = hash_feature_bytes(key(feat), bitlen=bitlen) if w else 0
+        if w:
+            for i in range(bitlen):
+                vec[i] += w if (h >> i) & 1 else -w
+            touched = True
+
+    flush()
+    if STATS is not None and not numpy:
+        STATS.features += max(0, tokens.tokens - max(1, ngram) + 1)
+    if touched:
+        yield record(tokens.bytes, tokens.chars)
+
+# ---------- resumable hashing (append-only plain files) ----------
+def _open_range(path, lo, hi):
+    """MmapReader over path[lo:hi], counted by --stats like open_binary's readers."""
+    fh = MmapReader(path, lo, hi)
+    return fh if STATS is None else STATS.reader(path, fh, True)
+
+def simhash_bytes_incremental(path, state=None, bitlen=128, n=7, step=1, chunk_size=1<<20, weight_fn=None,
+                              engine="python", feature_hash="blake2b", block_size=None, chunking="fixed",
+                              cdc_min=None, cdc_max=None, vectors=False, file_record=False, sample=1):
+    """
+    Hash a plain file, continuing from `state` (returned by an earlier call for a
+    prefix of the same file, with the same options) instead of rereading that prefix.
+    Only the n-1 bytes before the stored offset are read again. Checking that the
+    prefix is unchanged is the caller's job (simhash_resume.ResumeStore).
+    Returns (records, state): the records simhash_bytes (as [{"hash"}]) or
+    simhash_bytes_blocks would give for the whole file, and the state to resume from next.
+    """
+    check_engine(engine)
+    check_feature_hash(feature_hash)
+    check_sample(sample, step)
+    size = os.path.getsize(path)
+    lo = max(0, state["offset"] - (n - 1)) if state else 0
+
+    if block_size is None:
+        vec = state["vector"] if state else [0] * bitlen
+        if size:
+            with _open_range(path, lo, size) as reader:
+                vec = bytes_vector_fh(reader, bitlen=bitlen, n=n, step=step, chunk_size=chunk_size,
+                                      weight_fn=weight_fn, engine=engine, feature_hash=feature_hash,
+                                      offset=lo, vec=vec, sample=sample)
+        rec = {"hash": sign_from_vec(vec)}
+        if vectors:
+            rec["vector"] = vec
+        return [rec], {"offset": size, "vector": vec}
+
+    blocks = make_blocks(block_size, chunking, cdc_min, cdc_max)
+    records = []
+    init = None
+    if state:
+        blocks.set_state(state["blocks"])
+        records = [{"block": b, "start": s, "end": e, "hash": sign_from_vec(v), "vector": v}
+                   for b, s, e, v in state["records"]]
+        if records and records[-1]["block"] == blocks.idx:
+            init = records.pop()["vector"]      # the last block may still grow
+    if size:
+        body = _simhash_bytes_blocks_np if engine == "numpy" else _simhash_bytes_blocks_py
+        with _open_range(path, lo, size) as reader:
+            records += body(reader, bitlen, n, step, blocks, chunk_size, weight_fn, feature_hash, offset=lo,
+                            vectors=True, init=init, sample=sample)
+    new_state = {"offset": size, "blocks": blocks.get_state(),
+                 "records": [[r["block"], r["start"], r["end"], r["vector"]] for r in records]}
+    if file_record:
+        records = list(add_file_record(records, bitlen, vectors=vectors))
+    elif not vectors:
+        for r in records:
+            del r["vector"]
+    return records, new_state
+
+# ---------- in-memory batch API ----------
+def _combine_at_np(vals, starts, n):
+    """XOR of rotl(vals[j+k], n-1-k) over k < n for every j in starts: buzhash of byte
+    windows (vals = table entries) or n-gram hashes of token hashes."""
+    h = np.zeros(len(starts), dtype=np.uint64)
+    for k in range(n):
+        h ^= _rotl64_np(vals[starts + k], n - 1 - k)
+    return h
+
+def _pack_signs(acc):
+    """(N, bitlen) counter sums -> (N, ceil(bitlen/64)) uint64; bit i of lane j is bit 64j+i of the hash."""
+    signs = np.packbits(acc > 0, axis=1, bitorder="little")
+    lanes = -(-acc.shape[1] // 64)
+    signs = np.pad(signs, ((0, 0), (0, 8 * lanes - signs.shape[1])))
+    return signs.view("<u8").astype(np.uint64)
+
+def pack_hashes(hashes, bitlen=64):
+    """Python int fingerprints -> (N, ceil(bitlen/64)) uint64 array in simhash_many's layout."""
+    lanes = -(-bitlen // 64)
+    return np.array([[(h >> (64 * j)) & _M64 for j in range(lanes)] for h in hashes],
+                    dtype=np.uint64).reshape(-1, lanes)
+
+def unpack_hashes(packed):
+    """Inverse of pack_hashes: a list of python ints."""
+    return [sum(v << (64 * j) for j, v in enumerate(row)) for row in np.asarray(packed).tolist()]
+
+class _ManyBatch:
+    """Features of several small documents, hashed and accumulated together (see simhash_many)."""
+    def __init__(self, bitlen, weight_fn):
+        self.bitlen, self.weight_fn = bitlen, weight_fn
+        self.by_key = weighs_keys(weight_fn)
+        self.rows = []          # per document: index of its first feature
+        self.count = 0
+
+    def votes(self, bits, weights):
+        """(documents, bitlen) counter sums of the feature rows of each document."""
+        seg = np.array(self.rows + [len(bits)])
+        floats = weights is not None and weights.dtype.kind == "f"
+        acc = np.zeros((len(self.rows), self.bitlen), dtype=np.float64 if floats else np.int64)
+        docs = np.flatnonzero(seg[1:] > seg[:-1])       # documents with at least one feature
+        if weights is None and len(docs):
+            acc[docs] = sum_votes(bits, seg[docs], seg[docs + 1] - seg[docs])
+            return acc
+        for k in docs:
+            lo, hi = seg[k], seg[k + 1]
+            acc[k], _ = accumulate_bits(acc[k], bits[lo:hi], None if weights is None else weights[lo:hi])
+        return acc
+
+def _many_bytes(docs, bitlen, n, step, weight_fn, feature_hash):
+    """Counter sums of a group of byte documents: all their windows hashed in one batch."""
+    batch = _ManyBatch(bitlen, weight_fn)
+    buf = b"".join(docs)
+    sizes = np.array([len(d) for d in docs], dtype=np.int64)
+    counts = np.maximum(0, (sizes - n) // step + 1)         # windows per document
+    firsts = np.cumsum(counts) - counts
+    batch.rows = firsts.tolist()
+    batch.count = int(counts.sum())
+    # window k of a document starts k * step bytes into it
+    starts = np.repeat(np.cumsum(sizes) - sizes, counts) + (np.arange(batch.count) - np.repeat(firsts, counts)) * step
+    grams = keys = None
+    if feature_hash == "blake2b" or (weight_fn is not None and not batch.by_key):
+        grams = [buf[j:j + n] for j in starts.tolist()]
+    if feature_hash == "rolling":
+        h = _combine_at_np(_BUZ_NP[np.frombuffer(buf, dtype=np.uint8)], starts, n)
+        lanes = mix_lanes_np(h, bitlen)
+        bits = lanes_to_bits(lanes, bitlen)
+        if batch.by_key:
+            keys = lane_keys_np(lanes, bitlen)
+    else:
+        d = bitlen // 8
+        digests = b"".join([hashlib.blake2b(g, digest_size=d).digest() for g in grams])
+        bits = digests_to_bits(digests, bitlen)
+        if batch.by_key:
+            keys = digest_keys_np(digests, d)
+    if weight_fn is None:
+        weights = None
+    elif batch.by_key:
+        weights = weight_fn(keys)
+    else:
+        weights = np.asarray([weight_fn(g) for g in grams])
+    return batch.votes(bits, weights)
+
+class _TokenHashes(dict):
+    """hash_token of each distinct token, computed on first lookup."""
+    def __missing__(self, tok):
+        h = self[tok] = hash_token(tok)
+        return h
+
+def _many_text(docs, bitlen, ngram, weight_fn, feature_hash, chunk_size):
+    """Counter sums of a group of text documents (token n-grams as in simhash_text)."""
+    batch = _ManyBatch(bitlen, weight_fn)
+    n = max(1, ngram)
+    grams, th, firsts, counts = [], [], [], []
+    token_hash = _TokenHashes().__getitem__
+    for d in docs:
+        batch.rows.append(batch.count)
+        if len(d) <= chunk_size and isinstance(d, bytes):
+            # one chunk: the tokens of iter_token_chunks without a reader and generator per document
+            toks = _WORD_RE_B.findall(d.lower()) if d.isascii() else \
+                [t.encode("utf-8") for t in WORD_RE.findall(d.decode("utf-8", "surrogateescape").lower())]
         else:
-            # allow globs passed unexpanded on Windows/powershell
-            for q in Path().glob(str(p)):
-                if q.is_file():
-                    yield str(q)
+            toks = [t for chunk in iter_token_chunks(BufferReader(d), chunk_size) for t in chunk]
+        m = max(0, len(toks) - n + 1)
+        if feature_hash == "blake2b" or (weight_fn is not None and not batch.by_key):
+            grams += toks if n == 1 else [b" ".join(toks[i:i + n]) for i in range(m)]
+        if feature_hash == "rolling":
+            firsts.append(len(th))
+            counts.append(m)
+            th.extend(map(token_hash, toks))
+        batch.count += m
+    keys = None
+    if feature_hash == "rolling":
+        # feature k of a document starts at its first token + k
+        counts = np.array(counts, dtype=np.int64)
+        starts = np.arange(batch.count) + np.repeat(np.array(firsts, dtype=np.int64) - (np.cumsum(counts) - counts),
+                                                    counts)
+        lanes = mix_lanes_np(_combine_at_np(np.array(th, dtype=np.uint64), starts, n), bitlen)
+        bits = lanes_to_bits(lanes, bitlen)
+        if batch.by_key:
+            keys = lane_keys_np(lanes, bitlen)
+    else:
+        d = bitlen // 8
+        digests = b"".join([hashlib.blake2b(g, digest_size=d).digest() for g in grams])
+        bits = digests_to_bits(digests, bitlen)
+        if batch.by_key:
+            keys = digest_keys_np(digests, d)
+    if weight_fn is None:
+        weights = None
+    elif batch.by_key:
+        weights = weight_fn(keys)
+    else:
+        weights = np.asarray([weight_fn(g.decode("utf-8")) for g in grams])
+    return batch.votes(bits, weights)
+
+def simhash_many(docs, mode="bytes", bitlen=64, ngram=None, step=1, weight_fn=None, feature_hash="blake2b",
+                 batch=NUMPY_BATCH, chunk_size=1<<20):
+    """
+    Fingerprints of in-memory documents (bytes, bytearray, memoryview or str, which
+    is UTF-8 encoded) as an (N, ceil(bitlen/64)) uint64 array: lane j of row k holds
+    bits 64j..64j+63 of the k-th document's hash (see pack_hashes/unpack_hashes).
+    Same features and hashes as simhash_bytes/simhash_text on a file with the same
+    content (ngram defaults to 7 for bytes, 3 for text; step is bytes-only).
+    Small documents are grouped until they have `batch` features between them and
+    hashed and accumulated in one vectorized step; larger ones are streamed alone.
+    Needs NumPy.
+    """
+    check_engine("numpy")
+    check_feature_hash(feature_hash)
+    if mode not in ("bytes", "text"):
+        raise ValueError(f"unknown mode: {mode!r} (choose from bytes, text)")
+    n = ngram or (7 if mode == "bytes" else 3)
+    out = []
+    group, size = [], 0
+
+    def flush():
+        nonlocal group, size
+        if group:
+            if mode == "bytes":
+                out.append(_many_bytes(group, bitlen, n, step, weight_fn, feature_hash))
+            else:
+                out.append(_many_text(group, bitlen, n, weight_fn, feature_hash, chunk_size))
+            group, size = [], 0
+
+    for doc in docs:
+        if isinstance(doc, str):
+            doc = doc.encode("utf-8")
+        if mode == "bytes" and len(doc) // step > batch:
+            flush()
+            vec = bytes_vector_fh(BufferReader(doc), bitlen=bitlen, n=n, step=step, chunk_size=chunk_size,
+                                  weight_fn=weight_fn, engine="numpy", feature_hash=feature_hash)
+            out.append(np.array([vec]))
+            continue
+        group.append(doc)
+        size += len(doc) // step if mode == "bytes" else len(doc) // 4     # ~features
+        if size >= batch:
+            flush()
+    flush()
+    if not out:
+        return np.zeros((0, -(-bitlen // 64)), dtype=np.uint64)
+    return _pack_signs(np.concatenate(out))
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8) if np is not None else None
+
+def popcount_np(a):
+    """Set bits per element of an unsigned integer array."""
+    if hasattr(np, "bitwise_count"):       # NumPy >= 2.0
+        return np.bitwise_count(a)
+    return _POPCOUNT8[np.ascontiguousarray(a).view(np.uint8)].reshape(*a.shape, -1).sum(axis=-1, dtype=np.uint8)
+
+def hamming_one_to_many(query, packed):
+    """Hamming distances (N,) between one fingerprint (int, or a packed row) and an (N, L) packed array."""
+    packed = np.asarray(packed, dtype=np.uint64)
+    if isinstance(query, int):
+        query = pack_hashes([query], 64 * packed.shape[1])[0]
+    return popcount_np(packed ^ np.asarray(query, dtype=np.uint64)).sum(axis=1, dtype=np.int64)
+
+def hamming_many_to_many(a, b, rows=None):
+    """
+    (Na, Nb) matrix of Hamming distances between two packed arrays, computed
+    `rows` rows of a at a time to bound the (rows, Nb, L) temporary (default: ~64 MB).
+    """
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    out = np.empty((len(a), len(b)), dtype=np.int32)
+    rows = rows or max(1, (8 << 20) // max(1, b.size))
+    for i in range(0, len(a), rows):
+        x = a[i:i + rows, None, :] ^ b[None, :, :]
+        out[i:i + rows] = popcount_np(x).sum(axis=2)
+    return out
+
+# ---------- record streams (--records) ----------
+RECORD_SEPARATORS = {"jsonl": b"\n", "ndjson": b"\n", "nul": b"\0"}
+RECORD_BATCH = 4096         # records split, parsed and hashed together
+
+def iter_stream_records(fh, sep=b"\n", chunk_size=1<<20):
+    """
+    (number, start, end, bytes) of the sep-terminated records of a binary stream:
+    numbers count from 1 (for "\\n", the line number), start/end are offsets in the
+    (decompressed) stream without the separator. A "\\r" before "\\n" is dropped;
+    blank records are skipped but counted.
+    """
+    for group in iter_record_groups(fh, sep, chunk_size):
+        yield from group
+
+def iter_record_groups(fh, sep=b"\n", chunk_size=1<<20):
+    """iter_stream_records as one list per read call: the records that read completed (never empty)."""
+    pieces, base, number = [], 0, 0     # pieces: the unterminated record so far, starting at base
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            break
+        chunk = bytes(chunk)
+        if sep not in chunk:
+            pieces.append(chunk)
+            continue
+        pieces.append(chunk)
+        parts = b"".join(pieces).split(sep)
+        tail = parts.pop()
+        pos, group = base, []
+        for p in parts:
+            number += 1
+            end = pos + len(p)
+            if sep == b"\n" and p.endswith(b"\r"):
+                p = p[:-1]
+            if p.strip():
+                group.append((number, pos, pos + len(p), p))
+            pos = end + 1
+        pieces, base = [tail], pos
+        if group:
+            yield group
+    tail = b"".join(pieces)
+    if sep == b"\n" and tail.endswith(b"\r"):
+        tail = tail[:-1]
+    if tail.strip():
+        yield [(number + 1, base, base + len(tail), tail)]
+
+def parse_field_path(expr):
+    """'a.b.0' -> ("a", "b", "0"): dict keys, or list indices where the value is a list."""
+    parts = tuple(expr.split("."))
+    if not expr or "" in parts:
+        raise ValueError(f"bad field path {expr!r} (use dotted keys, e.g. request.body or items.0.text)")
+    return parts
+
+def select_fields(obj, paths):
+    """
+    The values at paths in a parsed JSON record joined by newlines (strings as they
+    are, anything else as compact JSON), or None when the record has none of them.
+    """
+    out = []
+    for path in paths:
+        v = obj
+        for key in path:
+            if isinstance(v, dict):
+                v = v.get(key)
+            elif isinstance(v, list) and key.lstrip("-").isdigit() and -len(v) <= int(key) < len(v):
+                v = v[int(key)]
+            else:
+                v = None
+            if v is None:
+                break
+        if v is not None:
+            out.append(v if isinstance(v, str) else json.dumps(v, ensure_ascii=False, separators=(",", ":"),
+                                                               sort_keys=True))
+    return "\n".join(out) if out else None
+
+def parse_json_batch(datas):
+    """
+    json.loads of each record, as one call over the whole batch (a JSON array of them);
+    a record that does not parse on its own gets its ValueError instead.
+    """
+    try:
+        objs = json.loads(b"[" + b",".join(datas) + b"]")
+        if len(objs) == len(datas):
+            return objs
+    except ValueError:
+        pass
+    out = []
+    for d in datas:
+        try:
+            out.append(json.loads(d))
+        except ValueError as e:
+            out.append(e)
+    return out
+
+def simhash_records(path, sep=b"\n", fields=None, bitlen=128, mode="bytes", ngram=7, step=1, weight_fn=None,
+                    feature_hash="blake2b", chunk_size=1<<20, readahead=0, batch=RECORD_BATCH):
+    """
+    One fingerprint per record of a record stream (JSONL, NUL-separated; plain or
+    .gz/.bz2/.xz): {"line", "start", "end", "hash"} dicts, in stream order (see
+    iter_stream_records). fields: parse_field_path tuples; records are then parsed as
+    JSON and only the selected values are hashed (records with none of them are
+    skipped, ones that are not JSON give {"line", "error"}). Records are hashed
+    `batch` at a time with simhash_many (mode "bytes" or "text"), so each one gets
+    the fingerprint its content would get as a file. Needs NumPy.
+    """
+    check_engine("numpy")
+    with open_binary(path, readahead=readahead) as fh:
+        for group in batched(iter_stream_records(fh, sep, chunk_size), batch):
+            if fields:
+                objs = parse_json_batch([r[3] for r in group])
+                docs, out = [], []
+                for r, obj in zip(group, objs):
+                    if isinstance(obj, ValueError):
+                        out.append({"line": r[0], "error": f"{type(obj).__name__}: {obj}"})
+                        continue
+                    text = select_fields(obj, fields)
+                    if text is not None:
+                        docs.append(text.encode("utf-8", "surrogatepass"))
+                        out.append({"line": r[0], "start": r[1], "end": r[2]})
+            else:
+                docs = [r[3] for r in group]
+                out = [{"line": r[0], "start": r[1], "end": r[2]} for r in group]
+            hashes = iter(unpack_hashes(simhash_many(docs, mode=mode, bitlen=bitlen, ngram=ngram, step=step,
+                                                     weight_fn=weight_fn, feature_hash=feature_hash,
+                                                     chunk_size=chunk_size)))
+            for rec in out:
+                if "error" not in rec:
+                    rec["hash"] = next(hashes)
+                yield rec
+
+# ---------- intra-file parallel blocks (plain files) ----------
+def _hash_block_range(path, lo, hi, kw):
+    """Worker for simhash_bytes_blocks_parallel: the records of blocks [lo, hi) of a plain file."""
+    block_size, n = kw["block_size"], kw["n"]
+    start = lo * block_size
+    off = max(0, start - (n - 1))           # n-1 bytes of overlap for n-grams ending in this range
+    with MmapReader(path, off, hi * block_size) as reader:
+        return list(iter_bytes_blocks_fh(reader, offset=off, **kw))
+
+def simhash_bytes_blocks_parallel(path, bitlen=128, n=7, step=1, block_size=1<<20, chunk_size=1<<20, weight_fn=None,
+                                  engine="python", feature_hash="blake2b", jobs=None, blocks_per_task=None,
+                                  chunking="fixed", cdc_min=None, cdc_max=None, vectors=False, file_record=False,
+                                  readahead=0, sample=1):
+    """
+    simhash_bytes_blocks for one large file, split across a process pool.
+    The file is memory-mapped and cut into block-aligned ranges; each worker also
+    reads the n-1 bytes before its range so n-grams crossing the edge land in the
+    right block, and the `step` phase follows the absolute offset. Records are
+    yielded in block order and are identical to simhash_bytes_blocks.
+    Compressed inputs, stdin and content-defined blocks (chunking="cdc", whose cuts
+    depend on all earlier bytes) can't be split and fall back to the sequential path.
+    weight_fn must be picklable (a module-level function, not a lambda).
+    """
+    check_engine(engine)
+    check_feature_hash(feature_hash)
+    check_sample(sample, step)
+    kw = dict(bitlen=bitlen, n=n, step=step, block_size=block_size, chunk_size=chunk_size,
+              weight_fn=weight_fn, engine=engine, feature_hash=feature_hash, sample=sample)
+    if chunking != "fixed" or not is_plain_file(path):
+        yield from simhash_bytes_blocks(path, chunking=chunking, cdc_min=cdc_min, cdc_max=cdc_max,
+                                        vectors=vectors, file_record=file_record, readahead=readahead, **kw)
+        return
+    kw["vectors"] = vectors or file_record
+    records = _iter_block_ranges(path, kw, jobs, blocks_per_task)
+    if file_record:
+        records = add_file_record(records, bitlen, vectors=vectors)
+    yield from records
+
+def _iter_block_ranges(path, kw, jobs, blocks_per_task):
+    """Block records of a plain file from block-aligned ranges hashed in a process pool, in order."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = jobs or os.cpu_count() or 1
+    block_size = kw["block_size"]
+    nblocks = -(-os.path.getsize(path) // block_size)
+    if not blocks_per_task:
+        blocks_per_task = max(1, -(-nblocks // (4 * jobs)))
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for lo in range(0, nblocks, blocks_per_task):
+            pending.append(pool.submit(_hash_block_range, path, lo, min(lo + blocks_per_task, nblocks), kw))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+# ---------- CLI ----------
+def iter_input_paths(paths, recursive=False, walker=None):
+    """Input files for the CLI arguments; see simhash_walk.Walker (default: no filters, no de-duplication)."""
+    return (walker or Walker(dedup=False)).walk(paths, recursive=recursive)
 
 def to_fixed_hex(h: int, bitlen: int) -> str:
     width = (bitlen + 3) // 4
     return f"{h:0{width}x}"
 
+def mode_label(mode: str, feature_hash: str) -> str:
+    """TSV mode column; non-default feature hashes are tagged so their fingerprints never get compared by mistake."""
+    return mode if feature_hash == "blake2b" else f"{mode}+{feature_hash}"
+
+def _size_or_none(text):
+    return parse_size(text) if text else None
+
+def iter_path_records(path, args):
+    """
+    All output records for one input path, as plain dicts:
+    whole-file {"path", "hash"} or per-block {"path", "block", "start", "end", "hash"}
+    (then, with --with-file, the whole-file record from the same pass; --vectors adds "vector"),
+    or with --records per-record {"path", "line", "start", "end", "hash"}.
+    With --stats the last record also carries "stats", the file's simhash_stats report.
+    """
+    records = _path_records(path, args)
+    return _with_stats(records) if getattr(args, "stats", False) else records
+
+def _with_stats(records):
+    """Step through a file's records with a fresh Stats active; its report goes on the last record."""
+    global STATS
+    st, last = Stats(), None
+    st.files = 1
+    while True:
+        prev, STATS = STATS, st
+        try:
+            with st.stage("total"):
+                rec = next(records, None)
+        finally:
+            STATS = prev
+        if rec is None:
+            break
+        if last is not None:
+            yield last
+        last = rec
+    if last is not None:
+        last["stats"] = st.report()
+        yield last
+
+def _path_records(path, args):
+    block_bytes = parse_size(args.block_size) if args.block_size else None
+    weight_fn = getattr(args, "weight_fn", None)
+    if getattr(args, "records", None):
+        for rec in simhash_records(path, sep=RECORD_SEPARATORS[args.records], fields=args.fields, bitlen=args.bitlen,
+                                   mode=args.mode, ngram=args.ngram, step=args.step, weight_fn=weight_fn,
+                                   feature_hash=args.feature_hash, chunk_size=args.chunk_size,
+                                   readahead=args.readahead):
+            yield {"path": path, **rec}
+        return
+    if getattr(args, "resume_store", None) is not None and args.mode == "bytes" and is_plain_file(path):
+        yield from resume_path_records(path, args, block_bytes)
+        return
+    if args.mode == "text" and (block_bytes or args.block_tokens):
+        for rec in simhash_text_blocks(path, bitlen=args.bitlen, ngram=args.ngram, block_tokens=args.block_tokens,
+                                       block_size=block_bytes, chunk_size=args.chunk_size, weight_fn=weight_fn,
+                                       engine=args.engine, vectors=args.vectors, file_record=args.with_file,
+                                       readahead=args.readahead):
+            yield {"path": path, **rec}
+        return
+    if block_bytes:
+        kw = dict(bitlen=args.bitlen, n=args.ngram, step=args.step, block_size=block_bytes,
+                  chunk_size=args.chunk_size, weight_fn=weight_fn, engine=args.engine, feature_hash=args.feature_hash,
+                  chunking=args.chunking, cdc_min=_size_or_none(args.cdc_min), cdc_max=_size_or_none(args.cdc_max),
+                  vectors=args.vectors, file_record=args.with_file, readahead=args.readahead, sample=args.sample)
+        if args.split_file:
+            it = simhash_bytes_blocks_parallel(path, jobs=args.jobs or None, **kw)
+        else:
+            it = simhash_bytes_blocks(path, **kw)
+        for rec in it:
+            yield {"path": path, **rec}
+        return
+
+    if args.mode == "text":
+        h = simhash_text(path, bitlen=args.bitlen, ngram=args.ngram, weight_fn=weight_fn, engine=args.engine,
+                         feature_hash=args.feature_hash, chunk_size=args.chunk_size, readahead=args.readahead)
+    else:
+        h = simhash_bytes(path, bitlen=args.bitlen, n=args.ngram,
+                          step=args.step, chunk_size=args.chunk_size, weight_fn=weight_fn, engine=args.engine,
+                          feature_hash=args.feature_hash, readahead=args.readahead, sample=args.sample)
+    yield {"path": path, "hash": h}
+
+def idf_params(args) -> str:
+    """The options feature keys and their counts depend on; a sketch only weights runs with the same ones."""
+    params = f"mode={args.mode} bitlen={args.bitlen} ngram={args.ngram} hash={args.feature_hash}"
+    if args.mode == "bytes":        # which windows are features at all
+        params += f" step={args.step} sample={args.sample}"
+    return params
+
+def count_features(path, sketch, args):
+    """Count the features path is hashed with (as iter_path_records would) into a CountMinSketch."""
+    kw = dict(bitlen=args.bitlen, ngram=args.ngram, weight_fn=sketch.counter(), engine="numpy",
+              feature_hash=args.feature_hash, chunk_size=args.chunk_size, readahead=args.readahead)
+    if args.mode == "text":
+        simhash_text(path, **kw)
+    else:
+        simhash_bytes(path, n=kw.pop("ngram"), step=args.step, sample=getattr(args, "sample", 1), **kw)
+    sketch.docs += 1
+
+def resume_path_records(path, args, block_bytes):
+    """iter_path_records with --resume: continue from the stored state of path when it is still valid."""
+    store, params = args.resume_store, cache_params(args)
+    kw = dict(bitlen=args.bitlen, n=args.ngram, step=args.step, chunk_size=args.chunk_size,
+              weight_fn=getattr(args, "weight_fn", None), engine=args.engine, feature_hash=args.feature_hash,
+              block_size=block_bytes, vectors=args.vectors, file_record=args.with_file, sample=args.sample)
+    if block_bytes:
+        kw.update(chunking=args.chunking, cdc_min=_size_or_none(args.cdc_min), cdc_max=_size_or_none(args.cdc_max))
+    records, state = simhash_bytes_incremental(path, store.get(path, params), **kw)
+    store.put(path, params, state, tail_len=args.ngram - 1)
+    for rec in records:
+        yield {"path": path, **rec}
+
+def error_record(path, exc):
+    return {"path": path, "error": f"{type(exc).__name__}: {exc}"}
+
+def hash_path_records(path, args):
+    """Worker entry point for --jobs: the records of one path, or a single error record."""
+    try:
+        return list(iter_path_records(path, args))
+    except Exception as e:
+        return [error_record(path, e)]
+
+def _cache_field(rec):
+    return {"cache": rec["cache"]} if "cache" in rec else {}
+
+def _vector_field(rec):
+    return {"vector": rec["vector"]} if "vector" in rec else {}
+
+TEXT_BLOCK_FIELDS = ("char_start", "char_end", "tokens")
+
+def _text_fields(rec):
+    return {k: rec[k] for k in TEXT_BLOCK_FIELDS if k in rec}
+
+def _stats_field(rec):
+    return {"stats": rec["stats"]} if "stats" in rec else {}
+
+def format_record(rec, args) -> str:
+    label = mode_label(args.mode, args.feature_hash)
+    path = rec["path"]
+    if "error" in rec:
+        line = {"line": rec["line"]} if "line" in rec else {}
+        if args.json:
+            return json.dumps({"path": path, **line, "bitlen": args.bitlen, "mode": args.mode,
+                               "feature_hash": args.feature_hash, "error": rec["error"]}, ensure_ascii=False)
+        where = f"{path}\tline={rec['line']}" if line else path
+        return f"error\t{args.bitlen}\t{label}\t{where}\t{rec['error']}"
+
+    hx = to_fixed_hex(rec["hash"], args.bitlen)
+    if "line" in rec:
+        if args.json:
+            return json.dumps({"path": path, "line": rec["line"], "start": rec["start"], "end": rec["end"],
+                               "bitlen": args.bitlen, "mode": args.mode, "feature_hash": args.feature_hash,
+                               "simhash_hex": hx, **_cache_field(rec), **_stats_field(rec)}, ensure_ascii=False)
+        return f"{hx}\t{args.bitlen}\t{label}\t{path}\tline={rec['line']}"
+    if "block" in rec:
+        if args.json:
+            return json.dumps({
+                "path": path, "block": rec["block"],
+                "start": rec["start"], "end": rec["end"], **_text_fields(rec),
+                "bitlen": args.bitlen, "mode": args.mode,
+                "feature_hash": args.feature_hash, "simhash_hex": hx,
+                **_vector_field(rec), **_cache_field(rec), **_stats_field(rec)
+            }, ensure_ascii=False)
+        return f"{hx}\t{args.bitlen}\t{label}\t{path}\tblock={rec['block']}\t[{rec['start']},{rec['end']})"
+
+    if args.json:
+        return json.dumps({"path": path, "simhash_hex": hx, "bitlen": args.bitlen, "mode": args.mode,
+                           "feature_hash": args.feature_hash, **_vector_field(rec), **_cache_field(rec),
+                           **_stats_field(rec)}, ensure_ascii=False)
+    return f"{hx}\t{args.bitlen}\t{label}\t{path}"
+
+def cache_params(args) -> str:
+    """Every option that changes a file's records, as the fingerprint-cache parameter key."""
+    block_bytes = parse_size(args.block_size) if args.block_size else 0
+    params = (f"mode={args.mode} bitlen={args.bitlen} ngram={args.ngram} step={args.step} "
+              f"block={block_bytes} hash={args.feature_hash}")
+    if args.mode == "text" and args.block_tokens:
+        params += f" block_tokens={args.block_tokens}"
+    if args.sample > 1:
+        params += f" sample={args.sample}"
+    if getattr(args, "records", None):
+        params += f" records={RECORD_SEPARATORS[args.records].hex()}"
+        if args.fields:
+            params += " fields=" + ",".join(".".join(f) for f in args.fields)
+    if block_bytes and args.chunking != "fixed":
+        params += f" chunking={args.chunking} min={_size_or_none(args.cdc_min)} max={_size_or_none(args.cdc_max)}"
+    if block_bytes and args.with_file:
+        params += " file=1"
+    if block_bytes and args.vectors:
+        params += " vectors=1"
+    if getattr(args, "idf_id", None):
+        params += f" idf={args.idf_id}"
+    return params
+
+def cacheable(records):
+    """Whether a path's records may be stored in the fingerprint cache: error results never are,
+    so a later run retries them (with any --jobs)."""
+    return not any("error" in rec for rec in records)
+
+def _mark(records, state):
+    for rec in records:
+        rec["cache"] = state
+    return records
+
+def parse_record(line):
+    """
+    Inverse of format_record for one TSV or JSON output line. Returns
+    {"path", "hash", "bitlen", "label"[, "block", "start", "end" | "line"][, "vector"]} where label
+    is the TSV mode column (e.g. "bytes", "bytes+rolling"), or None for blank and error lines.
+    """
+    line = line.rstrip("\r\n")
+    if not line.strip():
+        return None
+    if line.lstrip().startswith("{"):
+        d = json.loads(line)
+        if "error" in d or "simhash_hex" not in d:
+            return None
+        rec = {"path": d["path"], "hash": int(d["simhash_hex"], 16), "bitlen": int(d["bitlen"]),
+               "label": mode_label(d["mode"], d.get("feature_hash", "blake2b"))}
+        if "block" in d:
+            rec.update(block=d["block"], start=d["start"], end=d["end"])
+        elif "line" in d:
+            rec["line"] = d["line"]
+        if "vector" in d:
+            rec["vector"] = d["vector"]
+        return rec
+    parts = line.split("\t")
+    if parts[0] == "error" or len(parts) < 4:
+        return None
+    rec = {"path": parts[3], "hash": int(parts[0], 16), "bitlen": int(parts[1]), "label": parts[2]}
+    if len(parts) >= 6 and parts[4].startswith("block="):
+        start, end = parts[5].strip("[)").split(",")
+        rec.update(block=int(parts[4][len("block="):]), start=int(start), end=int(end))
+    elif len(parts) >= 5 and parts[4].startswith("line="):
+        rec["line"] = int(parts[4][len("line="):])
+    return rec
+
+def iter_record_files(paths):
+    """Parsed records of existing TSV/JSON/bin output files ('-' = stdin), skipping error lines."""
+    for p in paths:
+        if p != "-" and is_bin_file(p):
+            with BinFile(p) as bf:
+                yield from bf
+            continue
+        with open_maybe_compressed(p, "rt") as fh:
+            for line in fh:
+                rec = parse_record(line)
+                if rec is not None:
+                    yield rec
+
+def run_serial(paths, args, cache=None):
+    """Hash paths one after another, streaming block records as they are produced."""
+    params = cache_params(args) if cache else None
+    for path in paths:
+        key = None
+        if cache:
+            key = file_key(path)
+            hit = cache.get(key, params, path)
+            if hit is not None:
+                yield from _mark(hit, "hit")
+                continue
+        done = []
+        try:
+            for rec in iter_path_records(path, args):
+                if cache:
+                    rec["cache"] = "miss"
+                    done.append(rec)
+                yield rec
+        except Exception as e:
+            yield error_record(path, e)
+            continue
+        if cache and cacheable(done):
+            cache.put(key, params, path, done)
+
+def _pool_hash_path(path, args):
+    """Pool task: hash_path_records plus the READAHEAD_STATS it added in the worker process."""
+    before = dict(READAHEAD_STATS)
+    with profiling(getattr(args, "profile", None), worker=True):
+        records = hash_path_records(path, args)
+    return records, {k: READAHEAD_STATS[k] - before[k] for k in READAHEAD_STATS}
+
+def _collect(fut):
+    try:
+        records, stats = fut.result()
+    except Exception as e:      # worker crashed / result not picklable
+        return [error_record(fut.path, e)]
+    for k, v in stats.items():
+        READAHEAD_STATS[k] += v
+    return records
+
+def run_parallel(paths, args, jobs, ordered=False, cache=None):
+    """
+    Hash paths in a process pool and yield each path's records as soon as it finishes
+    (or in input order with ordered=True). At most 4*jobs paths are in flight, so
+    huge directory walks are never materialized. stdin ('-') is hashed in this process.
+    Cache lookups and stores happen here, in the parent; workers never touch the cache.
+    """
+    from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+
+    params = cache_params(args) if cache else None
+    max_pending = 4 * jobs
+    pending = deque() if ordered else set()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        def submit(path):
+            key = hit = None
+            if cache:
+                key = file_key(path)
+                hit = cache.get(key, params, path)
+            if hit is not None or path == "-":
+                fut = Future()
+                fut.set_result((_mark(hit, "hit") if hit is not None else hash_path_records(path, args), {}))
+            else:
+                fut = pool.submit(_pool_hash_path, path, args)
+                fut.cache_key = key
+            fut.path = path
+            if ordered:
+                pending.append(fut)
+            else:
+                pending.add(fut)
+
+        def finish(fut):
+            records = _collect(fut)
+            key = getattr(fut, "cache_key", None)
+            if key is not None and cacheable(records):
+                cache.put(key, params, fut.path, _mark(records, "miss"))
+            return records
+
+        def drain(block_until_one):
+            if ordered:
+                while pending and (pending[0].done() or block_until_one):
+                    yield pending.popleft()
+                    block_until_one = False
+            else:
+                done, _ = wait(pending, timeout=None if block_until_one else 0, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    pending.discard(fut)
+                    yield fut
+
+        for path in paths:
+            submit(path)
+            while len(pending) >= max_pending:
+                for fut in drain(True):
+                    yield from finish(fut)
+            for fut in drain(False):
+                yield from finish(fut)
+        while pending:
+            for fut in drain(True):
+                yield from finish(fut)
+
+def print_stats(wall, walker=None, totals=None):
+    print(f"wall: {wall:.2f}s", file=sys.stderr)
+    if totals is not None and totals.files:
+        t = totals.report(elapsed=wall)
+        print(f"hashed: {t['files']} files, {t['bytes_in'] / 1e6:.1f} MB in, {t['bytes'] / 1e6:.1f} MB hashed, "
+              f"{t['features']} features ({t['mb_s']:.1f} MB/s, {t['features_s']} features/s), "
+              f"cpu {t['cpu']:.2f}s", file=sys.stderr)
+        ws, cs = t["wall_stages"], t["cpu_stages"]
+        print("stages: " + ", ".join(f"{k} n/a" if ws[k] is None else
+                                     f"{k} {ws[k]:.2f}s" + (f" (cpu {cs[k]:.2f}s)" if k in cs else "")
+                                     for k in ws), file=sys.stderr)
+    if walker is not None and walker.dirs:
+        w = walker.summary()
+        print(f"walk: {w['dirs']} dirs, {w['files']} files, {w['filtered']} filtered out, "
+              f"{w['duplicates']} hardlink duplicates skipped, {w['errors']} errors", file=sys.stderr)
+    r = READAHEAD_STATS
+    if r["files"]:
+        print(f"readahead: {r['files']} files, {r['bytes'] / 1e6:.1f} MB decompressed in {r['decompress']:.2f}s "
+              f"({100 * r['decompress'] / wall if wall else 0:.0f}% of wall; summed over threads and workers), "
+              f"hashing waited {r['wait']:.2f}s for data", file=sys.stderr)
+
+SUBCOMMANDS = {
+    "index": "simhash_index",       # near-duplicate index over existing output: index build|query
+    "sketch": "simhash_sketch",     # feature-frequency sketches for --idf: sketch build|merge|info
+    "serve": "simhash_daemon",      # long-running HTTP / Unix-socket service with an in-memory index
+    "dedup": "simhash_dedup",       # online near-duplicate filter over a record stream
+    "delta": "simhash_delta",       # block-level patches from block manifests: delta manifest|diff|apply
+}
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        # `simhash_complete_chunked.py index ...`; use ./index for a file of that name
+        import importlib
+        return importlib.import_module(SUBCOMMANDS[sys.argv[1]]).main(sys.argv[2:])
+
     ap = argparse.ArgumentParser(description="Streamed SimHash for files, stdin, and directories.")
     ap.add_argument("paths", nargs="+", help="Files/dirs/globs or '-' for stdin")
     ap.add_argument("--mode", choices=["text", "bytes"], default="bytes",
@@ -219,54 +2320,254 @@ def main():
     ap.add_argument("--bitlen", type=int, default=128, help="Output hash bit length (64/128/256...)")
     ap.add_argument("--ngram", type=int, default=7, help="[text/bytes] token/byte n-gram size")
     ap.add_argument("--step", type=int, default=1, help="[bytes] slide step in bytes")
+    ap.add_argument("--sample", type=int, default=1, metavar="P",
+                    help="[bytes] content-defined sampling: only hash windows whose rolling hash is divisible by P "
+                         "(~1/P of them); unlike --step, the selection survives inserts and deletes (default: 1 = all)")
     ap.add_argument("--chunk-size", type=int, default=1<<20, help="Read size per chunk (bytes)")
+    ap.add_argument("--records", choices=list(RECORD_SEPARATORS), default=None,
+                    help="One SimHash per record instead of per file: jsonl/ndjson = lines, nul = NUL-separated; "
+                         "output gets the record's line (record) number; needs --engine numpy")
+    ap.add_argument("--field", action="append", default=[], metavar="PATH",
+                    help="With --records: parse records as JSON and hash only the value at this dotted path "
+                         "(e.g. request.body, items.0.text; repeatable, values joined by newlines)")
     ap.add_argument("--recursive", action="store_true", help="Recurse into directories")
-    ap.add_argument("--json", action="store_true", help="Emit JSON lines instead of TSV")
+    ap.add_argument("--json", action="store_true", help="Emit JSON lines instead of TSV (same as --format json)")
+    ap.add_argument("--format", choices=["tsv", "json", "bin"], default=None,
+                    help="Output format; bin: fixed-width binary records plus a path table, written to stdout "
+                         "(redirect to a file) and memory-mapped by simhash_bin.BinFile (default: tsv)")
     ap.add_argument("--block-size", type=str, default=None,
-                    help="If set (e.g. 64K, 1M, 256KiB), emit one SimHash per block of this size.")
+                    help="If set (e.g. 64K, 1M, 256KiB), emit one SimHash per block of this size "
+                         "(text mode: rounded up to the next token boundary).")
+    ap.add_argument("--block-tokens", type=int, default=None,
+                    help="[text] emit one SimHash per block of this many tokens")
+    ap.add_argument("--engine", choices=ENGINES, default="python",
+                    help="Accumulation engine: per-bit python loop or batched numpy (same hashes; default: python)")
+    ap.add_argument("--hash", dest="feature_hash", choices=HASH_FAMILIES, default="blake2b",
+                    help="Feature hash: blake2b per window/n-gram, or rolling: O(1)-per-byte buzhash "
+                         "(bytes) / per-token hashes combined into n-gram hashes (whole-file text); "
+                         "different fingerprints, tagged in the output (default: blake2b)")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Hash files in N worker processes, printing results as they finish (0 = all CPUs; default: 1)")
+    ap.add_argument("--ordered", action="store_true",
+                    help="With --jobs: keep the input order of the results")
+    ap.add_argument("--cache", metavar="PATH", default=os.environ.get("SIMHASH_CACHE"),
+                    help="SQLite fingerprint cache: unchanged files (same dev/inode/size/mtime/mode and "
+                         "hashing options) are not read again (default: $SIMHASH_CACHE)")
+    ap.add_argument("--no-cache", action="store_true", help="Ignore --cache / $SIMHASH_CACHE")
+    ap.add_argument("--cache-max-size", default="256M",
+                    help="Evict least recently used cache entries beyond this size (default: 256M)")
+    ap.add_argument("--cache-max-age", type=float, default=30,
+                    help="Evict cache entries unused for this many days (0 = never; default: 30)")
+    ap.add_argument("--split-file", action="store_true",
+                    help="With --block-size: split each uncompressed file into block ranges hashed by the "
+                         "--jobs workers (files are then taken one at a time; for few, very large files)")
+    ap.add_argument("--chunking", choices=CHUNKINGS, default="fixed",
+                    help="With --block-size: fixed-size blocks, or content-defined blocks (gear-hash CDC) that "
+                         "average --block-size and stay aligned after inserts/deletes (default: fixed)")
+    ap.add_argument("--cdc-min", default=None, help="[cdc] minimum block size (default: block size / 4)")
+    ap.add_argument("--cdc-max", default=None, help="[cdc] maximum block size (default: block size * 4)")
+    ap.add_argument("--with-file", action="store_true",
+                    help="With --block-size: also emit the whole-file fingerprint, summed from the block "
+                         "counters in the same pass (no second read/decompression)")
+    ap.add_argument("--vectors", action="store_true",
+                    help="With --block-size --json: include each record's signed counter vector, so coarser "
+                         "blocks can be built later without rereading (coarsen_blocks)")
+    ap.add_argument("--resume", metavar="STATE", default=None,
+                    help="[bytes] JSON state file for append-only inputs: plain files whose prefix is unchanged "
+                         "are hashed from where the last run stopped (same output as a full rehash)")
+    ap.add_argument("--readahead", type=int, default=4, metavar="N",
+                    help="Decompress .gz/.bz2/.xz on background threads, up to N 1 MiB buffers ahead of the "
+                         "hashing; BGZF files are inflated in parallel (0 = off; default: 4)")
+    ap.add_argument("--stats", action="store_true",
+                    help="Count bytes, features and wall/CPU time per stage (read, decompress, features, "
+                         "accumulate, output): a summary on stderr; with --json also a \"stats\" object on each "
+                         "file's last record and a final {\"stats\": totals} line")
+    ap.add_argument("--profile", metavar="PATH", default=None,
+                    help="Write cProfile data of the run to PATH (--jobs workers: PATH.<pid>); "
+                         "read with python -m pstats")
+    ap.add_argument("--include", action="append", default=[], metavar="GLOB",
+                    help="When walking directories, only hash files matching GLOB (file name, or path relative "
+                         "to the directory if GLOB has a '/'; repeatable)")
+    ap.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                    help="Skip files and directories matching GLOB (repeatable)")
+    ap.add_argument("--min-size", default=None, help="When walking directories, skip files smaller than this (e.g. 4K)")
+    ap.add_argument("--max-size", default=None, help="When walking directories, skip files larger than this (e.g. 2G)")
+    ap.add_argument("--keep-hardlinks", action="store_true",
+                    help="When walking directories, hash every path, even ones already seen by (device, inode) "
+                         "(default: hash each file once; paths given explicitly are always hashed)")
+    ap.add_argument("--walk-threads", type=int, default=1, metavar="N",
+                    help="Threads scanning directories; results then come in no particular order (default: 1)")
+    ap.add_argument("--idf", metavar="MODEL", default=None,
+                    help="Weight features by log(total / count) from a count-min sketch of feature frequencies "
+                         "(`sketch build`), so boilerplate shared across the corpus barely counts; needs NumPy")
+    ap.add_argument("--idf-pass", action="store_true",
+                    help="With --idf: first count the inputs' features into MODEL (overwritten), then hash with it")
     args = ap.parse_args()
+    try:
+        check_engine(args.engine)
+    except RuntimeError as e:
+        ap.error(str(e))
+    if args.feature_hash != "blake2b" and args.mode == "text" and (args.block_size or args.block_tokens):
+        ap.error(f"--hash {args.feature_hash} is not supported for text blocks")
+    if args.json and args.format not in (None, "json"):
+        ap.error(f"--json conflicts with --format {args.format}")
+    args.format = "json" if args.json else args.format or "tsv"
+    args.json = args.format == "json"
+    if args.format == "bin" and sys.stdout.isatty():
+        ap.error("--format bin writes binary records; redirect stdout to a file")
+    if args.jobs < 0:
+        ap.error("--jobs must be >= 0")
+    if args.sample > 1 and args.mode == "text":
+        ap.error("--sample works on byte n-grams; use --mode bytes")
+    try:
+        check_sample(args.sample, args.step)
+    except ValueError as e:
+        ap.error(f"--sample: {e}")
+    if args.readahead < 0:
+        ap.error("--readahead must be >= 0")
+    if args.walk_threads < 1:
+        ap.error("--walk-threads must be >= 1")
+    try:
+        min_size, max_size = _size_or_none(args.min_size), _size_or_none(args.max_size)
+    except ValueError as e:
+        ap.error(str(e))
+    if args.block_size:
+        try:
+            parse_size(args.block_size)
+        except ValueError as e:
+            ap.error(str(e))
+    if args.block_tokens is not None:
+        if args.mode != "text":
+            ap.error("--block-tokens works in --mode text; use --block-size for bytes")
+        if args.block_tokens < 1:
+            ap.error("--block-tokens must be >= 1")
+    blocked = args.block_size or args.block_tokens
+    if args.split_file and not args.block_size:
+        ap.error("--split-file needs --block-size")
+    if (args.with_file or args.vectors) and not blocked:
+        ap.error(f"{'--with-file' if args.with_file else '--vectors'} needs --block-size or --block-tokens")
+    if args.vectors and not args.json:
+        ap.error("--vectors needs --json")
+    if args.mode == "text" and (args.resume or args.split_file or args.chunking != "fixed"):
+        opt = "--resume" if args.resume else "--split-file" if args.split_file else "--chunking"
+        ap.error(f"{opt} works on byte n-grams; use --mode bytes")
+    if args.chunking != "fixed":
+        if not args.block_size:
+            ap.error(f"--chunking {args.chunking} needs --block-size")
+        try:
+            make_blocks(parse_size(args.block_size), args.chunking,
+                        _size_or_none(args.cdc_min), _size_or_none(args.cdc_max))
+        except ValueError as e:
+            ap.error(str(e))
+    if args.field and not args.records:
+        ap.error("--field needs --records")
+    try:
+        args.fields = [parse_field_path(f) for f in args.field]
+    except ValueError as e:
+        ap.error(f"--field: {e}")
+    if args.records:
+        if args.engine != "numpy":
+            ap.error("--records hashes records in vectorized batches; use --engine numpy")
+        if blocked or args.resume or args.sample > 1:
+            opt = "--resume" if args.resume else "--sample" if args.sample > 1 else "--block-size/--block-tokens"
+            ap.error(f"{opt} can't be combined with --records")
+    if args.idf_pass and not args.idf:
+        ap.error("--idf-pass needs --idf MODEL (where the counts are written)")
+    if args.idf_pass and "-" in args.paths:
+        ap.error("--idf-pass reads the inputs twice; stdin can't be used")
+    jobs = args.jobs or os.cpu_count() or 1
 
-    block_bytes = parse_size(args.block_size) if args.block_size else None
+    def new_walker():
+        return Walker(include=args.include, exclude=args.exclude, min_size=min_size, max_size=max_size,
+                      dedup=not args.keep_hardlinks, threads=args.walk_threads)
 
-    for path in iter_input_paths(args.paths, recursive=args.recursive):
-        # Per-block output
-        if block_bytes:
-            if args.mode == "text":
-                # Text chunked at byte boundaries (simple). If you need token-aware chunking, ask and we can add it.
-                it = simhash_bytes_blocks(path, bitlen=args.bitlen, n=args.ngram,
-                                          step=args.step, block_size=block_bytes,
-                                          chunk_size=args.chunk_size)
-            else:  # bytes
-                it = simhash_bytes_blocks(path, bitlen=args.bitlen, n=args.ngram,
-                                          step=args.step, block_size=block_bytes,
-                                          chunk_size=args.chunk_size)
-
-            for rec in it:
-                hx = to_fixed_hex(rec["hash"], args.bitlen)
-                if args.json:
-                    print(json.dumps({
-                        "path": path, "block": rec["block"],
-                        "start": rec["start"], "end": rec["end"],
-                        "bitlen": args.bitlen, "mode": args.mode,
-                        "simhash_hex": hx
-                    }, ensure_ascii=False))
-                else:
-                    print(f"{hx}\t{args.bitlen}\t{args.mode}\t{path}\tblock={rec['block']}\t[{rec['start']},{rec['end']})")
-            continue  # next path
+    args.weight_fn = args.idf_id = None
+    if args.idf:
+        try:
+            if args.idf_pass:
+                t0 = time.perf_counter()
+                args.width, args.depth, args.seed = DEFAULT_WIDTH, DEFAULT_DEPTH, 0
+                args.idf_params = idf_params(args)
+                sketch, errors = build_sketch(
+                    iter_input_paths(args.paths, recursive=args.recursive, walker=new_walker()), args, jobs)
+                for e in errors:
+                    print(f"idf pass: skipped {e}", file=sys.stderr)
+                sketch.save(args.idf)
+                print(f"idf pass: {sketch.total} features from {sketch.docs} files in "
+                      f"{time.perf_counter() - t0:.2f}s -> {args.idf}", file=sys.stderr)
+            args.weight_fn = load_idf(args.idf)
+        except (OSError, RuntimeError, ValueError) as e:
+            ap.error(str(e))
+        sketch = args.weight_fn.sketch
+        if sketch.params != idf_params(args):
+            ap.error(f"{args.idf} counts features with {sketch.params}, this run uses {idf_params(args)}")
+        h = hashlib.blake2b(str(sketch.total).encode(), digest_size=8)
+        h.update(sketch.table)
+        args.idf_id = h.hexdigest()     # cache/resume key: results change with the model's counts
 
-        # Whole-file (original behavior)
-        if args.mode == "text":
-            h = simhash_text(path, bitlen=args.bitlen, ngram=args.ngram)
-        else:
-            h = simhash_bytes(path, bitlen=args.bitlen, n=args.ngram,
-                              step=args.step, chunk_size=args.chunk_size)
+    cache = None
+    if args.cache and not args.no_cache:
+        try:
+            cache = FingerprintCache(args.cache, max_bytes=parse_size(args.cache_max_size),
+                                     max_age=args.cache_max_age * 86400)
+        except ValueError as e:
+            ap.error(str(e))
 
-        hx = to_fixed_hex(h, args.bitlen)
-        if args.json:
-            rec = {"path": path, "simhash_hex": hx, "bitlen": args.bitlen, "mode": args.mode}
-            print(json.dumps(rec, ensure_ascii=False))
+    args.resume_store = ResumeStore(args.resume) if args.resume else None
+
+    t_start = time.perf_counter()
+    walker = new_walker()
+    paths = iter_input_paths(args.paths, recursive=args.recursive, walker=walker)
+    if jobs == 1 or args.split_file or args.resume:     # resume state lives in this process
+        records = run_serial(paths, args, cache=cache)
+    else:
+        records = run_parallel(paths, args, jobs, ordered=args.ordered, cache=cache)
+
+    failed = 0
+    writer = None
+    if args.format == "bin":
+        writer = BinWriter(sys.stdout.buffer, args.bitlen, args.mode, args.feature_hash,
+                           unit="line" if args.records else "block")
+    totals = Stats() if args.stats else None
+
+    def emit(rec):
+        if writer is None:
+            print(format_record(rec, args), flush=jobs > 1)
+        elif "error" in rec:
+            print(format_record(rec, args), file=sys.stderr)
         else:
-            print(f"{hx}\t{args.bitlen}\t{args.mode}\t{path}")
+            writer.write(rec)
+
+    try:
+        with profiling(args.profile):
+            for rec in records:
+                failed += "error" in rec
+                if totals is None:
+                    emit(rec)
+                else:
+                    totals.add(rec.get("stats"))
+                    with totals.stage("output"):
+                        emit(rec)
+    finally:
+        if writer is not None:
+            writer.close()
+        if cache:
+            cache.close()
+            c = cache.summary()
+            print(f"cache: {c['hits']} hits, {c['misses']} misses, {c['stores']} stored, {c['evicted']} evicted",
+                  file=sys.stderr)
+        if args.resume_store:
+            args.resume_store.save()
+            r = args.resume_store.summary()
+            print(f"resume: {r['resumed']} resumed, {r['fresh']} new, {r['invalidated']} invalidated",
+                  file=sys.stderr)
+        if args.stats:
+            wall = time.perf_counter() - t_start
+            print_stats(wall, walker, totals)
+            if args.json:
+                print(json.dumps({"stats": totals.report(elapsed=wall)}))
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Long-running SimHash service: hashing and near-duplicate queries over HTTP on
+localhost or a Unix socket, without paying interpreter start-up and imports per
+run, and with a fingerprint index kept in memory between requests.
+
+    python simhash_daemon.py --port 8377 --mode text --ngram 3 --hash rolling --load corpus.tsv
+    python simhash_daemon.py --socket /tmp/simhash.sock --bitlen 64
+
+    curl -s localhost:8377/hash -d '{"docs": [{"id": "a", "text": "some text"}], "add": true}'
+    curl -s localhost:8377/hash -d '{"paths": ["/data/x.log"], "k": 3}'
+    curl -s localhost:8377/query -d '{"hashes": ["5e97ac9daf08ddb8ad3fa2dc78f48245"], "k": 5}'
+    curl -s localhost:8377/metrics
+    curl -s --unix-socket /tmp/simhash.sock http://localhost/health
+
+(also reachable as `simhash_complete_chunked.py serve ...`)
+
+POST /hash takes {"docs": [{"id", "text" | "data" (base64)}], "paths": [...],
+"add": bool, "k": int}: fingerprints of inline documents and files, optionally
+added to the index (under their id/path) and/or matched against it within
+Hamming distance k. POST /query takes {"hashes": [hex, ...], "k": int (default 3)}.
+Responses are {"results": [...]}, one entry per document, path or hash, with
+"simhash_hex", "matches" ([{"id", "distance", "simhash_hex"}], nearest first)
+or "error".
+
+Inline documents and small plain files of concurrent requests are collected
+into micro-batches (up to --max-batch documents, waiting at most --batch-wait ms
+for more) and hashed with one simhash_many call. Larger and compressed files are
+streamed by --workers threads. Requests beyond --max-inflight get 503. All
+fingerprints are whole-document ones with the options given at start-up, the same
+values simhash_complete_chunked.py prints for them. Needs NumPy.
+
+"paths" makes the daemon read files on the server, so it is only accepted on a
+loopback address or a Unix socket unless --allow-paths is given.
+"""
+import argparse, base64, http.client, ipaddress, json, os, queue, signal, socket, socketserver, sys, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from simhash_complete_chunked import (
+    HASH_FAMILIES, check_engine, hamming_one_to_many, hash_path_records, idf_params, is_plain_file,
+    iter_record_files, load_idf, mode_label, np, pack_hashes, simhash_many, to_fixed_hex, unpack_hashes,
+)
+
+DEFAULT_PORT = 8377
+MAX_BODY = 64 << 20
+
+class MemoryIndex:
+    """Fingerprints by id in a growing packed uint64 array; queries are one popcount pass (hamming_one_to_many)."""
+    def __init__(self, bitlen):
+        self.bitlen = bitlen
+        self.lanes = -(-bitlen // 64)
+        self._packed = np.zeros((1024, self.lanes), dtype=np.uint64)
+        self._ids = []
+        self._row = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, ids, packed):
+        """Insert or replace the fingerprints (rows of packed) of ids."""
+        with self._lock:
+            for i, row in zip(ids, packed):
+                r = self._row.get(i)
+                if r is None:
+                    r = self._row[i] = len(self._ids)
+                    self._ids.append(i)
+                    if r == len(self._packed):
+                        self._packed = np.concatenate([self._packed, np.zeros_like(self._packed)])
+                self._packed[r] = row
+
+    def query(self, row, k):
+        """[(distance, id, packed row)] of entries within distance k of row, nearest first."""
+        with self._lock:
+            n = len(self._ids)
+            packed = self._packed[:n]
+            d = hamming_one_to_many(row, packed)
+            hits = np.flatnonzero(d <= k)
+            hits = hits[np.argsort(d[hits], kind="stable")]
+            return [(int(d[j]), self._ids[j], packed[j].copy()) for j in hits]
+
+class Batcher:
+    """
+    One thread hashing queued groups of documents with simhash_many: groups that
+    arrive within `wait` seconds of the first (up to max_batch documents) share a call.
+    """
+    def __init__(self, hash_fn, metrics, max_batch=256, wait=0.002):
+        self.hash_fn = hash_fn
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.wait = wait
+        self._q = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, docs):
+        """Future of the (len(docs), lanes) packed fingerprints."""
+        fut = Future()
+        self._q.put((docs, fut))
+        return fut
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._q.get()
+            if item is None:
+                return
+            group, n = [item], len(item[0])
+            deadline = time.monotonic() + self.wait
+            while n < self.max_batch:
+                try:
+                    item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                group.append(item)
+                n += len(item[0])
+            docs = [d for g, _ in group for d in g]
+            try:
+                packed = self.hash_fn(docs)
+            except Exception as e:
+                for _, fut in group:
+                    fut.set_exception(e)
+                continue
+            self.metrics.batch(len(group), len(docs), sum(len(d) for d in docs))
+            lo = 0
+            for g, fut in group:
+                fut.set_result(packed[lo:lo + len(g)])
+                lo += len(g)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}          # (endpoint, status) -> count
+        self.seconds = {}           # endpoint -> summed handling time
+        self.rejected = self.inflight = 0
+        self.batches = self.batch_requests = self.batch_docs = self.batch_bytes = 0
+        self.streamed = 0
+
+    def request(self, endpoint, status, secs):
+        with self._lock:
+            self.requests[endpoint, status] = self.requests.get((endpoint, status), 0) + 1
+            self.seconds[endpoint] = self.seconds.get(endpoint, 0.0) + secs
+
+    def batch(self, requests, docs, nbytes):
+        with self._lock:
+            self.batches += 1
+            self.batch_requests += requests
+            self.batch_docs += docs
+            self.batch_bytes += nbytes
+
+    def add(self, attr, n=1):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + n)
+
+    def render(self, index_size):
+        """Prometheus text exposition format."""
+        with self._lock:
+            lines = [f'simhash_requests_total{{endpoint="{e}",status="{s}"}} {n}'
+                     for (e, s), n in sorted(self.requests.items())]
+            lines += [f'simhash_request_seconds_sum{{endpoint="{e}"}} {v:.6f}' for e, v in sorted(self.seconds.items())]
+            lines += [f"simhash_rejected_total {self.rejected}",
+                      f"simhash_inflight {self.inflight}",
+                      f"simhash_batches_total {self.batches}",
+                      f"simhash_batch_requests_total {self.batch_requests}",
+                      f"simhash_batch_docs_total {self.batch_docs}",
+                      f"simhash_batch_bytes_total {self.batch_bytes}",
+                      f"simhash_streamed_files_total {self.streamed}",
+                      f"simhash_index_size {index_size}",
+                      f"simhash_uptime_seconds {time.time() - self.started:.3f}"]
+        return "\n".join(lines) + "\n"
+
+class RecordError(Exception):
+    """The error of an error record, already formatted as "Type: message"."""
+
+def error_text(exc):
+    return str(exc) if isinstance(exc, RecordError) else f"{type(exc).__name__}: {exc}"
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Service:
+    """Request handling independent of the transport: hash/query/health/metrics."""
+    def __init__(self, args):
+        self.args = args
+        self.label = mode_label(args.mode, args.feature_hash)
+        self.metrics = Metrics()
+        self.index = MemoryIndex(args.bitlen)
+        self.batcher = Batcher(self._hash_docs, self.metrics, max_batch=args.max_batch, wait=args.batch_wait / 1000)
+        self.pool = ThreadPoolExecutor(max_workers=args.workers)
+        self.slots = threading.BoundedSemaphore(args.max_inflight)
+
+    def _hash_docs(self, docs):
+        a = self.args
+        return simhash_many(docs, mode=a.mode, bitlen=a.bitlen, ngram=a.ngram, step=a.step, weight_fn=a.weight_fn,
+                            feature_hash=a.feature_hash, chunk_size=a.chunk_size)
+
+    def load(self, paths):
+        """Warm the index from TSV/JSON/bin output files; returns (added, skipped)."""
+        ids, hashes, skipped = [], [], 0
+        for rec in iter_record_files(paths):
+            if rec["bitlen"] != self.args.bitlen or rec["label"] != self.label or "block" in rec or "line" in rec:
+                skipped += 1
+                continue
+            ids.append(rec["path"])
+            hashes.append(rec["hash"])
+        self.index.add(ids, pack_hashes(hashes, self.args.bitlen))
+        return len(ids), skipped
+
+    def _path_future(self, path):
+        """Small plain files join a micro-batch; the rest are streamed on the worker pool."""
+        if is_plain_file(path) and os.path.getsize(path) <= self.args.batch_file_max:
+            with open(path, "rb") as f:
+                return self.batcher.submit([f.read()])
+        self.metrics.add("streamed")
+        return self.pool.submit(self._stream_path, path)
+
+    def _stream_path(self, path):
+        rec = hash_path_records(path, self.args)[0]
+        if "error" in rec:
+            raise RecordError(rec["error"])
+        return pack_hashes([rec["hash"]], self.args.bitlen)
+
+    def _doc_bytes(self, doc):
+        if not isinstance(doc, dict) or "id" not in doc or ("text" in doc) == ("data" in doc):
+            raise HttpError(400, 'each doc needs "id" and one of "text" or "data" (base64)')
+        if "text" in doc:
+            return str(doc["text"]).encode("utf-8")
+        try:
+            return base64.b64decode(doc["data"], validate=True)
+        except ValueError:
+            raise HttpError(400, f"doc {doc['id']!r}: data is not valid base64")
+
+    def _result(self, key, ident, row, k):
+        out = {key: ident, "simhash_hex": to_fixed_hex(unpack_hashes([row])[0], self.args.bitlen)}
+        if k is not None:
+            out["matches"] = self._matches(row, k, exclude=ident if key != "query" else None)
+        return out
+
+    def _matches(self, row, k, exclude=None):
+        return [{"id": i, "distance": d, "simhash_hex": to_fixed_hex(unpack_hashes([r])[0], self.args.bitlen)}
+                for d, i, r in self.index.query(row, k) if i != exclude]
+
+    @staticmethod
+    def _k(body):
+        k = body.get("k")
+        if k is not None and (not isinstance(k, int) or k < 0):
+            raise HttpError(400, '"k" must be a non-negative integer')
+        return k
+
+    def hash(self, body):
+        docs, paths = body.get("docs", []), body.get("paths", [])
+        if not isinstance(docs, list) or not isinstance(paths, list):
+            raise HttpError(400, '"docs" and "paths" must be lists')
+        if paths and not self.args.allow_paths:
+            raise HttpError(403, '"paths" is disabled on a non-loopback address (start with --allow-paths)')
+        k = self._k(body)
+        data = [self._doc_bytes(d) for d in docs]
+        doc_fut = self.batcher.submit(data) if data else None
+        path_futs = []
+        for p in paths:
+            try:
+                path_futs.append(self._path_future(str(p)))
+            except OSError as e:
+                fut = Future()
+                fut.set_exception(e)
+                path_futs.append(fut)
+        results, added_ids, added = [], [], []
+        if doc_fut is not None:
+            packed = doc_fut.result()
+            for d, row in zip(docs, packed):
+                results.append(("id", str(d["id"]), row))
+        for p, fut in zip(paths, path_futs):
+            try:
+                results.append(("path", str(p), fut.result()[0]))
+            except Exception as e:
+                results.append(("path", str(p), e))
+        if body.get("add"):
+            for key, ident, row in results:
+                if not isinstance(row, Exception):
+                    added_ids.append(ident)
+                    added.append(row)
+            if added:
+                self.index.add(added_ids, np.array(added))
+        out = []
+        for key, ident, row in results:
+            if isinstance(row, Exception):
+                out.append({key: ident, "error": error_text(row)})
+            else:
+                out.append(self._result(key, ident, row, k))
+        return {"results": out}
+
+    def query(self, body):
+        hashes = body.get("hashes")
+        if not isinstance(hashes, list):
+            raise HttpError(400, '"hashes" must be a list of hex fingerprints')
+        k = self._k(body)
+        try:
+            packed = pack_hashes([int(h, 16) for h in hashes], self.args.bitlen)
+        except (TypeError, ValueError):
+            raise HttpError(400, '"hashes" must be hex strings')
+        return {"results": [{"query": h, "matches": self._matches(row, 3 if k is None else k)}
+                            for h, row in zip(hashes, packed)]}
+
+    def health(self):
+        return {"ok": True, "bitlen": self.args.bitlen, "label": self.label, "index": len(self.index)}
+
+    def close(self):
+        self.batcher.close()
+        self.pool.shutdown(wait=True)
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "simhash-daemon/1"
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, fmt, *a):
+        if self.server.service.args.log:
+            super().log_message(fmt, *a)
+
+    def _send(self, status, body, ctype="application/json"):
+        data = body.encode() if isinstance(body, str) else (json.dumps(body, ensure_ascii=False) + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, fn):
+        service = self.server.service
+        endpoint = self.path.split("?", 1)[0]
+        t0 = time.perf_counter()
+        if not service.slots.acquire(blocking=False):
+            service.metrics.add("rejected")
+            self._discard_body()
+            self._send(503, {"error": "too many requests in flight"})
+            service.metrics.request(endpoint, 503, time.perf_counter() - t0)
+            return
+        service.metrics.add("inflight")
+        try:
+            status, body = 200, fn(service, endpoint)
+        except HttpError as e:
+            status, body = e.status, {"error": str(e)}
+        except Exception as e:
+            status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            service.metrics.add("inflight", -1)
+            service.slots.release()
+        if isinstance(body, tuple):
+            self._send(status, body[1], ctype=body[0])
+        else:
+            self._send(status, body)
+        service.metrics.request(endpoint, status, time.perf_counter() - t0)
+
+    def _discard_body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n > MAX_BODY:
+            self.close_connection = True
+        else:
+            self.rfile.read(n)
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n > self.server.service.args.max_body:
+            self.close_connection = True
+            raise HttpError(413, f"request body over {self.server.service.args.max_body} bytes")
+        try:
+            body = json.loads(self.rfile.read(n) or b"{}")
+        except ValueError as e:
+            raise HttpError(400, f"invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise HttpError(400, "request body must be a JSON object")
+        return body
+
+    def do_GET(self):
+        def get(service, endpoint):
+            if endpoint == "/health":
+                return service.health()
+            if endpoint == "/metrics":
+                return "text/plain; version=0.0.4", service.metrics.render(len(service.index))
+            raise HttpError(404, f"no such endpoint: GET {endpoint}")
+        self._handle(get)
+
+    def do_POST(self):
+        def post(service, endpoint):
+            if endpoint == "/hash":
+                return service.hash(self._body())
+            if endpoint == "/query":
+                return service.query(self._body())
+            self._discard_body()
+            raise HttpError(404, f"no such endpoint: POST {endpoint}")
+        self._handle(post)
+
+class TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def is_loopback(host):
+    """Whether a --host value only accepts local connections."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def make_server(args, service):
+    """The Unix socket (--socket) or TCP server for service, and where it listens."""
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixServer(args.socket, Handler)
+        where = f"unix:{args.socket}"
+    else:
+        server = TCPServer((args.host, args.port), Handler)
+        where = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    server.service = service
+    return server, where
+
+def call(address, endpoint, payload=None, timeout=60):
+    """
+    Minimal client: GET (payload None) or POST JSON to endpoint of a daemon at
+    address, ("host", port) or a Unix socket path. Returns (status, decoded body).
+    """
+    if isinstance(address, str):
+        conn = http.client.HTTPConnection("localhost", timeout=timeout)
+        conn.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.sock.settimeout(timeout)
+        conn.sock.connect(address)
+    else:
+        conn = http.client.HTTPConnection(*address, timeout=timeout)
+    try:
+        if payload is None:
+            conn.request("GET", endpoint)
+        else:
+            conn.request("POST", endpoint, json.dumps(payload), {"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        data = resp.read().decode()
+        is_json = resp.getheader("Content-Type", "").startswith("application/json")
+        return resp.status, json.loads(data) if is_json else data
+    finally:
+        conn.close()
+
+def service_args(args):
+    """Complete the options hash_path_records reads (whole-file fingerprints only)."""
+    args.engine = "numpy"
+    args.block_size = args.block_tokens = None
+    args.split_file = args.vectors = args.with_file = args.stats = False
+    args.chunking, args.cdc_min, args.cdc_max = "fixed", None, None
+    args.resume_store = None
+    args.sample = 1
+    args.jobs = 1
+    return args
+
+def build_parser():
+    ap = argparse.ArgumentParser(description="SimHash daemon: hashing and near-duplicate queries over HTTP.")
+    ap.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"TCP port, 0 = any free one (default: {DEFAULT_PORT})")
+    ap.add_argument("--socket", metavar="PATH", default=None, help="Listen on this Unix socket instead of TCP")
+    ap.add_argument("--mode", choices=["text", "bytes"], default="bytes")
+    ap.add_argument("--bitlen", type=int, default=128)
+    ap.add_argument("--ngram", type=int, default=7)
+    ap.add_argument("--step", type=int, default=1, help="[bytes] slide step in bytes")
+    ap.add_argument("--hash", dest="feature_hash", choices=HASH_FAMILIES, default="blake2b")
+    ap.add_argument("--chunk-size", type=int, default=1<<20)
+    ap.add_argument("--readahead", type=int, default=4)
+    ap.add_argument("--idf", metavar="MODEL", default=None, help="IDF feature weights from a sketch (see --idf)")
+    ap.add_argument("--load", action="append", default=[], metavar="FILE",
+                    help="Warm the index from TSV/JSON/bin output files (whole-file records; repeatable)")
+    ap.add_argument("--workers", type=int, default=4, help="Threads streaming large/compressed files (default: 4)")
+    ap.add_argument("--max-inflight", type=int, default=64,
+                    help="Requests handled at once; more get 503 (default: 64)")
+    ap.add_argument("--max-batch", type=int, default=256, help="Documents per micro-batch (default: 256)")
+    ap.add_argument("--batch-wait", type=float, default=2.0,
+                    help="Milliseconds a micro-batch waits for more documents (default: 2)")
+    ap.add_argument("--batch-file-max", type=int, default=1 << 20,
+                    help="Plain files up to this many bytes are read into micro-batches (default: 1 MiB)")
+    ap.add_argument("--max-body", type=int, default=MAX_BODY, help=f"Largest request body (default: {MAX_BODY})")
+    ap.add_argument("--allow-paths", action="store_true",
+                    help='Accept "paths" (files read on the server) even when --host is not a loopback address')
+    ap.add_argument("--log", action="store_true", help="Log every request to stderr")
+    return ap
+
+def parse_args(argv=None, ap=None):
+    """Parsed and checked daemon options, completed for Service (see service_args)."""
+    ap = ap or build_parser()
+    args = ap.parse_args(argv)
+    args.allow_paths = args.allow_paths or bool(args.socket) or is_loopback(args.host)
+    try:
+        check_engine("numpy")
+    except RuntimeError as e:
+        ap.error(str(e))
+    for opt in ("workers", "max_inflight", "max_batch"):
+        if getattr(args, opt) < 1:
+            ap.error(f"--{opt.replace('_', '-')} must be >= 1")
+    args = service_args(args)
+    args.weight_fn = None
+    if args.idf:
+        try:
+            args.weight_fn = load_idf(args.idf)
+        except (OSError, RuntimeError, ValueError) as e:
+            ap.error(str(e))
+        if args.weight_fn.sketch.params != idf_params(args):
+            ap.error(f"{args.idf} counts features with {args.weight_fn.sketch.params}, "
+                     f"this daemon uses {idf_params(args)}")
+    return args
+
+def main(argv=None):
+    ap = build_parser()
+    args = parse_args(argv, ap)
+    service = Service(args)
+    if args.load:
+        try:
+            added, skipped = service.load(args.load)
+        except (OSError, ValueError) as e:
+            ap.error(str(e))
+        print(f"index: {added} fingerprints loaded" + (f", {skipped} incompatible skipped" if skipped else ""),
+              file=sys.stderr)
+
+    server, where = make_server(args, service)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"listening on {where}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+if __name__ == "__main__":
+    main()
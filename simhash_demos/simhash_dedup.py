@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Online near-duplicate filter: drop records of a live stream whose SimHash is
+within Hamming distance k of a record seen recently.
+
+    tail -F app.jsonl | python simhash_dedup.py --field msg --mode text --ngram 3 --k 3 --max-age 600 --emit kept
+    python simhash_dedup.py requests.jsonl.gz --field request.body --id-field id --time-field ts --max-age 3600
+    python simhash_dedup.py dump.nul --records nul --max-items 200000 --json
+
+(also reachable as `simhash_complete_chunked.py dedup ...`)
+
+The window holds at most --max-items fingerprints (--max-memory converts a byte
+budget using the per-fingerprint cost measured at startup for the chosen bitlen
+and k, see entry_bytes) and, with --max-age, none older than that many seconds. It is LRU: a record that matches refreshes the matched entry,
+so a burst of repeats keeps its first occurrence alive. Lookups split each
+fingerprint into k+1 bands: two fingerprints within distance k agree on at least
+one band (pigeonhole), so a lookup is k+1 dict probes plus a distance check of
+the entries found. Inserting and evicting are one dict update per band. Bands
+are kept at least MIN_BAND_BITS wide (narrower ones match a large share of the
+window), so for larger k (k >= 4 at 64 bits, k >= 8 at 128) there are fewer
+bands and each is probed at every value within k // bands bits, as simhash_index
+does; when that is more probes than the window has entries, the window is
+scanned. Lookups stay cheap up to about k = 7 at 64 bits and k = 15 at 128.
+
+Decisions (--emit decisions, the default) are `keep  ID` or `drop  ID  MATCH_ID
+DISTANCE` lines (TSV, or JSON with --json). Records that cannot be decided (bad
+JSON, or with --time-field no finite number there) are kept and get an error row
+instead, and never enter the window. IDs are line (record) numbers or the
+--id-field value. --emit kept / dropped instead passes those records through
+unchanged. Records are read, hashed (one simhash_many call per read) and decided
+as they arrive; output is flushed after each read. Needs NumPy.
+"""
+import argparse, json, math, random, sys, time, tracemalloc
+from collections import OrderedDict
+
+from simhash_complete_chunked import (
+    HASH_FAMILIES, RECORD_BATCH, RECORD_SEPARATORS, check_engine, hamming_distance, iter_record_groups,
+    open_binary, parse_field_path, parse_json_batch, parse_size, select_fields, simhash_many, unpack_hashes,
+)
+from simhash_index import flip_masks
+
+ENTRY_SAMPLE = 4096         # fingerprints inserted to measure the per-entry cost (entry_bytes)
+ENTRY_HEADROOM = 1.25       # the band dicts grow in steps: the sample can land on a dense table
+MIN_BAND_BITS = 16          # a band of w bits matches ~1/2**w of the window per probe
+
+class NearDupFilter:
+    """
+    Sliding window of fingerprints with Hamming-k lookup. check() returns the decision
+    for one fingerprint and inserts it when kept; the window is bounded by max_items
+    and, when max_age is set, by the time since an entry was inserted or last matched.
+    """
+    def __init__(self, bitlen=64, k=3, max_items=1_000_000, max_age=None, clock=time.monotonic):
+        if not 0 <= k < bitlen:
+            raise ValueError(f"k must be in [0, {bitlen})")
+        if max_items < 1:
+            raise ValueError("max_items must be >= 1")
+        self.bitlen, self.k, self.max_items, self.max_age, self.clock = bitlen, k, max_items, max_age, clock
+        self.bands = max(1, min(k + 1, bitlen // MIN_BAND_BITS))
+        self.width = -(-bitlen // self.bands)
+        self.radius = k // self.bands                    # differing bits allowed in the closest band
+        self.probes = self.bands * sum(math.comb(self.width, r) for r in range(self.radius + 1))
+        self._masks = None                               # flip_masks(width, radius), built on first use
+        self._mask = (1 << self.width) - 1
+        self._tables = [{} for _ in range(self.bands)]  # band value -> seq, or a set of seqs on collisions
+        self._entries = OrderedDict()                    # seq -> (hash, id, last used), least recently used first
+        self._seq = 0
+        self.kept = self.dropped = self.evicted_full = self.evicted_age = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _keys(self, h):
+        return [(h >> (j * self.width)) & self._mask for j in range(self.bands)]
+
+    def lookup(self, h):
+        """(distance, seq) of the nearest entry within k of h, or None."""
+        best = None
+        entries = self._entries
+        for seq in entries if self.probes > len(entries) else self._candidates(h):
+            d = hamming_distance(h, entries[seq][0])
+            if d <= self.k and (best is None or d < best[0]):
+                best = (d, seq)
+        return best
+
+    def _candidates(self, h):
+        """seqs of the entries agreeing with h on some band up to `radius` bits (repeats possible)."""
+        if self._masks is None:
+            self._masks = list(flip_masks(self.width, self.radius))
+        for table, key in zip(self._tables, self._keys(h)):
+            for m in self._masks:
+                b = table.get(key ^ m)
+                if b is None:
+                    continue
+                if isinstance(b, int):
+                    yield b
+                else:
+                    yield from b
+
+    def check(self, h, id=None, now=None):
+        """
+        Decide on fingerprint h: (True, None, None) and h is added as `id`, or
+        (False, matched id, distance) and the matched entry becomes most recently used.
+        now: the record's time (default: clock()), used for max_age.
+        """
+        now = self.clock() if now is None else now
+        self.expire(now)
+        hit = self.lookup(h)
+        if hit is not None:
+            d, seq = hit
+            mh, mid, _ = self._entries[seq]
+            self._entries[seq] = (mh, mid, now)
+            self._entries.move_to_end(seq)
+            self.dropped += 1
+            return False, mid, d
+        self._insert(h, id, now)
+        self.kept += 1
+        return True, None, None
+
+    def _insert(self, h, id, now):
+        seq = self._seq
+        self._seq += 1
+        self._entries[seq] = (h, id, now)
+        for table, key in zip(self._tables, self._keys(h)):
+            b = table.get(key)
+            if b is None:
+                table[key] = seq
+            elif isinstance(b, int):
+                table[key] = {b, seq}
+            else:
+                b.add(seq)
+        if len(self._entries) > self.max_items:
+            self._remove(next(iter(self._entries)))
+            self.evicted_full += 1
+
+    def _remove(self, seq):
+        h, _, _ = self._entries.pop(seq)
+        for table, key in zip(self._tables, self._keys(h)):
+            b = table[key]
+            if isinstance(b, int):
+                del table[key]
+            else:
+                b.discard(seq)
+                if len(b) == 1:
+                    table[key] = b.pop()
+
+    def expire(self, now):
+        """Evict entries unused for more than max_age (least recently used first)."""
+        if self.max_age is None:
+            return
+        entries = self._entries
+        while entries:
+            seq = next(iter(entries))
+            if now - entries[seq][2] <= self.max_age:
+                break
+            self._remove(seq)
+            self.evicted_age += 1
+
+    def summary(self):
+        return {"kept": self.kept, "dropped": self.dropped, "window": len(self),
+                "evicted_full": self.evicted_full, "evicted_age": self.evicted_age}
+
+def entry_bytes(bitlen=64, k=3):
+    """
+    Bytes of Python heap per fingerprint in a NearDupFilter(bitlen, k), measured by
+    filling one with ENTRY_SAMPLE random fingerprints (with line-number ids) under
+    tracemalloc, plus ENTRY_HEADROOM. Grows with the number of band dicts and with bitlen.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        flt = NearDupFilter(bitlen=bitlen, k=k, max_items=ENTRY_SAMPLE)
+        rng = random.Random(0)
+        for i in range(ENTRY_SAMPLE):
+            flt._insert(rng.getrandbits(bitlen), i, 0.0)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return math.ceil(used / ENTRY_SAMPLE * ENTRY_HEADROOM)
+
+class _LiveReader:
+    """read() that returns what is available instead of waiting for a full chunk (pipes, tail -F)."""
+    def __init__(self, fh):
+        self.fh = fh
+
+    def read(self, size=-1):
+        return self.fh.read1(size)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _as_number(text):
+    try:
+        v = float(text)
+    except (TypeError, ValueError):
+        return None
+    return v if math.isfinite(v) else None
+
+def decide_records(group, flt, args):
+    """Decisions for a list of iter_record_groups records: (record, id, keep, match id, distance | error text)."""
+    fields, ids, times = args.fields, [r[0] for r in group], [None] * len(group)
+    errors = {}
+    if fields or args.id_field or args.time_field:
+        docs = []
+        for j, (r, obj) in enumerate(zip(group, parse_json_batch([r[3] for r in group]))):
+            if isinstance(obj, ValueError):
+                errors[j] = f"{type(obj).__name__}: {obj}"
+                continue
+            if args.id_field:
+                ids[j] = select_fields(obj, [args.id_field]) or r[0]
+            if args.time_field:
+                times[j] = _as_number(select_fields(obj, [args.time_field]))
+                if times[j] is None:        # arrival time would mix clocks with the records' timestamps
+                    errors[j] = f"no numeric time at {'.'.join(args.time_field)}"
+                    continue
+            text = select_fields(obj, fields) if fields else None
+            docs.append(text.encode("utf-8", "surrogatepass") if text is not None else r[3])
+    else:
+        docs = [r[3] for r in group]
+    hashes = unpack_hashes(simhash_many(docs, mode=args.mode, bitlen=args.bitlen, ngram=args.ngram, step=args.step,
+                                        feature_hash=args.feature_hash, chunk_size=args.chunk_size))
+    out, hashes = [], iter(hashes)
+    for j, r in enumerate(group):
+        if j in errors:
+            out.append((r, ids[j], True, None, errors[j]))
+            continue
+        keep, mid, d = flt.check(next(hashes), ids[j], now=times[j])
+        out.append((r, ids[j], keep, mid, d))
+    return out
+
+def format_decision(rec_id, keep, mid, d, as_json):
+    if isinstance(d, str):
+        return json.dumps({"id": rec_id, "decision": "keep", "error": d}) if as_json else f"keep\t{rec_id}\t-\t{d}"
+    if as_json:
+        return json.dumps({"id": rec_id, "decision": "keep"} if keep else
+                          {"id": rec_id, "decision": "drop", "match": mid, "distance": d}, ensure_ascii=False)
+    return f"keep\t{rec_id}" if keep else f"drop\t{rec_id}\t{mid}\t{d}"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Drop near-duplicate records from a stream (sliding SimHash window).")
+    ap.add_argument("input", nargs="?", default="-", help="Record stream, plain or .gz/.bz2/.xz ('-' = stdin; default)")
+    ap.add_argument("--records", choices=list(RECORD_SEPARATORS), default="jsonl",
+                    help="jsonl/ndjson = one record per line, nul = NUL-separated (default: jsonl)")
+    ap.add_argument("--field", action="append", default=[], metavar="PATH",
+                    help="Hash only the JSON value at this dotted path (repeatable; records without any of them, "
+                         "and by default all records, are hashed whole)")
+    ap.add_argument("--id-field", metavar="PATH", type=parse_field_path, default=None,
+                    help="Report records by this JSON value instead of their line number")
+    ap.add_argument("--time-field", metavar="PATH", type=parse_field_path, default=None,
+                    help="Record time for --max-age, in seconds (e.g. a Unix timestamp; default: arrival time). "
+                         "Records without a number there are kept with an error row")
+    ap.add_argument("--mode", choices=["text", "bytes"], default="bytes")
+    ap.add_argument("--bitlen", type=int, default=64)
+    ap.add_argument("--ngram", type=int, default=7)
+    ap.add_argument("--step", type=int, default=1, help="[bytes] slide step in bytes")
+    ap.add_argument("--hash", dest="feature_hash", choices=HASH_FAMILIES, default="blake2b")
+    ap.add_argument("--chunk-size", type=int, default=1<<20, help="Read size per chunk (bytes)")
+    ap.add_argument("--k", type=int, default=3, help="Maximum Hamming distance of a near duplicate; lookups stay fast up to about "
+                         "bitlen/8 - 1 (7 at 64 bits), larger k probe more (default: 3)")
+    ap.add_argument("--max-items", type=int, default=1_000_000, help="Fingerprints kept in the window (default: 1000000)")
+    ap.add_argument("--max-memory", default=None,
+                    help="Cap the window at this size instead (e.g. 256M; the cost per fingerprint is measured "
+                         "at startup for --bitlen/--k)")
+    ap.add_argument("--max-age", type=float, default=None,
+                    help="Forget fingerprints not inserted or matched in this many seconds (default: never)")
+    ap.add_argument("--emit", choices=["decisions", "kept", "dropped"], default="decisions",
+                    help="Decision lines, or the kept/dropped records themselves (default: decisions)")
+    ap.add_argument("--json", action="store_true", help="JSON decision lines")
+    args = ap.parse_args(argv)
+    try:
+        check_engine("numpy")
+        args.fields = [parse_field_path(f) for f in args.field]
+        max_items = args.max_items
+        if args.max_memory:
+            max_items = min(max_items, max(1, parse_size(args.max_memory) // entry_bytes(args.bitlen, args.k)))
+        flt = NearDupFilter(bitlen=args.bitlen, k=args.k, max_items=max_items, max_age=args.max_age)
+    except (RuntimeError, ValueError) as e:
+        ap.error(str(e))
+
+    out = sys.stdout.buffer
+    sep = RECORD_SEPARATORS[args.records]
+    fh = _LiveReader(sys.stdin.buffer) if args.input == "-" else open_binary(args.input, readahead=4)
+    t0 = time.perf_counter()
+    try:
+        with fh:
+            for group in iter_record_groups(fh, sep, args.chunk_size):
+                for lo in range(0, len(group), RECORD_BATCH):
+                    for r, rec_id, keep, mid, d in decide_records(group[lo:lo + RECORD_BATCH], flt, args):
+                        if args.emit == "decisions":
+                            out.write(format_decision(rec_id, keep, mid, d, args.json).encode() + b"\n")
+                        elif keep == (args.emit == "kept"):
+                            out.write(r[3] + sep)
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    s = flt.summary()
+    print(f"dedup: {s['kept']} kept, {s['dropped']} dropped in {time.perf_counter() - t0:.2f}s; window {s['window']} "
+          f"(max {max_items}), evicted {s['evicted_full']} full + {s['evicted_age']} aged", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Block-level deltas: ship or store only the blocks of a file that changed.
+
+    python simhash_delta.py manifest base.bin > base.manifest
+    python simhash_delta.py diff base.manifest modified.bin > modified.patch
+    python simhash_delta.py apply base.bin modified.patch -o modified.copy
+
+(also reachable as `simhash_complete_chunked.py delta manifest|diff|apply ...`)
+
+A manifest lists the old file's blocks (content-defined by default, so an
+insert or delete only changes the blocks around it) with their SimHash and a
+blake2b digest (spans without a whole n-gram have no SimHash but still have a
+digest: blocks cover every byte), as JSON lines: a header with the block parameters, one line per
+block, and the file's size and digest at the end. diff cuts the new file into
+blocks the same way and writes a patch of copy operations (runs of old blocks
+with the same digest) and literal blocks (zlib-compressed). It needs only the
+manifest; with --old, a changed block whose SimHash is within --k of an old
+block is compressed with that old block as zlib's preset dictionary, which
+costs little more than the bytes that actually differ (apply reads the same
+block from its base file). apply rebuilds the new file from the old one and
+checks its size and digest.
+
+All three stream: memory is one chunk plus one block (and, for diff, the
+manifest's digests), whatever the file sizes. Patch layout after the MAGIC line
+and a JSON header line, little-endian:
+    C  start u64, length u64                                copy from the old file
+    L  length u32, bytes                                    literal
+    Z  length u32, zlen u32, dict start u64, dict len u32, zlib data
+    E  size u64, blake2b-256 digest of the new file         end
+"""
+import argparse, hashlib, json, os, struct, sys, zlib
+
+from simhash_complete_chunked import (
+    CHUNKINGS, HASH_FAMILIES, BufferReader, check_feature_hash, hamming_distance, hamming_one_to_many,
+    iter_bytes_blocks_fh, make_blocks, np, open_binary, open_maybe_compressed, pack_hashes, parse_size, to_fixed_hex,
+)
+
+MANIFEST = "simhash-delta 1"
+MAGIC = b"simhash-delta-patch 1\n"
+BLOCK_DIGEST = 16           # bytes of blake2b per block
+ZDICT_MAX = 32 << 10        # zlib only looks back 32 KiB: longer dictionaries are cut to their end
+COPY_PIECE = 1 << 20        # apply copies old ranges in pieces of this size
+
+_COPY = struct.Struct("<QQ")
+_LIT = struct.Struct("<I")
+_ZLIT = struct.Struct("<IIQI")
+_END = struct.Struct("<Q")
+
+class _Spool:
+    """read() that keeps what it hands out until take() claims it, so block bytes come out with their records."""
+    def __init__(self, fh):
+        self.fh = fh
+        self.buf = bytearray()
+        self.base = 0           # offset of buf[0]
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.buf += data
+        return data
+
+    def take(self, start, end):
+        """Bytes [start, end) of the stream, dropping everything before end (blocks are taken in order)."""
+        data = bytes(self.buf[start - self.base:end - self.base])
+        del self.buf[:end - self.base]
+        self.base = end
+        return data
+
+    def total(self):
+        """Byte count of the whole stream (reads whatever the hasher left unread)."""
+        while self.read(1 << 20):
+            pass
+        return self.base + len(self.buf)
+
+def iter_blocks(fh, params, chunk_size=1<<20):
+    """
+    (start, end, SimHash or None, block bytes) for every byte of an open stream, in order: blocks cut and
+    hashed as params (a manifest header) say. Spans the hasher has no record for, because no n-gram ends
+    in them (a stream shorter than an n-gram, bytes skipped by --step, a cut before the first full window),
+    come out in pieces of at most block_size bytes with no SimHash.
+    """
+    if isinstance(fh, BufferReader):        # mapped file: blocks are views of the mapping
+        first = fh.pos
+        src, take, total = fh, (lambda s, e: fh.mv[first + s:first + e]), (lambda: fh.end - first)
+    else:
+        src = _Spool(fh)
+        take, total = src.take, src.total
+    bs = params["block_size"]
+
+    def gap(lo, hi):
+        for s in range(lo, hi, bs):
+            e = min(hi, s + bs)
+            yield s, e, None, take(s, e)
+
+    engine = "numpy" if np is not None else "python"
+    pos = 0
+    for r in iter_bytes_blocks_fh(src, bitlen=params["bitlen"], n=params["ngram"], step=params["step"],
+                                  block_size=bs, chunk_size=chunk_size, engine=engine,
+                                  feature_hash=params["hash"], chunking=params["chunking"],
+                                  cdc_min=params["cdc_min"], cdc_max=params["cdc_max"]):
+        if r["end"] <= r["start"]:
+            continue
+        yield from gap(pos, r["start"])
+        yield r["start"], r["end"], r["hash"], take(r["start"], r["end"])
+        pos = r["end"]
+    yield from gap(pos, total())
+
+def block_digest(data):
+    return hashlib.blake2b(data, digest_size=BLOCK_DIGEST).digest()
+
+# ---------- manifest ----------
+def write_manifest(fh, out, params, chunk_size=1<<20):
+    """Write the manifest of an open stream as JSON lines; returns (size, digest hex)."""
+    out.write(json.dumps(dict(params, manifest=MANIFEST)) + "\n")
+    whole = hashlib.blake2b(digest_size=32)
+    size = 0
+    for start, end, h, data in iter_blocks(fh, params, chunk_size):
+        whole.update(data)
+        size += len(data)
+        out.write(json.dumps({"start": start, "end": end,
+                              "hash": None if h is None else to_fixed_hex(h, params["bitlen"]),
+                              "digest": block_digest(data).hex()}) + "\n")
+    out.write(json.dumps({"size": size, "digest": whole.hexdigest()}) + "\n")
+    return size, whole.hexdigest()
+
+class Manifest:
+    """A loaded manifest: block parameters, blocks by digest and by start, and the SimHashes for nearest-block lookups."""
+    def __init__(self, path):
+        self.by_digest = {}     # digest -> start of its first block
+        self.at = {}            # start -> (end, digest)
+        starts, hashes = [], []
+        self.size = self.digest = None
+        with open_maybe_compressed(path, "rt") as fh:
+            lines = iter(fh)
+            try:
+                self.params = json.loads(next(lines))
+            except (StopIteration, ValueError):
+                raise ValueError(f"{path}: not a manifest") from None
+            if self.params.get("manifest") != MANIFEST:
+                raise ValueError(f"{path}: not a manifest")
+            for line in lines:
+                rec = json.loads(line)
+                if "size" in rec:
+                    self.size, self.digest = rec["size"], rec["digest"]
+                    break
+                d = bytes.fromhex(rec["digest"])
+                self.by_digest.setdefault(d, rec["start"])
+                self.at[rec["start"]] = (rec["end"], d)
+                if rec["hash"] is not None:
+                    starts.append(rec["start"])
+                    hashes.append(int(rec["hash"], 16))
+        if self.size is None:
+            raise ValueError(f"{path}: truncated manifest (no size/digest line)")
+        self.starts = starts
+        self.hashes = hashes
+        self._packed = pack_hashes(hashes, self.params["bitlen"]) if np is not None and hashes else None
+
+    def nearest(self, h, k):
+        """(start, end) of the old block whose SimHash is nearest to h if within k, else None."""
+        if not self.hashes:
+            return None
+        if self._packed is not None:
+            d = hamming_one_to_many(h, self._packed)
+            i = int(d.argmin())
+            dist = int(d[i])
+        else:
+            dist, i = min((hamming_distance(h, x), i) for i, x in enumerate(self.hashes))
+        if dist > k:
+            return None
+        return self.starts[i], self.at[self.starts[i]][0]
+
+# ---------- patch ----------
+class PatchWriter:
+    """Writes patch operations, merging copies of adjacent old ranges, and counts what went where."""
+    def __init__(self, out, header):
+        self.out = out
+        self.pending = None     # [start, length] of a copy not written yet
+        self.size = 0
+        self.whole = hashlib.blake2b(digest_size=32)
+        self.stats = {"blocks": 0, "copied": 0, "copy_bytes": 0, "copy_ops": 0, "literal": 0, "literal_bytes": 0,
+                      "with_dict": 0}
+        out.write(MAGIC + json.dumps(header).encode() + b"\n")
+        self.written = len(MAGIC) + len(json.dumps(header)) + 1
+
+    def _write(self, data):
+        self.out.write(data)
+        self.written += len(data)
+
+    def _flush_copy(self):
+        if self.pending:
+            self._write(b"C" + _COPY.pack(*self.pending))
+            self.stats["copy_ops"] += 1
+            self.pending = None
+
+    def copy(self, start, data):
+        """Block `data` is old[start:start + len(data)]."""
+        self._count(data)
+        self.stats["copied"] += 1
+        self.stats["copy_bytes"] += len(data)
+        if self.pending and self.pending[0] + self.pending[1] == start:
+            self.pending[1] += len(data)
+        else:
+            self._flush_copy()
+            self.pending = [start, len(data)]
+
+    def literal(self, data, zdict=b"", dict_start=0, level=6):
+        """A block not in the old file, compressed (with zdict, old[dict_start:...], as preset dictionary if given)."""
+        self._count(data)
+        self._flush_copy()
+        self.stats["literal"] += 1
+        self.stats["literal_bytes"] += len(data)
+        comp = zlib.compressobj(level, zdict=zdict) if zdict else zlib.compressobj(level)
+        z = comp.compress(data) + comp.flush()
+        if len(z) + _ZLIT.size < len(data) + _LIT.size:
+            self._write(b"Z" + _ZLIT.pack(len(data), len(z), dict_start, len(zdict)) + z)
+            self.stats["with_dict"] += bool(zdict)
+        else:
+            self._write(b"L" + _LIT.pack(len(data)) + data)
+
+    def _count(self, data):
+        self.stats["blocks"] += 1
+        self.size += len(data)
+        self.whole.update(data)
+
+    def close(self):
+        self._flush_copy()
+        self._write(b"E" + _END.pack(self.size) + self.whole.digest())
+
+def _read_exact(fh, n, what="patch"):
+    data = fh.read(n)
+    if len(data) != n:
+        raise ValueError(f"truncated {what}")
+    return data
+
+def _read_dict(base, start, length):
+    keep = min(length, ZDICT_MAX)
+    base.seek(start + length - keep)
+    return _read_exact(base, keep, "base file")
+
+def make_patch(manifest, fh, out, base=None, k=None, level=6, chunk_size=1<<20):
+    """Write the patch turning the manifest's file into the stream fh; base: the old file (seekable) for dictionaries."""
+    header = {"base_size": manifest.size, "base_digest": manifest.digest,
+              "block_size": manifest.params["block_size"], "chunking": manifest.params["chunking"]}
+    w = PatchWriter(out, header)
+    for _, _, h, data in iter_blocks(fh, manifest.params, chunk_size):
+        d = block_digest(data)
+        start = manifest.by_digest.get(d)
+        if start is not None:
+            if w.pending:
+                nxt = w.pending[0] + w.pending[1]
+                if manifest.at.get(nxt, (None, None))[1] == d:
+                    start = nxt         # keep the copy run going
+            w.copy(start, data)
+            continue
+        near = manifest.nearest(h, k) if base is not None and h is not None else None
+        if near is None:
+            w.literal(data, level=level)
+        else:
+            s, e = near
+            zdict = _read_dict(base, s, e - s)
+            w.literal(data, zdict, e - len(zdict), level)
+    w.close()
+    return w
+
+def apply_patch(base, patch, out):
+    """Rebuild the new file from base (seekable old file) and patch into out; returns its size."""
+    if patch.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a simhash-delta patch")
+    try:
+        header = json.loads(patch.readline())
+    except ValueError:
+        raise ValueError("corrupt patch header") from None
+    base.seek(0, os.SEEK_END)
+    if base.tell() != header["base_size"]:
+        raise ValueError(f"base file has {base.tell()} bytes, the patch was made against {header['base_size']}")
+    whole = hashlib.blake2b(digest_size=32)
+    size = 0
+
+    def emit(data):
+        nonlocal size
+        out.write(data)
+        whole.update(data)
+        size += len(data)
+
+    while True:
+        op = patch.read(1)
+        if op == b"C":
+            start, length = _COPY.unpack(_read_exact(patch, _COPY.size))
+            base.seek(start)
+            while length:
+                piece = _read_exact(base, min(length, COPY_PIECE), "base file")
+                emit(piece)
+                length -= len(piece)
+        elif op == b"L":
+            (length,) = _LIT.unpack(_read_exact(patch, _LIT.size))
+            emit(_read_exact(patch, length))
+        elif op == b"Z":
+            length, zlen, dict_start, dict_len = _ZLIT.unpack(_read_exact(patch, _ZLIT.size))
+            z = _read_exact(patch, zlen)
+            if dict_len:
+                base.seek(dict_start)
+                dec = zlib.decompressobj(zdict=_read_exact(base, dict_len, "base file"))
+            else:
+                dec = zlib.decompressobj()
+            try:
+                data = dec.decompress(z) + dec.flush()
+            except zlib.error as e:
+                raise ValueError(f"corrupt patch: {e}") from None
+            if len(data) != length:
+                raise ValueError("corrupt patch: literal length mismatch")
+            emit(data)
+        elif op == b"E":
+            (want,) = _END.unpack(_read_exact(patch, _END.size))
+            digest = _read_exact(patch, whole.digest_size)
+            if size != want or whole.digest() != digest:
+                raise ValueError("result does not match the patch's size/digest (wrong base file?)")
+            return size
+        else:
+            raise ValueError("truncated patch" if not op else f"corrupt patch: unknown operation {op!r}")
+
+# ---------- CLI ----------
+def cmd_manifest(args):
+    check_feature_hash(args.feature_hash)
+    make_blocks(args.block_size, args.chunking, args.cdc_min, args.cdc_max)     # validate before reading
+    params = {"path": args.input, "bitlen": args.bitlen, "ngram": args.ngram, "step": args.step,
+              "hash": args.feature_hash, "chunking": args.chunking, "block_size": args.block_size,
+              "cdc_min": args.cdc_min, "cdc_max": args.cdc_max}
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        with open_binary(args.input, readahead=4) as fh:
+            size, _ = write_manifest(fh, out, params, args.chunk_size)
+    finally:
+        if args.output:
+            out.close()
+    print(f"manifest: {args.input}: {size} bytes", file=sys.stderr)
+
+def cmd_diff(args):
+    manifest = Manifest(args.manifest)
+    k = args.k if args.k is not None else manifest.params["bitlen"] // 4
+    base = open(args.old, "rb") if args.old else None
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        if base is not None and os.fstat(base.fileno()).st_size != manifest.size:
+            raise ValueError(f"{args.old} is not the manifest's file (size differs)")
+        with open_binary(args.input, readahead=4) as fh:
+            w = make_patch(manifest, fh, out, base=base, k=k, level=args.level, chunk_size=args.chunk_size)
+    finally:
+        if base is not None:
+            base.close()
+        if args.output:
+            out.close()
+    s = w.stats
+    print(f"delta: {s['blocks']} blocks, {s['copied']} copied ({s['copy_bytes']} bytes in {s['copy_ops']} ops), "
+          f"{s['literal']} literal ({s['literal_bytes']} bytes, {s['with_dict']} against a similar old block); "
+          f"patch {w.written} bytes ({w.written / max(1, w.size) * 100:.1f}% of {w.size})", file=sys.stderr)
+
+def cmd_apply(args):
+    if args.output and os.path.exists(args.output) and os.path.samefile(args.output, args.old):
+        raise ValueError("the output must not be the base file")
+    tmp = args.output + ".tmp" if args.output else None
+    with open(args.old, "rb") as base, open_maybe_compressed(args.patch, "rb") as patch:
+        out = open(tmp, "wb") if tmp else sys.stdout.buffer
+        try:
+            size = apply_patch(base, patch, out)
+        except BaseException:
+            if tmp:
+                out.close()
+                os.unlink(tmp)
+            raise
+    if tmp:
+        out.close()
+        os.replace(tmp, args.output)
+    print(f"apply: {size} bytes", file=sys.stderr)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Block-level delta patches from SimHash block manifests.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    m = sub.add_parser("manifest", help="List a file's blocks with SimHash and digest (JSON lines)")
+    m.add_argument("input", help="File (plain or .gz/.bz2/.xz) or '-' for stdin")
+    m.add_argument("-o", "--output", default=None, help="Write here instead of stdout")
+    m.add_argument("--block-size", type=parse_size, default=8 << 10,
+                   help="(Average) block size; patches carry changed blocks whole (default: 8K)")
+    m.add_argument("--chunking", choices=CHUNKINGS, default="cdc",
+                   help="cdc keeps blocks after an insert/delete unchanged (default: cdc)")
+    m.add_argument("--cdc-min", type=parse_size, default=None)
+    m.add_argument("--cdc-max", type=parse_size, default=None)
+    m.add_argument("--bitlen", type=int, default=64)
+    m.add_argument("--ngram", type=int, default=7)
+    m.add_argument("--step", type=int, default=1)
+    m.add_argument("--hash", dest="feature_hash", choices=HASH_FAMILIES, default="rolling")
+    m.add_argument("--chunk-size", type=int, default=1<<20)
+    m.set_defaults(func=cmd_manifest)
+
+    d = sub.add_parser("diff", help="Patch from a manifest's file to a new file")
+    d.add_argument("manifest", help="Manifest of the old file")
+    d.add_argument("input", help="New file (plain or .gz/.bz2/.xz) or '-' for stdin")
+    d.add_argument("-o", "--output", default=None, help="Write the patch here instead of stdout")
+    d.add_argument("--old", default=None,
+                   help="The old file itself: compress changed blocks against their SimHash-nearest old block")
+    d.add_argument("--k", type=int, default=None,
+                   help="With --old: maximum Hamming distance of a dictionary block (default: bitlen/4)")
+    d.add_argument("--level", type=int, default=6, help="zlib level for changed blocks (default: 6)")
+    d.add_argument("--chunk-size", type=int, default=1<<20)
+    d.set_defaults(func=cmd_diff)
+
+    a = sub.add_parser("apply", help="Rebuild the new file from the old file and a patch")
+    a.add_argument("old", help="The old file (plain, seekable)")
+    a.add_argument("patch", help="Patch file or '-' for stdin")
+    a.add_argument("-o", "--output", default=None,
+                   help="Write here (via a temporary file, replaced only when the digest checks out) instead of stdout")
+    a.set_defaults(func=cmd_apply)
+
+    args = ap.parse_args(argv)
+    try:
+        args.func(args)
+    except (RuntimeError, ValueError) as e:
+        ap.error(str(e))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Persistent near-duplicate index over SimHash fingerprints (64/128/256-bit...).
+
+Band splitting (pigeonhole): each fingerprint is cut into `bands` bit ranges and
+every range is stored in a B-tree keyed by (band, value). Two fingerprints within
+Hamming distance k agree exactly on at least one band when k < bands, so a query
+is `bands` index lookups plus an exact distance check of the few candidates.
+For k >= bands some band differs by at most k // bands bits, and the query probes
+every value within that radius instead; when that is more probes than the index
+has rows (large k), it scans the rows.
+
+    python simhash_index.py build corpus.idx out.tsv more.jsonl
+    python simhash_index.py query corpus.idx new.tsv --k 3
+    python simhash_index.py query corpus.idx --hash 5e97ac9daf08ddb8ad3fa2dc78f48245 --k 5
+
+(also reachable as `simhash_complete_chunked.py index build|query ...`)
+"""
+import argparse, itertools, json, math, sqlite3, sys
+
+from simhash_complete_chunked import hamming_distance, iter_record_files, to_fixed_hex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    id    INTEGER PRIMARY KEY,
+    hash  TEXT    NOT NULL,
+    path  TEXT    NOT NULL,
+    block INTEGER,
+    start INTEGER,
+    end   INTEGER,
+    line  INTEGER
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    key  INTEGER NOT NULL,
+    id   INTEGER NOT NULL,
+    PRIMARY KEY (band, key, id)
+) WITHOUT ROWID;
+"""
+
+def _signed64(v: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return v - (1 << 64) if v >= 1 << 63 else v
+
+def flip_masks(width, radius):
+    """All masks of up to `radius` set bits within a `width`-bit band (0 first)."""
+    for r in range(radius + 1):
+        for bits in itertools.combinations(range(width), r):
+            m = 0
+            for b in bits:
+                m |= 1 << b
+            yield m
+
+class HammingIndex:
+    def __init__(self, db_path, bitlen=None, label=None, bands=4):
+        """
+        Open (or create) an index. bitlen/label are fixed by the first build and
+        checked afterwards, so fingerprints of different sizes or feature hashes
+        never end up in the same index.
+        """
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        if "line" not in [row[1] for row in self.db.execute("PRAGMA table_info(entries)")]:
+            self.db.execute("ALTER TABLE entries ADD COLUMN line INTEGER")     # indexes built before --records
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        if meta:
+            self.bitlen, self.label, self.bands = int(meta["bitlen"]), meta["label"], int(meta["bands"])
+        else:
+            self.bitlen, self.label, self.bands = bitlen, label, bands
+        self.width = None if self.bitlen is None else -(-self.bitlen // self.bands)
+        if self.width is not None and self.width > 64:
+            raise ValueError(f"{self.bitlen}-bit hashes need at least {-(-self.bitlen // 64)} bands")
+
+    def _init_meta(self, bitlen, label):
+        self.bitlen, self.label = bitlen, label
+        self.width = -(-bitlen // self.bands)
+        if self.width > 64:
+            raise ValueError(f"{bitlen}-bit hashes need at least {-(-bitlen // 64)} bands")
+        self.db.executemany("INSERT INTO meta VALUES (?, ?)",
+                            [("bitlen", str(bitlen)), ("label", label), ("bands", str(self.bands))])
+
+    def band_keys(self, h):
+        mask = (1 << self.width) - 1
+        return [(h >> (j * self.width)) & mask for j in range(self.bands)]
+
+    def add(self, records):
+        """Insert parsed records (see parse_record); returns (added, skipped_incompatible)."""
+        added = skipped = 0
+        cur = self.db.cursor()
+        for rec in records:
+            if self.bitlen is None:
+                self._init_meta(rec["bitlen"], rec["label"])
+            if rec["bitlen"] != self.bitlen or rec["label"] != self.label:
+                skipped += 1
+                continue
+            cur.execute("INSERT INTO entries (hash, path, block, start, end, line) VALUES (?, ?, ?, ?, ?, ?)",
+                        (to_fixed_hex(rec["hash"], self.bitlen), rec["path"],
+                         rec.get("block"), rec.get("start"), rec.get("end"), rec.get("line")))
+            eid = cur.lastrowid
+            cur.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                            [(j, _signed64(v), eid) for j, v in enumerate(self.band_keys(rec["hash"]))])
+            added += 1
+        self.db.commit()
+        return added, skipped
+
+    def query(self, h, k=3):
+        """All entries within Hamming distance k of h, as (distance, entry dict), nearest first."""
+        if self.bitlen is None:
+            return []
+        if k < 0:
+            raise ValueError("k must be >= 0")
+        radius = min(k // self.bands, self.width)
+        probes = self.bands * sum(math.comb(self.width, r) for r in range(radius + 1))
+        if probes > len(self):
+            rows = self.db.execute("SELECT id, hash, path, block, start, end, line FROM entries")
+        else:
+            rows = self._band_rows(h, flip_masks(self.width, radius))
+        seen = set()
+        out = []
+        for eid, hx, path, block, start, end, line in rows:
+            if eid in seen:
+                continue
+            seen.add(eid)
+            d = hamming_distance(h, int(hx, 16))
+            if d <= k:
+                entry = {"path": path, "hash": int(hx, 16)}
+                if block is not None:
+                    entry.update(block=block, start=start, end=end)
+                elif line is not None:
+                    entry["line"] = line
+                out.append((d, entry))
+        out.sort(key=lambda t: t[0])
+        return out
+
+    def _band_rows(self, h, masks):
+        """Entries agreeing with h on some band up to one of the masks."""
+        masks = list(masks)
+        for j, v in enumerate(self.band_keys(h)):
+            keys = [_signed64(v ^ m) for m in masks if (v ^ m) >> self.width == 0]
+            for lo in range(0, len(keys), 500):
+                chunk = keys[lo:lo + 500]
+                yield from self.db.execute(
+                    "SELECT e.id, e.hash, e.path, e.block, e.start, e.end, e.line FROM bands b "
+                    "JOIN entries e ON e.id = b.id "
+                    f"WHERE b.band = ? AND b.key IN ({','.join('?' * len(chunk))})", (j, *chunk))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+def _ref(rec):
+    if "block" in rec:
+        return f"{rec['path']}\tblock={rec['block']}\t[{rec['start']},{rec['end']})"
+    if "line" in rec:
+        return f"{rec['path']}\tline={rec['line']}"
+    return rec["path"]
+
+def cmd_build(args):
+    idx = HammingIndex(args.index, bands=args.bands)
+    added, skipped = idx.add(iter_record_files(args.inputs))
+    print(f"{args.index}: +{added} fingerprints ({len(idx)} total, {idx.bitlen}-bit {idx.label}, "
+          f"{idx.bands} bands)", file=sys.stderr)
+    if skipped:
+        print(f"skipped {skipped} records with a different bitlen/mode than the index", file=sys.stderr)
+    idx.close()
+
+def cmd_query(args):
+    idx = HammingIndex(args.index)
+    if args.hash:
+        # a bare hex fingerprint has no mode: only its width can be checked
+        queries = ({"path": f"hash:{hx}", "hash": int(hx, 16), "bitlen": len(hx) * 4, "label": idx.label}
+                   for hx in args.hash)
+    else:
+        queries = iter_record_files(args.inputs or ["-"])
+    skipped = 0
+    for q in queries:
+        if idx.bitlen is not None and (q["bitlen"] != idx.bitlen or q["label"] != idx.label):
+            skipped += 1
+            continue
+        for d, m in idx.query(q["hash"], k=args.k):
+            if (not args.include_self and m["path"] == q["path"] and m.get("block") == q.get("block")
+                    and m.get("line") == q.get("line")):
+                continue
+            if args.json:
+                print(json.dumps({"distance": d,
+                                  "query": {**q, "hash": to_fixed_hex(q["hash"], idx.bitlen)},
+                                  "match": {**m, "hash": to_fixed_hex(m["hash"], idx.bitlen)}},
+                                 ensure_ascii=False))
+            else:
+                print(f"{d}\t{_ref(q)}\t{_ref(m)}")
+    if skipped:
+        print(f"skipped {skipped} queries with a different bitlen/mode than the index "
+              f"({idx.bitlen}-bit {idx.label})", file=sys.stderr)
+    idx.close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Hamming-distance near-duplicate index over SimHash output.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Add TSV/JSON fingerprint output to an index (created if missing)")
+    b.add_argument("index", help="Index file (SQLite)")
+    b.add_argument("inputs", nargs="+", help="simhash_complete_chunked.py output files ('-' for stdin)")
+    b.add_argument("--bands", type=int, default=4,
+                   help="Bands per fingerprint for a new index; queries with k < bands are exact lookups (default: 4)")
+    b.set_defaults(func=cmd_build)
+
+    q = sub.add_parser("query", help="Find indexed fingerprints within Hamming distance k")
+    q.add_argument("index", help="Index file (SQLite)")
+    q.add_argument("inputs", nargs="*", help="Output files with the query fingerprints (default: stdin)")
+    q.add_argument("--hash", action="append", metavar="HEX", help="Query a single hex fingerprint (repeatable)")
+    q.add_argument("--k", type=int, default=3, help="Maximum Hamming distance (default: 3)")
+    q.add_argument("--include-self", action="store_true", help="Also report a query's own entry (same path/block/line)")
+    q.add_argument("--json", action="store_true", help="Emit JSON lines instead of TSV")
+    q.set_defaults(func=cmd_query)
+
+    args = ap.parse_args(argv)
+    try:
+        args.func(args)
+    except ValueError as e:
+        ap.error(str(e))
+
+if __name__ == "__main__":
+    main()
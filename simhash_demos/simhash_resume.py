@@ -0,0 +1,101 @@
+"""
+Resume state for append-only inputs (JSON file, one entry per path).
+
+An entry holds everything needed to continue hashing a file at the byte offset
+where the previous run stopped: the counter vector (or the block records and the
+open block's position), the trailing bytes before the offset, and a checksum of
+the prefix. It is used only if the hashing parameters are unchanged, the file
+is at least `offset` bytes long, and the stored tail and prefix checksum still
+match; otherwise the file is hashed from the start.
+
+The prefix checksum covers every byte of the prefix, so a resumed result is
+always the one a full recompute would give: checking a resume reads the prefix
+once, sequentially, which is still far cheaper than hashing its features again.
+The checksum state reached by that check is kept and only extended over the
+appended bytes when the new entry is stored, so the prefix is not read twice.
+"""
+import hashlib, json, os
+
+STATE_VERSION = 3           # 1 stored sampled prefix checksums, 2 seeded them with the size
+READ_SIZE = 1 << 20
+
+def prefix_hasher(path, size, h=None, start=0):
+    """
+    blake2b state over the first `size` bytes of path. h: a state that already
+    covers the first `start` bytes, extended over the rest (a copy, h is not changed).
+    """
+    h = hashlib.blake2b(digest_size=16) if h is None else h.copy()
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = size - start
+        while left > 0:
+            data = f.read(min(left, READ_SIZE))
+            if not data:
+                break
+            h.update(data)
+            left -= len(data)
+    return h
+
+def prefix_digest(path, size):
+    """blake2b checksum of the first `size` bytes of path (the entry's offset is stored next to it)."""
+    return prefix_hasher(path, size).hexdigest()
+
+def read_tail(path, offset, length):
+    """The `length` bytes before offset (fewer at the start of the file)."""
+    with open(path, "rb") as f:
+        lo = max(0, offset - length)
+        f.seek(lo)
+        return f.read(offset - lo)
+
+class ResumeStore:
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.files = {}
+        self._checked = {}      # abspath -> (offset, checksum state) reached by get()
+        self.resumed = self.fresh = self.invalidated = 0
+        try:
+            with open(state_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == STATE_VERSION:
+                self.files = data["files"]
+        except FileNotFoundError:
+            pass
+
+    def get(self, path, params):
+        """The stored entry for path if it can be resumed with these params, else None."""
+        key = os.path.abspath(path)
+        entry = self.files.get(key)
+        if entry is None:
+            self.fresh += 1
+            return None
+        off = entry["offset"]
+        if (entry["params"] != params or os.path.getsize(path) < off
+                or read_tail(path, off, len(entry["tail"]) // 2).hex() != entry["tail"]):
+            self.invalidated += 1
+            return None
+        h = prefix_hasher(path, off)
+        if h.hexdigest() != entry["digest"]:
+            self.invalidated += 1
+            return None
+        self._checked[key] = (off, h)
+        self.resumed += 1
+        return entry
+
+    def put(self, path, params, entry, tail_len):
+        """Store an entry describing the first entry["offset"] bytes of path."""
+        key, off = os.path.abspath(path), entry["offset"]
+        start, h = self._checked.pop(key, (0, None))
+        if start > off:
+            start, h = 0, None
+        h = prefix_hasher(path, off, h, start)
+        entry.update(params=params, tail=read_tail(path, off, tail_len).hex(), digest=h.hexdigest())
+        self.files[key] = entry
+
+    def save(self):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "files": self.files}, f, separators=(",", ":"))
+        os.replace(tmp, self.state_path)
+
+    def summary(self):
+        return {"resumed": self.resumed, "fresh": self.fresh, "invalidated": self.invalidated}
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Count-min sketch of feature frequencies, for IDF-style SimHash weights.
+
+Features are counted by key: the low 64 bits of the feature hash the hashers
+compute anyway, so neither counting nor lookups hash a feature again. Each of
+`depth` rows maps a key to one of `width` counters by multiply-shift hashing, and
+a key's count is the minimum over its rows (collisions can only inflate it).
+Memory is fixed at depth * width * 4 bytes whatever the corpus size, and
+sketches with the same shape and feature parameters merge by adding their
+tables, so worker processes count separately and the parent sums their sketches.
+
+Weights are max(0, log((docs + 1) / (count + 1))) for a sketch of `docs` files:
+features in every file (headers, license text) or repeated throughout them
+(padding) get weight 0, features seen once the largest weight.
+
+    python simhash_sketch.py build corpus.cms /data --recursive --mode text --ngram 3 --jobs 8
+    python simhash_sketch.py merge all.cms part1.cms part2.cms
+    python simhash_sketch.py info corpus.cms
+
+(also reachable as `simhash_complete_chunked.py sketch build|merge|info ...`;
+hash with the model via `simhash_complete_chunked.py --idf corpus.cms ...`)
+"""
+import argparse, hashlib, json, math, os, sys
+
+try:
+    import numpy as np  # optional for the hashers, required here
+except ImportError:
+    np = None
+
+MAGIC = b"simhash-cms 1\n"
+DEFAULT_WIDTH = 1 << 20
+DEFAULT_DEPTH = 3
+TASK_BYTES = 64 << 20   # input bytes per counting task in build --jobs (each task returns a whole sketch)
+TASK_FILES = 256
+QUANTUM = 1 << 10       # weights are multiples of 1/QUANTUM (exact float sums)
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("count-min sketches require NumPy: pip install numpy")
+
+def _multipliers(depth, seed):
+    """Odd 64-bit multipliers, one per row, fixed by the seed."""
+    return np.array([int.from_bytes(hashlib.blake2b(f"{seed}:{r}".encode(), digest_size=8,
+                                                    person=b"simhash-cms").digest(), "big") | 1
+                     for r in range(depth)], dtype=np.uint64)
+
+class CountMinSketch:
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH, seed=0, params="", table=None, total=0, docs=0):
+        """
+        width is rounded up to a power of two. params describes the feature keys
+        (mode, bitlen, n-gram size, feature hash); sketches are only merged or used
+        for hashing with matching params. total counts keys, docs the files added.
+        """
+        _require_numpy()
+        self.bits = max(1, (width - 1).bit_length())
+        self.width, self.depth, self.seed, self.params = 1 << self.bits, depth, seed, params
+        self.table = np.zeros((depth, self.width), dtype=np.uint32) if table is None else table
+        self.total, self.docs = total, docs
+        self._mult = _multipliers(depth, seed)
+        self._shift = np.uint64(64 - self.bits)
+
+    def _index(self, r, keys):
+        return ((keys * self._mult[r]) >> self._shift).astype(np.intp)
+
+    def add(self, keys):
+        """Count a uint64 array of keys (duplicates included)."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not len(keys):
+            return
+        for r in range(self.depth):
+            idx = np.sort(self._index(r, keys))
+            first = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+            counts = np.diff(np.r_[first, len(idx)])
+            row, cells = self.table[r], idx[first]
+            row[cells] = np.minimum(row[cells] + counts.astype(np.uint64), 0xFFFFFFFF)
+        self.total += len(keys)
+
+    def estimate(self, keys):
+        """Estimated counts (uint32 array) of a uint64 array of keys."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        out = None
+        for r in range(self.depth):
+            c = self.table[r].take(self._index(r, keys))
+            out = c if out is None else np.minimum(out, c, out=out)
+        return out
+
+    def compatible(self, other):
+        return (self.width, self.depth, self.seed, self.params) == (other.width, other.depth, other.seed, other.params)
+
+    def merge(self, other):
+        """Add the counts of another sketch of the same shape, seed and params (in place)."""
+        if not self.compatible(other):
+            raise ValueError("can only merge sketches with the same width, depth, seed and params")
+        s = self.table.astype(np.uint64) + other.table
+        self.table = np.minimum(s, 0xFFFFFFFF).astype(np.uint32)
+        self.total += other.total
+        self.docs += other.docs
+        return self
+
+    def save(self, path):
+        header = {"width": self.width, "depth": self.depth, "seed": self.seed, "params": self.params,
+                  "total": self.total, "docs": self.docs}
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + json.dumps(header).encode() + b"\n")
+            f.write(self.table.astype("<u4").tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        _require_numpy()
+        with open(path, "rb") as f:
+            if f.readline() != MAGIC:
+                raise ValueError(f"{path}: not a simhash count-min sketch")
+            h = json.loads(f.readline())
+            table = np.empty((h["depth"], h["width"]), dtype="<u4")
+            if f.readinto(memoryview(table).cast("B")) != table.nbytes:
+                raise ValueError(f"{path}: truncated sketch")
+        return cls(h["width"], h["depth"], h["seed"], h["params"], table.astype(np.uint32, copy=False), h["total"],
+                   h["docs"])
+
+    def counter(self):
+        return SketchCounter(self)
+
+class SketchCounter:
+    """weight_fn that counts every key into a sketch and leaves the hashing unweighted."""
+    by_key = True
+
+    def __init__(self, sketch):
+        self.sketch = sketch
+
+    def __call__(self, keys):
+        if isinstance(keys, int):
+            self.sketch.add(np.array([keys], dtype=np.uint64))
+            return 1
+        self.sketch.add(keys)
+        return None
+
+class IdfWeights:
+    """
+    weight_fn giving each feature max(0, log((docs + 1) / (count + 1))) from a sketch
+    (docs falls back to total for sketches filled without counting files).
+    Takes feature keys (by_key): a uint64 array in the numpy engine, an int in the
+    python one. Pickles as its model path when it has one, so process pools load
+    the model once per worker instead of receiving the table with every task.
+    Weights are rounded to multiples of 1/QUANTUM, so vote sums are exact and both
+    engines break ties (bits whose votes cancel) the same way.
+    """
+    by_key = True
+
+    def __init__(self, sketch, path=None):
+        self.sketch = sketch
+        self.path = path
+        self._scale = float((sketch.docs or sketch.total) + 1)
+
+    def __call__(self, keys):
+        if isinstance(keys, int):
+            count = int(self.sketch.estimate(np.array([keys], dtype=np.uint64))[0])
+            return max(0.0, round(math.log(self._scale / (count + 1)) * QUANTUM) / QUANTUM)
+        w = np.log(self._scale / (self.sketch.estimate(keys) + 1.0))
+        return np.maximum(np.round(w * QUANTUM) / QUANTUM, 0.0)
+
+    def __reduce__(self):
+        if self.path is None:
+            return IdfWeights, (self.sketch,)
+        return load_idf, (self.path,)
+
+_LOADED = {}
+
+def load_idf(path):
+    """IdfWeights for a saved sketch, loaded once per process."""
+    path = os.path.abspath(path)
+    if path not in _LOADED:
+        _LOADED[path] = IdfWeights(CountMinSketch.load(path), path)
+    return _LOADED[path]
+
+# ---------- counting pass ----------
+def _count_into(sketch, paths, args):
+    """Add the features of paths to sketch; returns the errors of files that could not be read."""
+    from simhash_complete_chunked import count_features
+
+    errors = []
+    for p in paths:
+        try:
+            count_features(p, sketch, args)
+        except Exception as e:
+            errors.append(f"{p}: {type(e).__name__}: {e}")
+    return errors
+
+def _count_task(paths, args):
+    """Worker: a fresh sketch with the features of paths, and the errors."""
+    sketch = CountMinSketch(args.width, args.depth, args.seed, args.idf_params)
+    return sketch, _count_into(sketch, paths, args)
+
+def _tasks(paths):
+    """Group paths into counting tasks of about TASK_BYTES input or TASK_FILES files."""
+    group, size = [], 0
+    for p in paths:
+        group.append(p)
+        size += os.path.getsize(p)
+        if size >= TASK_BYTES or len(group) >= TASK_FILES:
+            yield group
+            group, size = [], 0
+    if group:
+        yield group
+
+def build_sketch(paths, args, jobs=1):
+    """
+    Count the features of paths (args: mode, bitlen, ngram, step, sample, feature_hash,
+    chunk_size, readahead, width, depth, seed, idf_params). With jobs > 1 groups of
+    files are counted in worker processes and their sketches merged here (stdin
+    is counted in this process). Returns (sketch, errors).
+    """
+    sketch = CountMinSketch(args.width, args.depth, args.seed, args.idf_params)
+    if jobs <= 1:
+        return sketch, _count_into(sketch, paths, args)
+    from concurrent.futures import ProcessPoolExecutor
+
+    errors = []
+    pending = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        def finish(fut):
+            part, errs = fut.result()
+            sketch.merge(part)
+            errors.extend(errs)
+
+        def files():
+            for p in paths:
+                if p == "-":
+                    errors.extend(_count_into(sketch, [p], args))
+                else:
+                    yield p
+
+        for group in _tasks(files()):
+            pending.append(pool.submit(_count_task, group, args))
+            if len(pending) >= 2 * jobs:
+                finish(pending.pop(0))
+        for fut in pending:
+            finish(fut)
+    return sketch, errors
+
+# ---------- CLI ----------
+def cmd_build(args):
+    from simhash_complete_chunked import idf_params, iter_input_paths
+
+    args.idf_params = idf_params(args)
+    sketch, errors = build_sketch(iter_input_paths(args.inputs, recursive=args.recursive), args,
+                                  jobs=args.jobs or os.cpu_count() or 1)
+    for e in errors:
+        print(f"skipped {e}", file=sys.stderr)
+    sketch.save(args.model)
+    print(f"{args.model}: {sketch.total} features from {sketch.docs} files "
+          f"({sketch.depth}x{sketch.width} counters, {args.idf_params})", file=sys.stderr)
+
+def cmd_merge(args):
+    out = CountMinSketch.load(args.inputs[0])
+    for p in args.inputs[1:]:
+        out.merge(CountMinSketch.load(p))
+    out.save(args.model)
+    print(f"{args.model}: {out.total} features from {len(args.inputs)} sketches", file=sys.stderr)
+
+def cmd_info(args):
+    s = CountMinSketch.load(args.model)
+    used = int(np.count_nonzero(s.table[0]))
+    print(json.dumps({"width": s.width, "depth": s.depth, "seed": s.seed, "params": s.params, "total": s.total,
+                      "docs": s.docs,
+                      "fill": round(used / s.width, 4), "max_count": int(s.table.max(initial=0))}))
+
+def main(argv=None):
+    from simhash_complete_chunked import HASH_FAMILIES
+
+    ap = argparse.ArgumentParser(description="Count-min sketches of feature frequencies for IDF-weighted SimHash.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Count the features of files/dirs into a new sketch")
+    b.add_argument("model", help="Output sketch file")
+    b.add_argument("inputs", nargs="+", help="Files/dirs/globs or '-' for stdin")
+    b.add_argument("--mode", choices=["text", "bytes"], default="bytes")
+    b.add_argument("--bitlen", type=int, default=128, help="Must match the hashing runs (feature keys depend on it)")
+    b.add_argument("--ngram", type=int, default=7)
+    b.add_argument("--step", type=int, default=1, help="[bytes] count every step-th window")
+    b.add_argument("--sample", type=int, default=1, help="[bytes] count windows kept by --sample P (as in the runs)")
+    b.add_argument("--hash", dest="feature_hash", choices=HASH_FAMILIES, default="blake2b")
+    b.add_argument("--chunk-size", type=int, default=1<<20)
+    b.add_argument("--readahead", type=int, default=4)
+    b.add_argument("--recursive", action="store_true")
+    b.add_argument("--jobs", type=int, default=1, help="Worker processes (0 = all CPUs; default: 1)")
+    b.add_argument("--width", type=int, default=DEFAULT_WIDTH,
+                   help=f"Counters per row, rounded up to a power of two (default: {DEFAULT_WIDTH})")
+    b.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help=f"Rows (default: {DEFAULT_DEPTH})")
+    b.add_argument("--seed", type=int, default=0)
+    b.set_defaults(func=cmd_build)
+
+    m = sub.add_parser("merge", help="Sum sketches built with the same shape and parameters")
+    m.add_argument("model", help="Output sketch file")
+    m.add_argument("inputs", nargs="+", help="Sketch files")
+    m.set_defaults(func=cmd_merge)
+
+    i = sub.add_parser("info", help="Print a sketch's parameters as JSON")
+    i.add_argument("model")
+    i.set_defaults(func=cmd_info)
+
+    args = ap.parse_args(argv)
+    try:
+        args.func(args)
+    except (RuntimeError, ValueError) as e:
+        ap.error(str(e))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Runtime instrumentation for --stats and --profile.
+
+--stats hashes each input file with a Stats object active (the STATS global of
+simhash_complete_chunked). The hot paths add to it once per read call, batch or
+chunk (per feature only in the python engine's loops, which cost far more per
+feature anyway) and do nothing but check for None when it is off.
+Per-stage wall and CPU seconds (CPU: time.thread_time of the hashing thread):
+
+    read        inside the input's read()/readinto(): I/O, plus decompression for
+                .gz/.bz2/.xz without readahead (memory-mapped plain files make no
+                read calls; their page faults land in features)
+    decompress  decompressing on readahead threads, overlapping the other stages
+                (wall only, summed over threads)
+    features    n-gram/token extraction and feature hashing: the rest of the time
+                spent producing the file's records
+    accumulate  adding the bit votes of each batch (numpy engine). The python
+                engine adds each feature's votes right after hashing it, too finely
+                interleaved to time apart: there accumulate is reported as n/a
+                (null in JSON) and features includes it
+    output      formatting and writing records (whole run only, in the main process)
+
+Counters: bytes_in (bytes of the input as stored, compressed or not), bytes (bytes
+hashed after decompression), features (n-grams hashed). With --split-file the
+blocks are hashed in worker processes, so a file's stats only hold its wall time.
+
+--profile PATH runs everything under cProfile and writes pstats data to PATH;
+each --jobs worker process writes its own PATH.<pid> (pstats.Stats(*files) merges them).
+"""
+import cProfile, os, time
+from contextlib import contextmanager
+
+STAGES = ("read", "decompress", "features", "accumulate", "output")
+_MEASURED = ("total", "read", "accumulate", "output")   # features = total - read - accumulate
+
+class Stats:
+    def __init__(self):
+        self.accumulated = False    # the accumulate stage was timed (numpy engine)
+        self.files = 0
+        self.bytes_in = self.bytes = self.features = 0
+        self.decompress = 0.0
+        self.wall = dict.fromkeys(_MEASURED, 0.0)
+        self.cpu = dict.fromkeys(_MEASURED, 0.0)
+
+    @contextmanager
+    def stage(self, name):
+        if name == "accumulate":
+            self.accumulated = True
+        w0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.wall[name] += time.perf_counter() - w0
+            self.cpu[name] += time.thread_time() - c0
+
+    def counted(self, items):
+        """items, counting each one as a feature (the python engine's per-feature loops)."""
+        for x in items:
+            self.features += 1
+            yield x
+
+    def reader(self, path, fh, mapped):
+        """open_binary's hook: count the input and time its read calls (mapped readers have none)."""
+        if mapped:
+            n = fh.end - fh.pos
+            self.bytes_in += n
+            self.bytes += n
+            return fh
+        if path != "-":
+            self.bytes_in += os.path.getsize(path)
+        return TimedReader(fh, self, stdin=path == "-")
+
+    def report(self, elapsed=None):
+        """
+        The counters as a JSON-ready dict. elapsed: wall time of the whole run, used for
+        the throughput instead of the summed per-file times (which overlap with --jobs).
+        """
+        wall, cpu = self.wall, self.cpu
+        acc = self.accumulated or None      # None: not measured (python engine)
+        wall_stages = {"read": wall["read"], "decompress": self.decompress,
+                       "features": max(0.0, wall["total"] - wall["read"] - wall["accumulate"]),
+                       "accumulate": acc and wall["accumulate"], "output": wall["output"]}
+        cpu_stages = {"read": cpu["read"], "features": max(0.0, cpu["total"] - cpu["read"] - cpu["accumulate"]),
+                      "accumulate": acc and cpu["accumulate"], "output": cpu["output"]}
+        secs = elapsed if elapsed is not None else wall["total"]
+        out = {"files": self.files, "bytes_in": self.bytes_in, "bytes": self.bytes, "features": self.features,
+               "wall": round(secs, 6), "cpu": round(cpu["total"] + cpu["output"], 6),
+               "wall_stages": {k: None if v is None else round(v, 6) for k, v in wall_stages.items()},
+               "cpu_stages": {k: None if v is None else round(v, 6) for k, v in cpu_stages.items()},
+               "mb_s": round(self.bytes / secs / 1e6, 3) if secs else None,
+               "features_s": round(self.features / secs) if secs else None}
+        return out
+
+    def add(self, rep):
+        """Sum a file's report() (as carried by its last record) into these totals."""
+        if not rep:
+            return
+        self.files += rep["files"]
+        self.bytes_in += rep["bytes_in"]
+        self.bytes += rep["bytes"]
+        self.features += rep["features"]
+        ws, cs = rep["wall_stages"], rep["cpu_stages"]
+        self.decompress += ws["decompress"]
+        if ws["accumulate"] is not None:
+            self.accumulated = True
+        self.wall["total"] += ws["read"] + ws["features"] + (ws["accumulate"] or 0.0)
+        self.cpu["total"] += cs["read"] + cs["features"] + (cs["accumulate"] or 0.0)
+        for k in ("read", "accumulate"):
+            self.wall[k] += ws[k] or 0.0
+            self.cpu[k] += cs[k] or 0.0
+
+class TimedReader:
+    """read()/readinto() wrapper that charges the calls to the "read" stage and counts the bytes."""
+    def __init__(self, fh, stats, stdin=False):
+        self.fh = fh
+        self.stats = stats
+        self.stdin = stdin
+        if hasattr(fh, "readinto"):
+            self.readinto = self._readinto
+
+    def read(self, size=-1):
+        with self.stats.stage("read"):
+            data = self.fh.read(size)
+        self._got(len(data))
+        return data
+
+    def _readinto(self, b):
+        with self.stats.stage("read"):
+            got = self.fh.readinto(b) or 0
+        self._got(got)
+        return got
+
+    def _got(self, n):
+        self.stats.bytes += n
+        if self.stdin:
+            self.stats.bytes_in += n
+
+    def close(self):
+        self.fh.close()
+        self.stats.decompress += getattr(self.fh, "decompress_time", 0.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_PROFILER = None
+
+@contextmanager
+def profiling(path, worker=False):
+    """
+    Run the body under cProfile (nothing if path is None) and write the profile so far
+    to path, or to path.<pid> in worker processes, where it accumulates over tasks.
+    """
+    global _PROFILER
+    if not path:
+        yield
+        return
+    if _PROFILER is None:
+        _PROFILER = cProfile.Profile()
+    _PROFILER.enable()
+    try:
+        yield
+    finally:
+        _PROFILER.disable()
+        _PROFILER.dump_stats(f"{path}.{os.getpid()}" if worker else path)
@@ -0,0 +1,173 @@
+"""
+Input walker for large directory trees.
+
+os.scandir instead of Path.rglob + is_file(): the file type comes with the
+directory entry, so plain walks need one stat per directory, not per file (files
+are only stat'ed for size filters and symlinks). Subtrees are scanned by a pool
+of threads (scandir/stat release the GIL) that feed a bounded queue, so hashing
+starts while the walk is still running. Files found in directories that were
+already seen by (device, inode), i.e. hardlinked or symlinked copies, are skipped;
+paths named explicitly (and glob matches) are always yielded, like before.
+
+Globs without a '/' match the file or directory name, globs with one match the
+path relative to the walked directory. Excluded directories are not descended.
+"""
+import fnmatch, os, queue, re, sys, threading
+from pathlib import Path
+
+WALK_QUEUE = 256        # per-directory batches of paths buffered ahead of the hashers
+
+_DONE = object()
+
+def _compile(globs, with_slash):
+    pats = [fnmatch.translate(g) for g in globs if ("/" in g) == with_slash]
+    return re.compile("|".join(pats)) if pats else None
+
+class Walker:
+    def __init__(self, include=(), exclude=(), min_size=None, max_size=None, dedup=True, threads=1,
+                 queue_size=WALK_QUEUE, on_error=None):
+        self.include = bool(include)
+        self._inc_name, self._inc_path = _compile(include, False), _compile(include, True)
+        self._exc_name, self._exc_path = _compile(exclude, False), _compile(exclude, True)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.dedup = dedup
+        self.threads = max(1, threads)
+        self.queue_size = queue_size
+        self.on_error = on_error or (lambda e: print(f"walk: {e}", file=sys.stderr))
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.dirs = self.files = self.filtered = self.duplicates = self.errors = 0
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    @staticmethod
+    def _match(name_rx, path_rx, name, rel):
+        return bool((name_rx and name_rx.match(name)) or (path_rx and path_rx.match(rel)))
+
+    def _first_time(self, dev, ino):
+        if not self.dedup:
+            return True
+        key = (dev << 64) | ino
+        with self._lock:
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen.add(key)
+            return True
+
+    def _accept(self, entry, rel, dev):
+        """Filters and hardlink de-duplication for a regular file found under a directory."""
+        if ((self.include and not self._match(self._inc_name, self._inc_path, entry.name, rel))
+                or self._match(self._exc_name, self._exc_path, entry.name, rel)):
+            self._count("filtered")
+            return False
+        ino = entry.inode()
+        if self.min_size is not None or self.max_size is not None or entry.is_symlink():
+            st = entry.stat()
+            if ((self.min_size is not None and st.st_size < self.min_size)
+                    or (self.max_size is not None and st.st_size > self.max_size)):
+                self._count("filtered")
+                return False
+            dev, ino = st.st_dev, st.st_ino
+        return self._first_time(dev, ino)
+
+    def walk(self, paths, recursive=False):
+        """
+        Yield input paths: '-' and existing files as given (repeats included), the
+        (filtered, de-duplicated) files of directories, recursively with recursive=True,
+        and glob matches for other arguments.
+        """
+        for p in paths:
+            if p == "-":
+                yield p
+            elif os.path.isdir(p):
+                yield from self._walk_dir(p, recursive)
+            elif os.path.exists(p):
+                yield p
+            else:
+                # allow globs passed unexpanded on Windows/powershell
+                for q in Path().glob(str(p)):
+                    if q.is_file():
+                        yield str(q)
+
+    def _scan(self, root, path, rel, recursive, emit, push):
+        found = []
+        try:
+            dev = os.stat(path).st_dev
+            with os.scandir(path) as it:
+                for entry in it:
+                    child = f"{rel}/{entry.name}" if rel else entry.name
+                    child_path = child if root == "." else os.path.join(root, child)    # as Path() would print it
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not self._match(self._exc_name, self._exc_path, entry.name, child):
+                                push((child_path, child))
+                        elif entry.is_file() and self._accept(entry, child, dev):
+                            found.append(child_path)
+                    except OSError as e:
+                        self._count("errors")
+                        self.on_error(e)
+            self._count("dirs")
+        except OSError as e:
+            self._count("errors")
+            self.on_error(e)
+        if found:
+            with self._lock:
+                self.files += len(found)
+            emit(found)
+
+    def _walk_dir(self, root, recursive):
+        root = str(Path(root))
+        dirs = queue.LifoQueue()        # depth first keeps the frontier small
+        out = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        pending = [1]                   # directories queued or being scanned
+        lock = threading.Lock()
+
+        def emit(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def push(item):
+            with lock:
+                pending[0] += 1
+            dirs.put(item)
+
+        def worker():
+            while True:
+                item = dirs.get()
+                if item is None:
+                    return
+                if not stop.is_set():
+                    self._scan(root, *item, recursive, emit, push)
+                with lock:
+                    pending[0] -= 1
+                    finished = pending[0] == 0
+                if finished:
+                    for _ in range(self.threads):
+                        dirs.put(None)
+                    emit(_DONE)
+
+        dirs.put((root, ""))
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.threads)]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = out.get()
+                if item is _DONE:
+                    break
+                yield from item
+        finally:
+            stop.set()
+
+    def summary(self):
+        return {"dirs": self.dirs, "files": self.files, "filtered": self.filtered,
+                "duplicates": self.duplicates, "errors": self.errors}
@@ -0,0 +1,35 @@
+import json, random, subprocess, sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).parent
+OPTS = ("--bitlen", "64", "--hash", "rolling", "--json")
+
+def run(*args):
+    out = subprocess.run([sys.executable, str(HERE / "simhash_complete_chunked.py"), *OPTS, *args],
+                         capture_output=True, text=True)
+    return [json.loads(line) for line in out.stdout.splitlines()], out.stderr
+
+def test_stats_are_not_replayed_from_the_cache(tmp_path):
+    path, cache = tmp_path / "a.bin", str(tmp_path / "cache.db")
+    path.write_bytes(random.Random(1).randbytes(20_000))
+    args = (str(path), "--block-size", "4k", "--stats", "--cache", cache)
+    first, _ = run(*args)
+    second, _ = run(*args)
+    assert "stats" in first[-2] and first[-2]["cache"] == "miss"
+    assert second[-2]["cache"] == "hit" and "stats" not in second[-2]
+    assert [r["simhash_hex"] for r in first[:-1]] == [r["simhash_hex"] for r in second[:-1]]
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_error_results_are_not_cached(tmp_path, jobs):
+    pytest.importorskip("numpy")
+    path, cache = tmp_path / "a.jsonl", str(tmp_path / "cache.db")
+    path.write_text('{"text": "one two three four"}\nnot json\n{"text": "five six seven eight"}\n')
+    (tmp_path / "b.jsonl").write_text('{"text": "nine ten eleven twelve"}\n')
+    args = (str(path), str(tmp_path / "b.jsonl"), "--records", "jsonl", "--field", "text", "--engine", "numpy",
+            "--cache", cache, "--jobs", jobs)
+    for _ in range(2):
+        recs, err = run(*args)
+        assert sum("error" in r for r in recs) == 1
+    assert "1 hits, 1 misses" in err        # b.jsonl only: a.jsonl is hashed again
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from simhash_complete_chunked import pack_hashes, simhash_many, to_fixed_hex, unpack_hashes
+from simhash_daemon import HttpError, MemoryIndex, Service, call, make_server, parse_args
+
+OPTS = ["--mode", "text", "--ngram", "2", "--bitlen", "64", "--hash", "rolling"]
+DOCS = ["the quick brown fox jumps over the lazy dog", "the quick brown fox jumps over the lazy cat",
+        "lorem ipsum dolor sit amet consectetur", "an entirely different sentence about hashing"]
+
+@pytest.fixture
+def daemon(request, tmp_path):
+    """(service, address) of a daemon serving on a background thread; torn down like main() does."""
+    where = getattr(request, "param", "tcp")
+    addr = ["--socket", str(tmp_path / "d.sock")] if where == "unix" else ["--port", "0"]
+    args = parse_args(OPTS + addr + ["--batch-wait", "300"])
+    service = Service(args)
+    server, _ = make_server(args, service)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield service, args.socket or server.server_address
+    server.shutdown()
+    server.server_close()
+    service.close()
+    thread.join(5)
+    assert not thread.is_alive() and not service.batcher._thread.is_alive()
+
+def expected(docs):
+    return [to_fixed_hex(h, 64) for h in unpack_hashes(simhash_many([d.encode() for d in docs], mode="text", bitlen=64,
+                                                                   ngram=2, feature_hash="rolling"))]
+
+@pytest.mark.parametrize("daemon", ["tcp", "unix"], indirect=True)
+def test_hash_and_query_match_the_library(daemon):
+    service, addr = daemon
+    status, body = call(addr, "/hash", {"docs": [{"id": str(i), "text": d} for i, d in enumerate(DOCS)],
+                                        "add": True})
+    assert status == 200
+    hexes = [r["simhash_hex"] for r in body["results"]]
+    assert hexes == expected(DOCS)
+
+    index = MemoryIndex(64)
+    index.add([str(i) for i in range(len(DOCS))], pack_hashes([int(h, 16) for h in hexes], 64))
+    status, body = call(addr, "/query", {"hashes": hexes[:2], "k": 20})
+    assert status == 200
+    for res, row in zip(body["results"], pack_hashes([int(h, 16) for h in hexes[:2]], 64)):
+        assert [(m["id"], m["distance"]) for m in res["matches"]] == [(i, d) for d, i, _ in index.query(row, 20)]
+    assert call(addr, "/health") == (200, {"ok": True, "bitlen": 64, "label": "text+rolling", "index": len(DOCS)})
+
+def test_concurrent_requests_share_a_batch(daemon):
+    service, addr = daemon
+    start = threading.Barrier(len(DOCS))
+    out = [None] * len(DOCS)
+
+    def one(i):
+        start.wait()
+        out[i] = call(addr, "/hash", {"docs": [{"id": str(i), "text": DOCS[i]}]})
+
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(len(DOCS))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [body["results"][0]["simhash_hex"] for _, body in out] == expected(DOCS)
+    assert service.metrics.batch_docs == len(DOCS) and service.metrics.batches < len(DOCS)
+
+def test_paths_need_a_loopback_address(tmp_path):
+    f = tmp_path / "a.txt"
+    f.write_text(DOCS[0])
+    for host, allowed in (("127.0.0.1", True), ("::1", True), ("0.0.0.0", False), ("192.0.2.1", False)):
+        args = parse_args(OPTS + ["--host", host])
+        assert args.allow_paths == allowed
+    service = Service(parse_args(OPTS + ["--host", "0.0.0.0"]))
+    try:
+        with pytest.raises(HttpError) as e:
+            service.hash({"paths": [str(f)]})
+        assert e.value.status == 403
+        assert service.hash({"docs": [{"id": "a", "text": DOCS[0]}]})["results"][0]["simhash_hex"] == expected(DOCS[:1])[0]
+    finally:
+        service.close()
+    service = Service(parse_args(OPTS + ["--host", "0.0.0.0", "--allow-paths"]))
+    try:
+        assert service.hash({"paths": [str(f)]})["results"][0]["simhash_hex"] == expected(DOCS[:1])[0]
+    finally:
+        service.close()
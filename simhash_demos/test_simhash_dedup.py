@@ -0,0 +1,55 @@
+import json, random, tracemalloc
+
+import pytest
+
+from simhash_dedup import NearDupFilter, entry_bytes, main
+
+pytest.importorskip("numpy")
+
+def run(capsysbinary, tmp_path, records, *opts):
+    path = tmp_path / "in.jsonl"
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    main([str(path), "--json", *opts])
+    return [json.loads(line) for line in capsysbinary.readouterr().out.splitlines()]
+
+def test_records_without_a_time_are_errors(capsysbinary, tmp_path):
+    msg = "the quick brown fox jumps over the lazy dog " * 4
+    records = [{"ts": 1000, "msg": msg}, {"msg": msg}, {"ts": "soon", "msg": msg}, {"ts": "nan", "msg": msg},
+               {"ts": 1001, "msg": msg}, {"ts": 5000, "msg": msg}]
+    rows = run(capsysbinary, tmp_path, records, "--field", "msg", "--time-field", "ts", "--max-age", "60")
+    assert [r["decision"] for r in rows] == ["keep", "keep", "keep", "keep", "drop", "keep"]
+    assert [bool(r.get("error")) for r in rows] == [False, True, True, True, False, False]
+    assert rows[4]["match"] == 1
+
+@pytest.mark.parametrize("bitlen,k", [(64, 3), (64, 7), (128, 7), (256, 15)])
+def test_max_memory_budget_holds(bitlen, k):
+    budget = 4 << 20
+    n = budget // entry_bytes(bitlen, k)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        flt = NearDupFilter(bitlen=bitlen, k=k, max_items=n)
+        rng = random.Random(1)
+        for i in range(n + 100):
+            flt._insert(rng.getrandbits(bitlen), i, 0.0)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(flt) == n
+    assert used <= budget
+
+@pytest.mark.parametrize("bitlen,k", [(64, 3), (64, 7), (64, 12), (128, 15), (60, 9), (8, 3)])
+def test_lookup_finds_the_nearest_within_k(bitlen, k):
+    rng = random.Random(bitlen * 100 + k)
+    flt = NearDupFilter(bitlen=bitlen, k=k, max_items=5000)
+    assert flt.width >= min(bitlen, 16)
+    stored = [rng.getrandbits(bitlen) for _ in range(2000)]
+    for i, h in enumerate(stored):
+        flt._insert(h, i, 0.0)
+    for _ in range(200):
+        h = rng.choice(stored)
+        for b in rng.sample(range(bitlen), rng.randrange(k + 3)):
+            h ^= 1 << b
+        want = min((bin(h ^ s).count("1") for s in stored), default=None)
+        got = flt.lookup(h)
+        assert (got and got[0]) == (want if want <= k else None)
@@ -0,0 +1,75 @@
+import io, json, random
+
+import pytest
+
+from simhash_delta import BufferReader, Manifest, apply_patch, make_patch, write_manifest
+
+def params(**kw):
+    p = {"path": "-", "bitlen": 64, "ngram": 5, "step": 1, "hash": "rolling", "chunking": "cdc", "block_size": 256,
+         "cdc_min": None, "cdc_max": None}
+    p.update(kw)
+    return p
+
+def roundtrip(tmp_path, old, new, p, with_old=False):
+    """Manifest of old, patch to new, apply; returns (manifest lines, patch bytes, rebuilt bytes)."""
+    text = io.StringIO()
+    write_manifest(io.BytesIO(old), text, p)
+    (tmp_path / "old.manifest").write_text(text.getvalue())
+    (tmp_path / "old.bin").write_bytes(old)
+    patch = io.BytesIO()
+    with open(tmp_path / "old.bin", "rb") as base:
+        make_patch(Manifest(str(tmp_path / "old.manifest")), io.BytesIO(new), patch,
+                   base=base if with_old else None, k=16)
+        out = io.BytesIO()
+        apply_patch(base, io.BytesIO(patch.getvalue()), out)
+    return [json.loads(line) for line in text.getvalue().splitlines()], patch.getvalue(), out.getvalue()
+
+@pytest.mark.parametrize("old,new", [
+    (b"", b""),
+    (b"", b"abc"),
+    (b"abcde", b""),
+    (b"abcde", b"abc"),             # both shorter than an n-gram
+    (b"abc", b"abcdefgh"),
+])
+def test_short_and_empty(tmp_path, old, new):
+    lines, _, out = roundtrip(tmp_path, old, new, params())
+    assert out == new
+    assert lines[-1]["size"] == len(old)
+
+@pytest.mark.parametrize("p", [
+    params(chunking="fixed", block_size=16, step=64),                  # most blocks get no n-gram
+    params(chunking="cdc", block_size=4, cdc_min=1, ngram=7),          # cuts before the first full window
+    params(chunking="fixed", block_size=100, ngram=7, step=3),
+])
+def test_blocks_cover_every_byte(tmp_path, p):
+    rng = random.Random(3)
+    old = rng.randbytes(5000)
+    new = old[:1234] + rng.randbytes(50) + old[1300:]
+    lines, _, out = roundtrip(tmp_path, old, new, p)
+    assert out == new
+    blocks = lines[1:-1]
+    assert [b["start"] for b in blocks] == [0] + [b["end"] for b in blocks[:-1]]
+    assert blocks[-1]["end"] == lines[-1]["size"] == len(old)
+
+def test_patch_carries_only_the_change(tmp_path):
+    rng = random.Random(5)
+    old = rng.randbytes(200_000)
+    new = old[:50_000] + rng.randbytes(1000) + old[50_000:150_000] + old[151_000:]
+    _, patch, out = roundtrip(tmp_path, old, new, params(block_size=4096), with_old=True)
+    assert out == new
+    assert len(patch) < 20_000
+
+def test_wrong_base_is_rejected(tmp_path):
+    old = random.Random(7).randbytes(10_000)
+    _, patch, _ = roundtrip(tmp_path, old, old[:5000] + b"x" + old[5000:], params())
+    bad = bytearray(old)
+    bad[100] ^= 1
+    with pytest.raises(ValueError):
+        apply_patch(io.BytesIO(bytes(bad)), io.BytesIO(patch), io.BytesIO())
+
+def test_mapped_input_matches_stream(tmp_path):
+    data = random.Random(9).randbytes(3000)
+    a, b = io.StringIO(), io.StringIO()
+    write_manifest(io.BytesIO(data), a, params())
+    write_manifest(BufferReader(data), b, params())
+    assert a.getvalue() == b.getvalue()
@@ -0,0 +1,50 @@
+import random, time
+
+from simhash_index import HammingIndex, main
+
+def fingerprints(n, bitlen, seed=1):
+    rng = random.Random(seed)
+    return [rng.getrandbits(bitlen) for _ in range(n)]
+
+def write_tsv(path, hashes, bitlen, label):
+    with open(path, "w") as f:
+        for i, h in enumerate(hashes):
+            f.write(f"{h:0{bitlen // 4}x}\t{bitlen}\t{label}\tdoc{i}\n")
+
+def test_query_skips_incompatible_records(tmp_path, capsys):
+    hashes = fingerprints(20, 128)
+    write_tsv(tmp_path / "a.tsv", hashes, 128, "bytes")
+    write_tsv(tmp_path / "q64.tsv", [h >> 64 for h in hashes], 64, "bytes")
+    write_tsv(tmp_path / "qroll.tsv", hashes, 128, "bytes+rolling")
+    idx = str(tmp_path / "a.idx")
+    main(["build", idx, str(tmp_path / "a.tsv")])
+    capsys.readouterr()
+    main(["query", idx, str(tmp_path / "q64.tsv"), str(tmp_path / "qroll.tsv"), "--k", "3", "--include-self"])
+    out, err = capsys.readouterr()
+    assert out == ""
+    assert "skipped 40 queries" in err
+    main(["query", idx, "--hash", f"{hashes[0]:032x}", "--hash", f"{hashes[0] >> 64:016x}"])
+    out, err = capsys.readouterr()
+    assert out.startswith("0\thash:") and len(out.splitlines()) == 1
+    assert "skipped 1 queries" in err
+
+def test_large_k_scans_instead_of_enumerating(tmp_path):
+    hashes = fingerprints(200, 128, seed=2)
+    idx = HammingIndex(str(tmp_path / "b.idx"), bands=4)
+    idx.add({"path": f"doc{i}", "hash": h, "bitlen": 128, "label": "bytes"} for i, h in enumerate(hashes))
+    t0 = time.perf_counter()
+    got = idx.query(hashes[0], k=60)
+    assert time.perf_counter() - t0 < 5
+    want = sorted(bin(h ^ hashes[0]).count("1") for h in hashes if bin(h ^ hashes[0]).count("1") <= 60)
+    assert [d for d, _ in got] == want
+
+def test_small_k_matches_brute_force(tmp_path):
+    base = fingerprints(50, 64, seed=3)
+    rng = random.Random(4)
+    near = [h ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for h in base]
+    idx = HammingIndex(str(tmp_path / "c.idx"), bands=4)
+    idx.add({"path": f"doc{i}", "hash": h, "bitlen": 64, "label": "bytes"} for i, h in enumerate(base + near))
+    for k in (0, 2, 5, 9):
+        for h in base[:10]:
+            want = sorted(d for d in (bin(h ^ x).count("1") for x in base + near) if d <= k)
+            assert [d for d, _ in idx.query(h, k=k)] == want
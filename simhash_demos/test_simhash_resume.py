@@ -0,0 +1,77 @@
+import random, subprocess, sys
+from pathlib import Path
+
+import pytest
+
+import simhash_resume
+from simhash_resume import ResumeStore, prefix_digest
+
+HERE = Path(__file__).parent
+OPTS = ("--bitlen", "64", "--engine", "numpy", "--hash", "rolling")
+
+def run(*args):
+    out = subprocess.run([sys.executable, str(HERE / "simhash_complete_chunked.py"), *args],
+                         check=True, capture_output=True, text=True)
+    return out.stdout.split("\t")[0], out.stderr
+
+def test_edit_between_samples_is_not_resumed(tmp_path):
+    pytest.importorskip("numpy")
+    data = bytearray(random.Random(1).randbytes(1 << 20))
+    path, state = tmp_path / "log.bin", str(tmp_path / "state.json")
+    path.write_bytes(data)
+    run(str(path), *OPTS, "--resume", state)
+    # in place, same size: away from the head/tail and from the old 1/16 sample points
+    data[(1 << 20) * 5 // 32] ^= 0xFF
+    data += b"appended"
+    path.write_bytes(data)
+    resumed, err = run(str(path), *OPTS, "--resume", state)
+    assert "1 invalidated" in err
+    full, _ = run(str(path), *OPTS)
+    assert resumed == full
+
+def test_append_is_resumed(tmp_path):
+    pytest.importorskip("numpy")
+    data = random.Random(2).randbytes(1 << 20)
+    path, state = tmp_path / "log.bin", str(tmp_path / "state.json")
+    path.write_bytes(data)
+    run(str(path), *OPTS, "--resume", state)
+    path.write_bytes(data + b"more data")
+    resumed, err = run(str(path), *OPTS, "--resume", state)
+    assert "1 resumed" in err
+    full, _ = run(str(path), *OPTS)
+    assert resumed == full
+
+def test_resume_reads_the_prefix_once(tmp_path, monkeypatch):
+    size, more = 3 << 20, 1000
+    path, state = tmp_path / "log.bin", str(tmp_path / "state.json")
+    path.write_bytes(random.Random(3).randbytes(size))
+    store = ResumeStore(state)
+    store.get(str(path), {})
+    store.put(str(path), {}, {"offset": size}, tail_len=4)
+    store.save()
+    with open(path, "ab") as f:
+        f.write(b"x" * more)
+
+    read = []
+    class Counted:
+        def __init__(self, f):
+            self.f = f
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            self.f.close()
+        def seek(self, pos):
+            self.f.seek(pos)
+        def read(self, n):
+            data = self.f.read(n)
+            read.append(len(data))
+            return data
+    monkeypatch.setattr(simhash_resume, "open", raising=False,
+                        value=lambda p, mode="r", **kw: Counted(open(p, mode)) if mode == "rb" else open(p, mode, **kw))
+    store = ResumeStore(state)
+    entry = store.get(str(path), {})
+    assert entry is not None
+    store.put(str(path), {}, {"offset": size + more}, tail_len=4)
+    assert sum(read) <= size + more + 2 * 4
+    monkeypatch.undo()
+    assert store.files[str(path.resolve())]["digest"] == prefix_digest(str(path), size + more)
@@ -0,0 +1,36 @@
+import random, subprocess, sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("numpy")
+
+HERE = Path(__file__).parent
+
+def run(*args, check=True):
+    return subprocess.run([sys.executable, str(HERE / "simhash_complete_chunked.py"), *args],
+                          check=check, capture_output=True, text=True)
+
+@pytest.fixture
+def data(tmp_path):
+    path = tmp_path / "d.bin"
+    path.write_bytes(random.Random(1).randbytes(64 << 10))
+    return path
+
+@pytest.mark.parametrize("built,used", [
+    (("--step", "4"), ("--step", "1")),
+    (("--sample", "8"), ()),
+    ((), ("--sample", "8")),
+])
+def test_idf_rejects_sketches_of_other_windows(tmp_path, data, built, used):
+    model = str(tmp_path / "m.cms")
+    run("sketch", "build", model, str(data), "--hash", "rolling", "--width", "1024", *built)
+    r = run(str(data), "--engine", "numpy", "--hash", "rolling", "--idf", model, *used, check=False)
+    assert r.returncode == 2
+    assert "counts features with" in r.stderr
+
+def test_idf_accepts_matching_sketch(tmp_path, data):
+    model = str(tmp_path / "m.cms")
+    run("sketch", "build", model, str(data), "--hash", "rolling", "--width", "1024", "--step", "4")
+    r = run(str(data), "--engine", "numpy", "--hash", "rolling", "--idf", model, "--step", "4")
+    assert r.stdout.count("\t") >= 3
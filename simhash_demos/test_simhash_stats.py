@@ -0,0 +1,24 @@
+import json, subprocess, sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).parent
+
+def stats(tmp_path, *opts):
+    f = tmp_path / "a.txt"
+    f.write_text("the quick brown fox jumps over the lazy dog " * 50)
+    out = subprocess.run([sys.executable, str(HERE / "simhash_complete_chunked.py"), str(f), "--json", "--stats",
+                          "--bitlen", "64", "--hash", "rolling", *opts], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.splitlines()[-1])["stats"], out.stderr
+
+def test_python_engine_reports_accumulate_as_not_measured(tmp_path):
+    st, err = stats(tmp_path, "--engine", "python")
+    assert st["wall_stages"]["accumulate"] is None and st["cpu_stages"]["accumulate"] is None
+    assert "accumulate n/a" in err
+
+def test_numpy_engine_times_accumulate(tmp_path):
+    pytest.importorskip("numpy")
+    st, err = stats(tmp_path, "--engine", "numpy")
+    assert st["wall_stages"]["accumulate"] is not None
+    assert "accumulate n/a" not in err
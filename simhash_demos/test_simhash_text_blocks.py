@@ -0,0 +1,26 @@
+import pytest
+
+from simhash_complete_chunked import WORD_RE, np, simhash_text, simhash_text_blocks
+
+TEXT = ("İSTANBUL İstanbul istanbul ΣΟΦΟΣ σοφος Straße STRASSE ǅemal ǄEMAL ΌΣΟΣ İİİ\n" * 40
+        + "ﬁnal Kelvin K MİXED-case İ-dot\n" * 20)
+
+ENGINES = ["python"] + (["numpy"] if np is not None else [])
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("chunk_size", [7, 64, 1 << 20])
+def test_file_record_matches_simhash_text(tmp_path, engine, chunk_size):
+    path = tmp_path / "tr.txt"
+    path.write_text(TEXT, encoding="utf-8")
+    whole = simhash_text(str(path), bitlen=64, ngram=2, engine=engine)
+    records = list(simhash_text_blocks(str(path), bitlen=64, ngram=2, block_tokens=50, chunk_size=chunk_size,
+                                       engine=engine, file_record=True))
+    assert records[-1]["hash"] == whole
+    assert sum(r["tokens"] for r in records[:-1]) == len(WORD_RE.findall(TEXT.lower()))
+
+def test_offsets_point_into_the_original_text(tmp_path):
+    path = tmp_path / "tr.txt"
+    path.write_text(TEXT, encoding="utf-8")
+    data = path.read_bytes()
+    for r in simhash_text_blocks(str(path), bitlen=64, ngram=2, block_tokens=7, chunk_size=5):
+        assert data[r["start"]:r["end"]].decode("utf-8") == TEXT[r["char_start"]:r["char_end"]]
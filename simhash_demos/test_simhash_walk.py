@@ -0,0 +1,25 @@
+import os, subprocess, sys
+from pathlib import Path
+
+from simhash_walk import Walker
+
+HERE = Path(__file__).parent
+
+def test_repeated_explicit_paths_are_all_yielded(tmp_path):
+    f = tmp_path / "a.bin"
+    f.write_bytes(b"some bytes to hash")
+    os.link(f, tmp_path / "b.bin")
+    paths = [str(f), str(f), str(tmp_path / "b.bin")]
+    assert list(Walker().walk(paths)) == paths
+    out = subprocess.run([sys.executable, str(HERE / "simhash_complete_chunked.py"), "--bitlen", "64",
+                          "--hash", "rolling", str(f), str(f)], capture_output=True, text=True, check=True)
+    assert len(out.stdout.splitlines()) == 2
+
+def test_hardlinks_in_directories_are_walked_once(tmp_path):
+    (tmp_path / "d").mkdir()
+    f = tmp_path / "d" / "a.bin"
+    f.write_bytes(b"x")
+    os.link(f, tmp_path / "d" / "b.bin")
+    walker = Walker()
+    assert len(list(walker.walk([str(tmp_path / "d")]))) == 1 and walker.duplicates == 1
+    assert len(list(Walker(dedup=False).walk([str(tmp_path / "d")]))) == 2